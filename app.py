@@ -1,36 +1,84 @@
+from startup import StartupTimer
+
+startup = StartupTimer()  # 需在其他 import 之前建立，才能量到模組載入時間
+
+from collections import Counter
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse, JSONResponse
+from functools import lru_cache
+from datetime import datetime
+from typing import AsyncIterator
+from fastapi import FastAPI, Header, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.exceptions import HTTPException as StarletteHTTPException
 
-from depot import AsyncDepot, DepotItem, DepotError
-import markdown
+from bus import create_bus
+from depot import AsyncDepot, DepotItem, DepotError, MONGO_ADDR, _log_operation
+from forecast import Forecaster
+from page_cache import PageCache
+from readings import ReadingTable
+from record_buffer import RecordBuffer
+from registry import ItemRegistry
+from search import ItemIndex
 import asyncio
-import httpx
 import json
+import os
 import time
 
+startup.mark("imports")
+
 
 # ---- 應用生命週期管理 ----
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # 應用啟動時的初始化操作
-    await depot.tool.clear_inventory(double_check=True)  # 初始化清空倉庫
+    # 應用啟動時的初始化操作（資料庫連線在這裡建立，import 時不連線）
+    with startup.phase("storage"):
+        await depot.storage.start()  # 建立索引、本地日誌的 fsync / 斷線重播等背景工作
+        await bus.start()  # 接收其他 worker 的事件
+    with startup.phase("inventory"):
+        if STORAGE_CONFIG.get("startup", "warm") == "clear":
+            await depot.tool.clear_inventory(double_check=True)  # 清空並重新插入預設物品
+        else:  # 保留庫存，只補上缺少的預設物品並以最近快照驗證
+            repair = STORAGE_CONFIG.get("repair_drift", False)
+            await depot.tool.warm_start(repair=repair)
+    with startup.phase("page_cache"):
+        page_cache.warm(  # 預先渲染並壓縮靜態頁面（首頁含 README，第一次請求時才渲染）
+            app,
+            [CONFIG["url"]["web"], CONFIG["url"]["web_local"]],
+            [
+                ("base.html", {"side_items": SIDE_ITEMS}, STATIC_PAGE),
+                ("live.html", {}, STATIC_PAGE),
+                ("status.html", STATUS_CONTEXT, STATIC_PAGE),
+                ("404.html", {}, STATIC_PAGE),
+            ],
+        )
+    startup.log()
+    retention = asyncio.create_task(retention_loop())  # 每日封存舊紀錄
+    item_watch = asyncio.create_task(item_config_loop())  # 監看 item_id.json
     yield
-    # 應用關閉時的清理操作（如果需要）
+    # 應用關閉時的清理操作
+    retention.cancel()
+    item_watch.cancel()
+    await bus.close()
+    if depot.record_buffer is not None:
+        await depot.record_buffer.close()  # 寫入尚在緩衝中的紀錄
+    await depot.storage.close()
 
 
 # ---- 初始化配置 ----
 CONFIG = json.load(open("./config/server_config.json", "r", encoding="utf-8"))
-ITEM_ID = json.load(open("./config/item_id.json", "r", encoding="utf-8"))
+STORAGE_CONFIG = CONFIG.get("storage", {})
+MENU_CONFIG = CONFIG.get("menu", {})
+registry = ItemRegistry()  # config/item_id.json（變更後自動套用）
 app = FastAPI(openapi_url=None, docs_url=None, redoc_url=None, lifespan=lifespan)
 # app.mount("/static", StaticFiles(directory="static"), name="static")  # 掛載靜態資源
 templates = Jinja2Templates(
     directory=("templates" if not CONFIG.get("new_ui", False) else "new_templates")
 )  # 模板目錄
+stream_env = templates.env.overlay(enable_async=True)  # 逐段渲染大量資料的頁面
+page_cache = PageCache(templates)  # 靜態頁面渲染快取
 app.add_middleware(  # 允許跨網域讀資源
     CORSMiddleware,
     allow_origins=[CONFIG["url"]["line"], CONFIG["url"]["line_local"]],
@@ -39,27 +87,55 @@ app.add_middleware(  # 允許跨網域讀資源
 )
 
 # ---- 全域物件初始化 ----
-depot = AsyncDepot()
+depot = AsyncDepot(seed_items=False)  # 預設物品由 lifespan 補上
+if STORAGE_CONFIG.get("write_behind"):  # 紀錄集中後批次寫入
+    depot.record_buffer = RecordBuffer(depot.storage, **STORAGE_CONFIG["write_behind"])
+bus = create_bus(CONFIG.get("bus", {}), MONGO_ADDR)  # worker 之間共享 ESP / 庫存 / 狀態事件
 status_cache: list | None = None  # status狀態快取
 status_cache_lock = asyncio.Lock()
 status_last_time = time.time()  # status頁狀態-最後刷新時間
 esp_do_depot_last = {}  # 暫存上次紀錄
+readings = ReadingTable(registry.config)  # ESP32 最新讀數 (/api/data)
+forecaster = Forecaster()  # 消耗預測與補貨點 (/api/forecast)
+item_index = ItemIndex()  # 物品名稱搜尋 (/api/items/search)
+route_misses: Counter[str] = Counter()  # 404 次數 (路徑 -> 次數)
+ROUTE_MISS_LIMIT = 1000  # 最多記錄的路徑數，超過的歸入 "<other>"
+NOT_FOUND_JSON = b'{"detail":"Not Found"}'
+SIDE_ITEMS = [  # 側邊欄項目
+    {"name": "首頁", "endpoint": "home"},
+    {"name": "ESP32即時顯示", "endpoint": "esp_live"},
+    {"name": "倉庫", "endpoint": "inventory"},
+    {"name": "出/入貨物", "endpoint": "stock_input"},
+    {"name": "貨物紀錄", "endpoint": "records"},
+    {"name": "狀態", "endpoint": "status_page"},
+]
+STATIC_PAGE = "static"  # page_cache 版本: context 在行程內不變的頁面
+STATUS_CONTEXT = {  # 狀態頁初始內容，實際狀態由 /status/data 取得
+    "results": [{"name": "連線中", "url": "------連線中------"}],
+    "framework": "FastAPI",
+}
 
 
 class ConnectionManager:
     """連線管理器, 維護瀏覽器客戶端連線與 ESP32 狀態"""
 
     def __init__(self):
-        self.clients: list[WebSocket] = []
+        self.clients: list[WebSocket] = []  # ESP 即時資料訂閱者
+        self.inventory_clients: list[WebSocket] = []  # 庫存變動訂閱者
         self.esp_connected: bool = False
 
-    async def connect_client(self, websocket: WebSocket):
+    async def connect_client(self, websocket: WebSocket, topic: str = "esp"):
         await websocket.accept()
-        self.clients.append(websocket)
+        if topic == "inventory":
+            self.inventory_clients.append(websocket)
+        else:
+            self.clients.append(websocket)
 
     def disconnect_client(self, websocket: WebSocket):
         if websocket in self.clients:
             self.clients.remove(websocket)
+        if websocket in self.inventory_clients:
+            self.inventory_clients.remove(websocket)
 
     async def broadcast(self, message: str):
         for connection in self.clients:
@@ -75,10 +151,30 @@ class ConnectionManager:
             except:
                 pass
 
+    async def broadcast_inventory(self, event: dict):
+        """推送庫存變動給庫存頁面"""
+        message = json.dumps({"type": "inventory", **event}, ensure_ascii=False)
+        for connection in self.inventory_clients:
+            try:
+                await connection.send_text(message)
+            except:
+                pass
+
+
+def readme_version() -> str:
+    """README.md 的修改時間（首頁快取的版本，修改後重新轉換）"""
+    try:
+        return str(os.stat("README.md").st_mtime_ns)
+    except OSError:
+        return ""
+
 
-def readme_to_html() -> str:
-    """將readme轉成html"""
+@lru_cache(maxsize=1)
+def readme_to_html(version: str = "") -> str:
+    """將readme轉成html（第一次開啟首頁時才載入 markdown 並轉換，version 為快取鍵）"""
     try:
+        import markdown
+
         with open("README.md", "r", encoding="utf-8") as f:
             readme_md = f.read()
         return markdown.markdown(readme_md)
@@ -86,46 +182,73 @@ def readme_to_html() -> str:
         return "<h3>無法讀取 README.md</h3><p>目前無說明文件。</p>"
 
 
+async def publish_inventory(event: dict):
+    """Depot listener: 庫存變動發布到事件匯流排（所有 worker 都會收到）"""
+    await bus.publish("inventory", event)
+
+
+async def on_esp_frame(message: dict, local: bool):
+    """ESP32 原始資料: 推送給本 worker 的瀏覽器並更新讀數表"""
+    global esp_do_depot_last
+    await manager.broadcast(message["raw"])
+    data = json.loads(message["raw"])
+    readings.update_frame(data)
+    if not local and data.get("final", False):
+        esp_do_depot_last = data  # ESP32 改連到本 worker 時，從最新的基準繼續計算
+
+
+async def on_esp_status(message: dict, local: bool):
+    """ESP32 連線狀態"""
+    manager.esp_connected = message["esp"]
+    await manager.broadcast_json({"type": "status", "esp": message["esp"]})
+
+
+async def on_inventory(event: dict, local: bool):
+    """庫存變動（任一 worker 寫入）"""
+    await manager.broadcast_inventory(event)  # 推送給庫存頁面
+    await forecaster.observe(event)  # 出庫時累加今日消耗量
+    await item_index.observe(event)  # 更新搜尋索引
+
+
 manager = ConnectionManager()
-readme_html = readme_to_html()
+depot.add_listener(publish_inventory)
+bus.subscribe("esp", on_esp_frame)
+bus.subscribe("status", on_esp_status)
+bus.subscribe("inventory", on_inventory)
+startup.mark("app")
 
 
 # ---- 路由定義 ----
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
-    side_items = [
-        {"name": "首頁", "endpoint": "home"},
-        {"name": "ESP32即時顯示", "endpoint": "esp_live"},
-        {"name": "倉庫", "endpoint": "inventory"},
-        {"name": "出/入貨物", "endpoint": "stock_input"},
-        {"name": "貨物紀錄", "endpoint": "records"},
-        {"name": "狀態", "endpoint": "status_page"},
-    ]
-    return templates.TemplateResponse(
-        "base.html", {"request": request, "side_items": side_items}
+    return page_cache.response(
+        request, "base.html", {"side_items": SIDE_ITEMS}, version=STATIC_PAGE
     )
 
 
 @app.get("/home", response_class=HTMLResponse)
 async def home(request: Request):
     """首頁"""
-    return templates.TemplateResponse(
-        "home.html", {"request": request, "readme_html": readme_html}
+    version = readme_version()
+    return page_cache.response(
+        request, "home.html", {"readme_html": readme_to_html(version)}, version=version
     )
 
 
 @app.get("/esp", response_class=HTMLResponse, name="esp_live")
 async def esp_live(request: Request):
     """即時顯示秤重重量"""
-    return templates.TemplateResponse("live.html", {"request": request})
+    return page_cache.response(request, "live.html", version=STATIC_PAGE)
 
 
 @app.get("/inventory", response_class=HTMLResponse)
 async def inventory(request: Request):
     """倉庫庫存"""
     inv = await depot.get_inventory()
+    await forecaster.refresh(depot)
     return templates.TemplateResponse(
-        "inventory.html", {"request": request, "items": inv}
+        "inventory.html",
+        {"request": request, "items": inv, "forecast": forecaster.forecast(inv)},
     )
 
 
@@ -142,7 +265,9 @@ async def reset_inv(request: Request):
 @app.get("/records", response_class=HTMLResponse)
 async def records(request: Request):
     """進出貨紀錄 - 輸出框架網頁"""
-    table_list = sorted(await depot.date_collections, reverse=True)
+    table_list = sorted(
+        {*await depot.date_collections, *depot.archived_days}, reverse=True
+    )
     return templates.TemplateResponse(
         "records.html", {"request": request, "tables": table_list}
     )
@@ -150,19 +275,20 @@ async def records(request: Request):
 
 @app.get("/records/data", response_class=HTMLResponse)
 async def records_data(request: Request, date: str):
-    """進出貨紀錄 - 輸出紀錄"""
-    data = await depot.find_records(date)
-    return templates.TemplateResponse(
-        "records_data.html", {"request": request, "data": data, "date": date}
-    )
+    """進出貨紀錄 - 輸出紀錄（邊讀取邊渲染，先送出的列可立即顯示）"""
+    data = None
+    if depot.archive.has(date) or date in await depot.date_collections:
+        data = depot.iter_records(date)
+    template = stream_env.get_template("records_data.html")
+    parts = template.generate_async({"request": request, "data": data, "date": date})
+    return StreamingResponse(_buffered(parts), media_type="text/html; charset=utf-8")
 
 
 @app.get("/status", response_class=HTMLResponse)
 async def status_page(request: Request):
     """回傳狀態頁"""
-    results = [{"name": "連線中", "url": "------連線中------"}]
-    return templates.TemplateResponse(
-        "status.html", {"request": request, "results": results, "framework": "FastAPI"}
+    return page_cache.response(
+        request, "status.html", STATUS_CONTEXT, version=STATIC_PAGE
     )
 
 
@@ -187,6 +313,8 @@ async def status_data(request: Request):
         if (status_cache is not None) and (status_last_time + 10 > current_time):
             return JSONResponse(content={"results": status_cache})
 
+        import httpx  # 只有狀態頁使用
+
         async with httpx.AsyncClient(timeout=3.0) as client:
             for svc in services:
                 try:
@@ -208,53 +336,225 @@ async def status_data(request: Request):
             return JSONResponse(content={"results": results})
 
 
+@app.get("/api/data")
+async def api_data(request: Request, item: str, wait: float = 0):
+    """
+    物品最新秤重讀數 (item, count, weight, unit_weight, min_weight, timestamp)
+
+    帶 If-None-Match 時：讀數未變回 304；
+    另帶 wait=秒數 則為長輪詢，最多等待 30 秒直到讀數改變。
+    """
+    etag = request.headers.get("if-none-match")
+    if etag and wait > 0:
+        reading = await readings.wait_change(item, etag, min(wait, 30))
+    else:
+        reading = readings.get(item)
+
+    if reading is None:
+        return JSONResponse({"detail": f"未配置的物品: {item}"}, status_code=404)
+
+    headers = {"ETag": reading.etag, "Cache-Control": "no-cache"}
+    if reading.etag == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=reading.body, media_type="application/json", headers=headers)
+
+
+@app.get("/api/inventory")
+async def api_inventory(at: datetime | None = None):
+    """庫存數量；帶 at=ISO 時間 則由快照與紀錄還原該時間的庫存"""
+    if at is None:
+        return await depot.get_inventory()
+    if at.tzinfo is not None:  # 紀錄時間為本地時間 (naive)
+        at = at.astimezone().replace(tzinfo=None)
+    return await depot.inventory_at(at)
+
+
+@app.get("/api/records/{date}")
+async def api_records(date: str):
+    """當日紀錄 JSON（分批讀取並直接串流，不建立整天的紀錄列表）"""
+    if not depot.archive.has(date) and date not in await depot.date_collections:
+        return JSONResponse({"detail": "Not Found"}, status_code=404)
+    return StreamingResponse(depot.iter_records_json(date), media_type="application/json")
+
+
+@app.get("/api/records/{date}/rollup")
+async def api_records_rollup(date: str):
+    """每日各物品的進出彙總 (已封存的日期也可查詢)"""
+    rollup = await depot.rollup(date)
+    if rollup is None:
+        return JSONResponse({"detail": "Not Found"}, status_code=404)
+    return rollup
+
+
+@app.get("/api/items/search")
+async def api_items_search(q: str = "", limit: int = 10):
+    """品項自動完成: 前綴/子字串搜尋，依相關度返回前 limit 筆 [{item, amount}]"""
+    return item_index.search(q, min(limit, 1000))
+
+
+@app.get("/api/forecast")
+async def api_forecast():
+    """每項物品的每日消耗率、補貨點與預估剩餘天數"""
+    await forecaster.refresh(depot)
+    return forecaster.forecast(await depot.get_inventory())
+
+
+@app.get("/api/bom")
+async def api_bom():
+    """BOM 定義與展開後的原料表"""
+    return {"definitions": depot.bom.definitions, "table": depot.bom.table}
+
+
+@app.put("/api/bom/{product}")
+async def api_bom_set(product: str, components: dict[str, int]):
+    """新增或覆寫產品定義 ({零件或子產品: 數量})"""
+    try:
+        return {"product": product, "parts": depot.bom.set(product, components)}
+    except ValueError as err:
+        return JSONResponse({"detail": str(err)}, status_code=400)
+
+
+@app.delete("/api/bom/{product}")
+async def api_bom_remove(product: str):
+    """刪除產品定義"""
+    return {"removed": depot.bom.remove(product)}
+
+
+@app.get("/api/bom/{product}/buildable")
+async def api_bom_buildable(product: str):
+    """產品目前可組裝數量"""
+    try:
+        return {
+            "product": product,
+            "buildable": await depot.buildable(product),
+            "parts": depot.bom.expand(product),
+        }
+    except DepotError as err:
+        return JSONResponse({"detail": err.message}, status_code=404)
+
+
+@app.post("/api/bom/{product}/consume")
+async def api_bom_consume(
+    product: str, count: int = 1, idempotency_key: str | None = Header(default=None)
+):
+    """依 BOM 一次扣除產品所需的原料（可帶 Idempotency-Key）"""
+    try:
+        return await depot.consume_kit(product, count, "app", idempotency_key)
+    except DepotError as err:
+        return JSONResponse({"detail": err.message}, status_code=409)
+
+
+@app.get("/status/consistency")
+async def status_consistency():
+    """檢查 inventory 與紀錄重播結果是否一致 (drift 為不一致的物品)"""
+    drift = await depot.check_consistency()
+    return {"consistent": not drift, "drift": drift}
+
+
+@app.get("/status/startup")
+async def status_startup():
+    """啟動各階段耗時 (毫秒) 與新載入的模組數"""
+    return startup.report()
+
+
+@app.get("/status/misses")
+async def status_misses(top: int = 50):
+    """404 路徑統計 (次數由多到少)"""
+    return {
+        "total": route_misses.total(),
+        "paths": dict(route_misses.most_common(top)),
+    }
+
+
 @app.get("/stock/input", response_class=HTMLResponse)
 async def stock_input(request: Request):
-    """貨物進出 - 框架網頁"""
-    inv: dict = await depot.get_inventory()
-    existing_items = list(inv.keys()) if inv else None
-    return templates.TemplateResponse(
-        "stock_input.html", {"request": request, "items": existing_items}
-    )
+    """貨物進出 - 框架網頁 (品項由 /api/items/search 自動完成)"""
+    return templates.TemplateResponse("stock_input.html", {"request": request})
 
 
 @app.post("/stock/submit")
-async def stock_submit(stock_data: list[dict]):
-    """貨物進出 - 資料處理"""
+async def stock_submit(
+    stock_data: list[dict], idempotency_key: str | None = Header(default=None)
+):
+    """
+    貨物進出 - 資料處理
+
+    可帶 Idempotency-Key 標頭（整批，第 i 筆使用 "<key>:<i>"）
+    或每筆資料的 "idempotency_key" 欄位，重送時不會重複寫入。
+    """
     fail_data = []
-    for stock in stock_data:
+    replayed = 0
+    for index, stock in enumerate(stock_data):
+        key = stock.get("idempotency_key") or (
+            f"{idempotency_key}:{index}" if idempotency_key else None
+        )
         try:
-            await depot.write(
-                DepotItem(stock["type"], stock["item"], stock["amount"]), source="app"
+            result = await depot.write(
+                DepotItem(stock["type"], stock["item"], stock["amount"]),
+                source="app",
+                idempotency_key=key,
             )
+            replayed += result.get("replayed", False)
         except DepotError as err:
             fail_data.append(str(err))
         except Exception as err:
             fail_data.append(str(err))
     if not fail_data:
-        return {"status": "success", "message": f"共{len(stock_data)}筆資料已成功處理"}
+        return {
+            "status": "success",
+            "message": f"共{len(stock_data)}筆資料已成功處理",
+            "replayed": replayed,
+        }
     return {
         "status": "error",
         "message": f"共{len(fail_data)}筆資料均已忽略，原因:\n{''.join(fail_data)}",
+        "replayed": replayed,
     }
 
 
 @app.post("/menu_post")
-async def menu_post(menu_data: dict):
+async def menu_post(
+    menu_data: dict, idempotency_key: str | None = Header(default=None)
+):
+    """
+    Menu 訂單扣料，整筆訂單以單一交易寫入（任一材料不足則全部不扣）
+
+    重送識別: Idempotency-Key 標頭或訂單的 "order_id" 欄位，重送時不會重複扣料。
+    """
     try:
-        # await menu_do_depot(menu_data) # 雙重紀錄會造成紀錄混亂，以 esp_do_depot 為主。
-        return {"status": "success", "message": "資料已成功寫入(meun 不寫入)"}
+        result = await menu_do_depot(
+            menu_data, idempotency_key or menu_data.get("order_id")
+        )
+        if result is None:
+            return {"status": "success", "message": "無需扣料"}
+        return {
+            "status": "success",
+            "message": f"共{len(result['events'])}項材料已扣除",
+            "replayed": result.get("replayed", False),
+        }
     except Exception as err:
         return {"status": "error", "message": str(err)}
 
 
 # ---- WebSocket: 瀏覽器客戶端 ----
 @app.websocket("/ws/client")
-async def ws_client(websocket: WebSocket):
-    """WebSocket協議 - 瀏覽器端"""
-    await manager.connect_client(websocket)
+async def ws_client(websocket: WebSocket, topic: str = "esp"):
+    """
+    WebSocket協議 - 瀏覽器端
+
+    topic=esp(預設): ESP32 即時資料與連線狀態
+    topic=inventory: 訂閱時先送出完整庫存 (event=reset)，
+        之後為庫存變動事件 (item, amount, source, record_id, removed)
+    """
+    await manager.connect_client(websocket, topic)
     # 初次連線時發送當前 ESP32 連線狀態
     await websocket.send_json({"type": "status", "esp": manager.esp_connected})
+    if topic == "inventory":
+        # 先送出完整庫存，補上頁面渲染到訂閱之間漏掉的變動
+        items = await depot.get_inventory()
+        await websocket.send_json(
+            {"type": "inventory", "event": "reset", "items": items}
+        )
     try:
         while True:
             await websocket.receive_text()  # 保持連線，只處理斷線情況
@@ -267,21 +567,19 @@ async def ws_client(websocket: WebSocket):
 async def ws_esp32(websocket: WebSocket):
     """WebSocket協議 - esp32端"""
     await websocket.accept()
-    manager.esp_connected = True
-    # ESP32 連線時，通知所有瀏覽器客戶端
-    await manager.broadcast_json({"type": "status", "esp": True})
+    # ESP32 連線時，通知所有 worker 的瀏覽器客戶端
+    await bus.publish("status", {"esp": True})
     try:
         while True:
             raw = await websocket.receive_text()
-            # 廣播接收到的原始資料給瀏覽器客戶端
-            await manager.broadcast(raw)
-            # 處理並寫入出貨資料
             data = json.loads(raw)
+            # 廣播原始資料給所有 worker（瀏覽器推送與讀數表）
+            await bus.publish("esp", {"raw": raw})
+            # 處理並寫入出貨資料（只在接收的 worker 寫入一次）
             await esp_do_depot(data)
     except WebSocketDisconnect:
-        manager.esp_connected = False
-        # ESP32 斷線時，通知所有瀏覽器客戶端
-        await manager.broadcast_json({"type": "status", "esp": False})
+        # ESP32 斷線時，通知所有 worker 的瀏覽器客戶端
+        await bus.publish("status", {"esp": False})
 
 
 # ---- 功能方法 ----
@@ -291,41 +589,117 @@ async def esp_do_depot(data: dict):
         return
 
     global esp_do_depot_last
-    try:
-        if data != esp_do_depot_last:
-            item_dict: dict = {i["esp"]: i["name"] for i in ITEM_ID}
-            for i in data:
-                if i in item_dict:
-                    await depot.write(
-                        DepotItem(
-                            "auto",
-                            item_dict[i],
-                            data[i] - esp_do_depot_last.get(i, 0),
-                        ),
-                        source="esp",
-                    )
-            esp_do_depot_last = data
-    except DepotError:
-        pass
-
-
-async def menu_do_depot(data: dict):
-    """處理 Menu 傳來的出貨資料，並寫入 Depot"""
-    for i in data["items"]:
+    if data == esp_do_depot_last:
+        return
+    esp_map = registry.esp_map  # 取一次，整幀使用同一版設定
+    for i in data:
+        name = esp_map.get(i)
+        if name is not None:
+            # 逐項寫入: 單一物品失敗（已由 DepotError 記錄）不影響同一幀的其他物品
+            try:
+                await depot.write(
+                    DepotItem("auto", name, data[i] - esp_do_depot_last.get(i, 0)),
+                    source="esp",
+                )
+            except DepotError:
+                continue
+    esp_do_depot_last = data
+
+
+async def _buffered(
+    parts: AsyncIterator[str], size: int = 16 * 1024
+) -> AsyncIterator[bytes]:
+    """合併模板逐段輸出的細碎字串，約每 size 字元送出一個 chunk"""
+    buffer: list[str] = []
+    length = 0
+    async for part in parts:
+        buffer.append(part)
+        length += len(part)
+        if length >= size:
+            yield "".join(buffer).encode("utf-8")
+            buffer, length = [], 0
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
+
+
+async def retention_loop():
+    """
+    依 storage.retention_days 每天封存一次超過保留天數的紀錄 (null 關閉)\n
+    多個 worker 時只由 archive.elect 選出的一個執行
+    """
+    keep_days = STORAGE_CONFIG.get("retention_days")
+    if not keep_days:
+        return
+    while True:
+        if depot.archive.elect():
+            await depot.tool.archive_records(keep_days)
+        await asyncio.sleep(24 * 60 * 60)
+
+
+async def item_config_loop(interval: float = 1.0):
+    """
+    每秒檢查 item_id.json: tag 或 esp 欄位對應變動時更新讀數表（含移除的物品），
+    並只寫入新增或 tag 變動的物品
+    """
+    while True:
+        await asyncio.sleep(interval)
         try:
-            await depot.write(DepotItem("out", i["material"], i["quantity"]), "menu")
-        except DepotError:
-            pass
+            changes = registry.reload()
+        except ValueError as err:
+            _log_operation("ERROR", "item_id.json 格式錯誤，保留目前設定", str(err))
+            continue
+        if changes.tags or changes.esp_map_changed:
+            readings.configure(registry.config)
+        changed = changes.tags
+        if not changed:
+            continue
+        for name, tag in changed.items():
+            if await depot.storage.find_item(name) is None:
+                await depot.storage.seed_item(name, 0, tag)
+            else:
+                await depot.set_tag(name, tag)
+        _log_operation(
+            "SUCCESS", "套用 item_id.json", f"{len(changed)} 項物品: {list(changed)}"
+        )
+
+
+async def menu_do_depot(data: dict, idempotency_key: str | None = None):
+    """
+    處理 Menu 傳來的出貨資料，以單一交易寫入 Depot
+
+    material 為 BOM 產品時展開為原料；ESP 秤重的物品以 esp_do_depot 為主，
+    預設不扣除，避免雙重紀錄（menu.skip_esp_items 為 false 時一併扣除）。
+    """
+    skipped = registry.names if MENU_CONFIG.get("skip_esp_items", True) else ()
+    parts: Counter[str] = Counter()
+    for i in data["items"]:
+        parts.update(depot.bom.expand(i["material"], i["quantity"]))
+    items = [
+        DepotItem("out", part, qty)
+        for part, qty in parts.items()
+        if part not in skipped
+    ]
+    if not items:
+        return None
+    return await depot.write_transaction(items, "menu", idempotency_key)
 
 
 # ---- 自訂 404 錯誤處理 ----
 @app.exception_handler(StarletteHTTPException)
 async def custom_http_exception_handler(request: Request, exc: StarletteHTTPException):
-    """自訂 404 頁面"""
+    """自訂 404 頁面 (瀏覽器回快取頁面，fetch/API 回精簡 JSON)"""
     if exc.status_code == 404:
-        return templates.TemplateResponse(
-            "404.html", {"request": request}, status_code=404
-        )
+        path = request.url.path
+        if path in route_misses or len(route_misses) < ROUTE_MISS_LIMIT:
+            route_misses[path] += 1
+        else:
+            route_misses["<other>"] += 1
+
+        if "text/html" in request.headers.get("accept", ""):
+            return page_cache.response(
+                request, "404.html", status_code=404, version=STATIC_PAGE
+            )
+        return Response(NOT_FOUND_JSON, status_code=404, media_type="application/json")
     return JSONResponse({"detail": exc.detail}, status_code=exc.status_code)
 
 
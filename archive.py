@@ -0,0 +1,192 @@
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator
+from bson import json_util
+from storage import storage_config
+import gzip
+import json
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: 沒有跨行程檔案鎖（只支援單一行程寫入）
+    fcntl = None
+
+
+class RecordArchive:
+    """
+    舊紀錄封存（冷儲存）\n
+    - write 將一天的紀錄壓縮寫入當月的封存檔，並保存當天的彙總\n
+    - read 讀取封存的一天（只解壓該天的區段）\n
+    - days / has 已封存的日期\n
+    - rollup 已封存日期的每日彙總（不需解壓）\n
+    - elect 多個 worker 時選出唯一執行封存的行程\n
+    \n
+    檔案配置: <directory>/records-YYYY-MM.ndjson.gz 每天一個 gzip 區段（可直接 zcat），
+    index.json 保存每天的 (檔案, 位移, 長度, 筆數, 彙總)。\n
+    多個行程共用同一目錄: 寫入時持有 index.lock 檔案鎖並先重新載入索引，
+    讀取時 index.json 被其他行程更新則重新載入
+    """
+
+    def __init__(self, directory: str = "./data/archive") -> None:
+        """
+        Args:
+            directory: 封存目錄（第一次寫入時建立）
+        """
+        self.directory = Path(directory)
+        self.index_path = self.directory / "index.json"
+        self.lock = threading.Lock()
+        self.index: dict[str, dict[str, Any]] = {}
+        self._version: tuple[int, int] | None = None  # index.json 的 (inode, mtime)
+        self._leader = None  # elect 取得的 retention.lock
+        self._refresh()
+
+    def days(self) -> list[str]:
+        """已封存的日期"""
+        self._refresh()
+        return list(self.index)
+
+    def has(self, day: str) -> bool:
+        """該日期是否已封存"""
+        self._refresh()
+        return day in self.index
+
+    def rollup(self, day: str) -> dict[str, dict[str, int]] | None:
+        """
+        已封存日期的彙總
+
+        Returns:
+            dict[str, dict[str, int]] | None: {物品: {"in", "out", "set", "count"}}，未封存時為 None
+        """
+        self._refresh()
+        entry = self.index.get(day)
+        return entry["rollup"] if entry else None
+
+    def read(self, day: str) -> list[dict[str, Any]] | None:
+        """
+        讀取封存的紀錄
+
+        Args:
+            day: 日期 (YYYY-MM-DD)
+
+        Returns:
+            list[dict[str, Any]] | None: 紀錄列表，未封存時為 None
+        """
+        self._refresh()
+        entry = self.index.get(day)
+        if entry is None:
+            return None
+        with open(self.directory / entry["file"], "rb") as f:
+            f.seek(entry["offset"])
+            data = gzip.decompress(f.read(entry["length"]))
+        return [json_util.loads(line) for line in data.decode("utf-8").splitlines()]
+
+    def write(self, day: str, records: list[dict[str, Any]]) -> dict[str, Any]:
+        """
+        封存一天的紀錄（先寫入資料並 fsync，再更新索引；持有檔案鎖，不會覆蓋其他行程的索引）
+
+        Args:
+            day: 日期 (YYYY-MM-DD)
+            records: 該日期的所有紀錄
+
+        Returns:
+            dict[str, Any]: 索引項目 {"file", "offset", "length", "count", "rollup"}
+        """
+        body = gzip.compress(
+            "\n".join(json_util.dumps(r, ensure_ascii=False) for r in records).encode(
+                "utf-8"
+            )
+        )
+        name = f"records-{day[:7]}.ndjson.gz"
+        with self.lock, self._file_lock():
+            self._refresh()
+            with open(self.directory / name, "ab") as f:
+                offset = f.tell()
+                f.write(body)
+                f.flush()
+                os.fsync(f.fileno())
+            entry = {
+                "file": name,
+                "offset": offset,
+                "length": len(body),
+                "count": len(records),
+                "rollup": daily_rollup(records),
+            }
+            self.index[day] = entry
+            tmp = self.index_path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self.index, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, self.index_path)
+            self._version = _version(self.index_path)
+        return entry
+
+    def elect(self) -> bool:
+        """
+        選出執行封存的行程: 非阻塞取得 retention.lock 並持有到行程結束\n
+        負責的行程結束後，其他行程下次呼叫時接手
+
+        Returns:
+            bool: 本行程負責封存（沒有檔案鎖的平台一律為 True）
+        """
+        if fcntl is None or self._leader is not None:
+            return True
+        self.directory.mkdir(parents=True, exist_ok=True)
+        file = open(self.directory / "retention.lock", "w")
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            return False
+        self._leader = file
+        return True
+
+    def _refresh(self) -> None:
+        """index.json 不存在或未變更時不動，被其他行程更新時重新載入"""
+        version = _version(self.index_path)
+        if version is None or version == self._version:
+            return
+        self.index = json.loads(self.index_path.read_text(encoding="utf-8"))
+        self._version = version
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        """跨行程寫入鎖 (index.lock)"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if fcntl is None:
+            yield
+            return
+        with open(self.directory / "index.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+
+def _version(path: Path) -> tuple[int, int] | None:
+    """檔案的 (inode, mtime)，os.replace 每次都會換新的 inode"""
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def daily_rollup(records: list[dict[str, Any]]) -> dict[str, dict[str, int]]:
+    """
+    每日彙總
+
+    Returns:
+        dict[str, dict[str, int]]: {物品: {"in": 入庫量, "out": 出庫量, "set": 設定次數, "count": 筆數}}
+    """
+    rollup: dict[str, dict[str, int]] = {}
+    for r in records:
+        item = rollup.setdefault(r["item"], {"in": 0, "out": 0, "set": 0, "count": 0})
+        if r["type"] == "set":
+            item["set"] += 1
+        elif r["type"] in ("in", "out"):
+            item[r["type"]] += r["amount"]
+        item["count"] += 1
+    return rollup
+
+
+def create_archive() -> RecordArchive:
+    """依 server_config.json 的 storage.archive 建立封存（未設定時使用 ./data/archive）"""
+    return RecordArchive(storage_config().get("archive") or "./data/archive")
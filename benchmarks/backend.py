@@ -0,0 +1,162 @@
+"""
+效能測試用的資料庫後端
+
+- mongod: 在暫存目錄啟動一個用完即丟的 mongod（需安裝 mongod）
+- mongomock: 記憶體內的 MongoDB 替代品（需 pip install mongomock），
+  以簡單的 async 包裝提供給 AsyncDepot 使用
+- memory: 使用 storage.MemoryStorage 引擎（不經過 MongoDB 介面）
+"""
+
+from contextlib import contextmanager
+from typing import Any, Iterator
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+
+import depot
+import storage
+
+
+@contextmanager
+def mongo_backend(kind: str = "auto") -> Iterator[str]:
+    """
+    啟動效能測試用的資料庫，並讓 depot 模組連到該資料庫
+
+    Args:
+        kind: "auto"(有 mongod 用 mongod，否則 mongomock) / "mongod" / "mongomock" / "memory"
+
+    Yields:
+        str: 實際使用的後端名稱
+    """
+    if kind == "auto":
+        kind = "mongod" if shutil.which("mongod") else "mongomock"
+
+    if kind == "mongod":
+        with _throwaway_mongod() as uri:
+            original = depot.MONGO_ADDR
+            depot.MONGO_ADDR = uri
+            try:
+                yield "mongod"
+            finally:
+                depot.MONGO_ADDR = original
+    elif kind == "mongomock":
+        _install_mongomock()
+        yield "mongomock"
+    elif kind == "memory":
+        os.environ["DEPOT_STORAGE_ENGINE"] = "memory"
+        yield "memory"
+    else:
+        raise ValueError(f"未知的後端: {kind}")
+
+
+@contextmanager
+def _throwaway_mongod() -> Iterator[str]:
+    """在暫存目錄啟動 mongod，結束後關閉並刪除資料"""
+    mongod = shutil.which("mongod")
+    if mongod is None:
+        raise RuntimeError("找不到 mongod，請安裝 MongoDB 或改用 --backend mongomock")
+
+    dbpath = tempfile.mkdtemp(prefix="depot-bench-")
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    proc = subprocess.Popen(
+        [mongod, "--dbpath", dbpath, "--port", str(port), "--bind_ip", "127.0.0.1"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    uri = f"mongodb://127.0.0.1:{port}/"
+    try:
+        _wait_ready(uri, proc)
+        yield uri
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+        shutil.rmtree(dbpath, ignore_errors=True)
+
+
+def _wait_ready(uri: str, proc: subprocess.Popen, timeout: float = 30) -> None:
+    """等待 mongod 可以回應 ping"""
+    from pymongo import MongoClient
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("mongod 啟動失敗")
+        try:
+            MongoClient(uri, serverSelectionTimeoutMS=500).admin.command("ping")
+            return
+        except Exception:
+            time.sleep(0.2)
+    raise RuntimeError("等待 mongod 啟動逾時")
+
+
+def _install_mongomock() -> None:
+    """讓 storage 的 MongoClient / AsyncMongoClient 改用同一個 mongomock 伺服器"""
+    try:
+        import mongomock
+    except ImportError as err:
+        raise RuntimeError("請先 pip install mongomock，或安裝 mongod") from err
+
+    server = mongomock.MongoClient()
+    storage.MongoClient = lambda *args, **kwargs: server
+    storage.AsyncMongoClient = lambda *args, **kwargs: _AsyncClient(server)
+
+
+class _AsyncCursor:
+    def __init__(self, cursor: Any) -> None:
+        self.cursor = cursor
+
+    def __aiter__(self) -> "_AsyncCursor":
+        return self
+
+    async def __anext__(self) -> Any:
+        try:
+            return next(self.cursor)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    def __getattr__(self, name: str) -> Any:  # sort / limit / batch_size ...
+        attr = getattr(self.cursor, name)
+
+        def chain(*args: Any, **kwargs: Any) -> "_AsyncCursor":
+            attr(*args, **kwargs)
+            return self
+
+        return chain
+
+    async def to_list(self, length: int | None = None) -> list[Any]:
+        return list(self.cursor)
+
+
+class _AsyncWrapper:
+    """把同步 mongomock 物件的方法包成 coroutine"""
+
+    CURSOR_METHODS = {"find", "aggregate", "find_raw_batches"}
+
+    def __init__(self, target: Any) -> None:
+        self.target = target
+
+    def __getitem__(self, name: str) -> "_AsyncWrapper":
+        return _AsyncWrapper(self.target[name])
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self.target, name)
+        if name in self.CURSOR_METHODS:
+            return lambda *args, **kwargs: _AsyncCursor(attr(*args, **kwargs))
+        if not callable(attr) or name in ("get_collection", "get_database"):
+            return attr
+
+        async def call(*args: Any, **kwargs: Any) -> Any:
+            return attr(*args, **kwargs)
+
+        return call
+
+
+class _AsyncClient(_AsyncWrapper):
+    async def close(self) -> None:
+        pass
@@ -0,0 +1,119 @@
+"""Depot / AsyncDepot 寫入與查詢效能"""
+
+from datetime import date
+from typing import Any
+import asyncio
+
+from benchmarks.stats import Timer, quiet
+from depot import AsyncDepot, Depot, DepotItem
+
+
+def catalogue(skus: int) -> list[str]:
+    """合成的 SKU 清單"""
+    return [f"SKU-{i:05d}" for i in range(skus)]
+
+
+def run(ops: int, skus: int, batch: int, concurrency: int) -> dict[str, Any]:
+    """
+    Args:
+        ops: 每項測試的寫入筆數
+        skus: SKU 數量
+        batch: 批次大小
+        concurrency: 非同步並行數
+
+    Returns:
+        dict[str, Any]: 測試名稱 -> 統計結果
+    """
+    names = catalogue(skus)
+    results: dict[str, Any] = {}
+
+    with quiet():
+        db = Depot()
+
+        # 同步：逐筆寫入
+        with Timer() as t:
+            for i in range(ops):
+                with t.op():
+                    db.write(DepotItem("in", names[i % skus], 1), source="bench")
+        results["depot.write.sync"] = t.summary()
+
+        # 同步：idempotency key 寫入
+        with Timer() as t:
+            for i in range(ops):
+                with t.op():
+                    db.write(
+                        DepotItem("in", names[i % skus], 1),
+                        source="bench",
+                        idempotency_key=f"bench-sync-{i}",
+                    )
+        results["depot.write.sync.idempotent"] = t.summary()
+
+        # 查詢
+        with Timer() as t:
+            for _ in range(max(ops // 20, 1)):
+                with t.op():
+                    db.get_inventory()
+        results["depot.get_inventory"] = t.summary()
+
+        with Timer() as t:
+            for _ in range(max(ops // 50, 1)):
+                with t.op():
+                    db.find_records(f"{date.today()}")
+        results["depot.find_records"] = t.summary()
+
+        results.update(asyncio.run(_run_async(names, ops, batch, concurrency)))
+
+    return results
+
+
+async def _run_async(
+    names: list[str], ops: int, batch: int, concurrency: int
+) -> dict[str, Any]:
+    results: dict[str, Any] = {}
+    db = AsyncDepot()
+    skus = len(names)
+
+    # 非同步：逐筆寫入
+    with Timer() as t:
+        for i in range(ops):
+            with t.op():
+                await db.write(DepotItem("in", names[i % skus], 1), source="bench")
+    results["asyncdepot.write.single"] = t.summary()
+
+    # 非同步：每批 batch 筆並行寫入（不同 SKU，避免同物品競爭）
+    with Timer() as t:
+        for start in range(0, ops, batch):
+            with t.op():
+                await asyncio.gather(
+                    *(
+                        db.write(DepotItem("in", names[i % skus], 1), source="bench")
+                        for i in range(start, min(start + batch, ops))
+                    )
+                )
+    results["asyncdepot.write.batched"] = t.summary(ops)
+
+    # 非同步：concurrency 個 worker 持續寫入
+    counter = iter(range(ops))
+
+    async def worker(t: Timer) -> None:
+        for i in counter:
+            with t.op():
+                await db.write(DepotItem("in", names[i % skus], 1), source="bench")
+
+    with Timer() as t:
+        await asyncio.gather(*(worker(t) for _ in range(concurrency)))
+    results["asyncdepot.write.concurrent"] = t.summary()
+
+    with Timer() as t:
+        for _ in range(max(ops // 20, 1)):
+            with t.op():
+                await db.get_inventory()
+    results["asyncdepot.get_inventory"] = t.summary()
+
+    with Timer() as t:
+        for _ in range(max(ops // 50, 1)):
+            with t.op():
+                await db.find_records(f"{date.today()}")
+    results["asyncdepot.find_records"] = t.summary()
+
+    return results
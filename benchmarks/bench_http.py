@@ -0,0 +1,131 @@
+"""FastAPI 端點延遲與 ESP32 WebSocket 重播"""
+
+from datetime import date
+from typing import Any
+import asyncio
+import json
+import threading
+import time
+
+from benchmarks.stats import Timer, quiet
+
+
+def run_endpoints(requests: int, skus: int, batch: int) -> dict[str, Any]:
+    """
+    量測 /stock/submit、/inventory、/records/data 的 p50/p99
+
+    Args:
+        requests: 每個端點的請求數
+        skus: SKU 數量
+        batch: /stock/submit 每次送出的筆數
+    """
+    import httpx
+    import app
+
+    async def main() -> dict[str, Any]:
+        results: dict[str, Any] = {}
+        transport = httpx.ASGITransport(app=app.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench"
+        ) as client:
+            names = [f"SKU-{i:05d}" for i in range(skus)]
+
+            for size in (1, batch):
+                with Timer() as t:
+                    for n in range(requests):
+                        rows = [
+                            {
+                                "type": "in",
+                                "item": names[(n * size + i) % skus],
+                                "amount": 1,
+                            }
+                            for i in range(size)
+                        ]
+                        with t.op():
+                            resp = await client.post("/stock/submit", json=rows)
+                        resp.raise_for_status()
+                results[f"http.stock_submit.rows{size}"] = t.summary(requests * size)
+
+            for name, url in (
+                ("http.inventory", "/inventory"),
+                ("http.records_data", f"/records/data?date={date.today()}"),
+            ):
+                with Timer() as t:
+                    for _ in range(requests):
+                        with t.op():
+                            resp = await client.get(url)
+                        resp.raise_for_status()
+                results[name] = t.summary()
+        return results
+
+    with quiet():
+        return asyncio.run(main())
+
+
+def run_esp_replay(frames: int, clients: int, rate: float) -> dict[str, Any]:
+    """
+    以合成的 ESP32 幀重播 /ws/esp32，並量測廣播到 N 個瀏覽器的延遲
+
+    Args:
+        frames: 重播幀數（每 10 幀一個 final 幀，會寫入 Depot）
+        clients: 模擬的瀏覽器客戶端數量
+        rate: 每秒送出幀數，0 表示不限速
+    """
+    from starlette.testclient import TestClient
+    import app
+
+    sent: dict[int, float] = {}
+    latencies: list[float] = []
+    lock = threading.Lock()
+
+    def browser(ws: Any, ready: threading.Event) -> None:
+        ws.receive_json()  # 初次連線的 status 訊息
+        ready.set()
+        received = 0
+        while received < frames:
+            msg = ws.receive_json()
+            if "seq" not in msg:  # status 等其他訊息
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - sent[msg["seq"]])
+            received += 1
+
+    with quiet(), TestClient(app.app) as client:
+        sockets = [client.websocket_connect("/ws/client") for _ in range(clients)]
+        opened = [s.__enter__() for s in sockets]
+        ready = [threading.Event() for _ in opened]
+        threads = [
+            threading.Thread(target=browser, args=(ws, ev), daemon=True)
+            for ws, ev in zip(opened, ready)
+        ]
+        for th in threads:
+            th.start()
+        for ev in ready:
+            ev.wait()
+
+        with client.websocket_connect("/ws/esp32") as esp, Timer() as t:
+            for seq in range(frames):
+                count = seq // 10
+                frame = {
+                    "seq": seq,
+                    "weight": count * 4,
+                    "small": count,
+                    "big": count,
+                    "tube": count,
+                    "libu": count,
+                    "final": seq % 10 == 9,
+                }
+                sent[seq] = time.perf_counter()
+                esp.send_text(json.dumps(frame))
+                if rate:
+                    time.sleep(1 / rate)
+            for th in threads:
+                th.join(timeout=60)
+
+        for s in sockets:
+            s.__exit__(None, None, None)
+
+    t.latencies = latencies
+    result = t.summary(frames)
+    result["clients"] = clients
+    return {"ws.esp32.broadcast": result}
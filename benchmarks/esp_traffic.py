@@ -0,0 +1,401 @@
+"""
+ESP32 流量錄製與加速重播（對執行中的 app.py 做端到端壓力測試）
+
+使用範例:
+  python -m benchmarks.esp_traffic record esp.ndjson.gz             # 錄製實際 ESP32 流量
+  python -m benchmarks.esp_traffic synth esp.ndjson.gz --frames 2000  # 沒有 ESP32 時產生合成流量
+  python -m benchmarks.esp_traffic replay esp.ndjson.gz --speed 10 --devices 4
+
+錄製: 以瀏覽器端 /ws/client 接收 app 轉發的 ESP32 原始幀，不需要改動 ESP32 或 app。
+檔案為 gzip NDJSON: 第一行為標頭，之後每行 [距第一幀的毫秒數, 幀]。
+
+重播: N 個模擬裝置各自連線 /ws/esp32，依錄製的時間間隔 ÷ speed 送出每一幀，
+每幀附上 seq / device 欄位（app 只處理 item_id.json 的欄位，其餘忽略）。
+- broadcast 延遲: 送出 → 瀏覽器 (/ws/client) 收到同一 seq 的幀
+- record 延遲: 送出 final 幀 → 庫存頁面 (/ws/client?topic=inventory) 收到寫入後的變動事件
+  依 app 的計算方式（與上一個 final 幀的差值）在本機預測每幀會產生的 (物品, 異動後數量)，
+  以此對應收到的事件；重播前請重新啟動 app，並避免同時有其他寫入
+"""
+
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+import argparse
+import asyncio
+import gzip
+import json
+import sys
+import time
+
+from benchmarks.stats import Timer
+
+ROOT = Path(__file__).resolve().parent.parent
+FORMAT = "depot-esp-traffic"
+VERSION = 1
+
+
+def read_recording(path: str) -> tuple[dict[str, Any], list[tuple[float, dict]]]:
+    """
+    讀取錄製檔
+
+    Returns:
+        tuple: (標頭, [(毫秒, 幀)])
+
+    Raises:
+        ValueError: 不是錄製檔
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline() or "{}")
+        if header.get("format") != FORMAT:
+            raise ValueError(f"{path} 不是 ESP 錄製檔")
+        frames = [tuple(json.loads(line)) for line in f if line.strip()]
+    return header, frames
+
+
+class RecordingWriter:
+    """寫入錄製檔（每幀一行，時間以第一幀為 0）"""
+
+    def __init__(self, path: str, source: str) -> None:
+        self.file = gzip.open(path, "wt", encoding="utf-8")
+        self.count = 0
+        self._origin: float | None = None
+        header = {
+            "format": FORMAT,
+            "version": VERSION,
+            "started": datetime.now().isoformat(timespec="seconds"),
+            "source": source,
+        }
+        self.file.write(json.dumps(header, ensure_ascii=False) + "\n")
+
+    def write(self, frame: dict[str, Any], at: float | None = None) -> None:
+        """
+        Args:
+            frame: ESP32 幀
+            at: 收到的時間 (time.perf_counter 秒)，預設為現在
+        """
+        at = time.perf_counter() if at is None else at
+        if self._origin is None:
+            self._origin = at
+        offset = round((at - self._origin) * 1000, 3)
+        self.file.write(json.dumps([offset, frame], separators=(",", ":")) + "\n")
+        self.count += 1
+
+    def close(self) -> None:
+        self.file.close()
+
+
+async def record(
+    url: str, path: str, frames: int = 0, duration: float = 0
+) -> int:
+    """
+    錄製 ESP32 流量（經由 /ws/client）
+
+    Args:
+        url: app 位址，例如 ws://127.0.0.1:5000
+        path: 輸出檔案
+        frames: 錄製幾幀後停止，0 表示不限
+        duration: 錄製幾秒後停止，0 表示不限（Ctrl+C 結束）
+
+    Returns:
+        int: 錄製的幀數
+    """
+    import websockets
+
+    writer = RecordingWriter(path, url)
+    deadline = time.perf_counter() + duration if duration else None
+    try:
+        async with websockets.connect(f"{url}/ws/client") as ws:
+            while not frames or writer.count < frames:
+                timeout = None if deadline is None else deadline - time.perf_counter()
+                if timeout is not None and timeout <= 0:
+                    break
+                try:
+                    raw = await asyncio.wait_for(ws.recv(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                at = time.perf_counter()
+                message = json.loads(raw)
+                if message.get("type") == "status":  # 連線狀態，不是 ESP32 幀
+                    continue
+                writer.write(message, at)
+                print(f"\r已錄製 {writer.count} 幀", end="", file=sys.stderr)
+    finally:
+        writer.close()
+        print(file=sys.stderr)
+    return writer.count
+
+
+def synthesize(path: str, frames: int = 2000, fps: float = 20) -> int:
+    """
+    產生合成錄製檔（同 benchmarks 的 ESP 重播: 每 10 幀一個 final 幀，每個 final 幀各物品 +1）
+
+    Args:
+        path: 輸出檔案
+        frames: 幀數
+        fps: 每秒幀數
+    """
+    writer = RecordingWriter(path, "synthetic")
+    for seq in range(frames):
+        count = seq // 10 + 1
+        frame = {
+            "weight": count * 4,
+            "small": count,
+            "big": count,
+            "tube": count,
+            "libu": count,
+            "final": seq % 10 == 9,
+        }
+        writer.write(frame, seq / fps)
+    writer.close()
+    return frames
+
+
+class RecordPredictor:
+    """
+    依 app 的 esp_do_depot 預測每個 final 幀寫入後的 (物品, 數量)\n
+    差值 > 0 入庫、< 0 出庫（庫存不足時 app 會略過）、= 0 不寫入
+    """
+
+    def __init__(self, esp_map: dict[str, str], stock: dict[str, int]) -> None:
+        self.esp_map = esp_map
+        self.stock = dict(stock)
+        self.last: dict[str, Any] = {}
+
+    def feed(self, frame: dict[str, Any]) -> list[tuple[str, int]]:
+        """送出一幀，返回預期的變動 [(物品, 異動後數量)]"""
+        if not frame.get("final", False):
+            return []
+        expected = []
+        for key, value in frame.items():
+            name = self.esp_map.get(key)
+            if name is None:
+                continue
+            delta = value - self.last.get(key, 0)
+            current = self.stock.get(name, 0)
+            if delta > 0 or (delta < 0 and current >= -delta):
+                self.stock[name] = current + delta
+                expected.append((name, current + delta))
+        self.last = frame
+        return expected
+
+
+async def replay(
+    url: str,
+    path: str,
+    speed: float = 1.0,
+    devices: int = 1,
+    settle: float = 5.0,
+) -> dict[str, Any]:
+    """
+    重播錄製檔並量測延遲
+
+    Args:
+        url: app 位址，例如 ws://127.0.0.1:5000
+        path: 錄製檔
+        speed: 播放倍速（1 = 原速，100 = 100 倍速）
+        devices: 模擬的 ESP32 裝置數（每個裝置送出完整的錄製內容）
+        settle: 送完後等待尚未收到的廣播與事件的最長秒數
+
+    Returns:
+        dict[str, Any]: {"esp.replay.broadcast": 統計, "esp.replay.record": 統計}
+    """
+    import httpx
+    import websockets
+    from registry import ItemRegistry
+
+    _, frames = read_recording(path)
+    http_url = "http" + url[len("ws") :] if url.startswith("ws") else url
+    async with httpx.AsyncClient(base_url=http_url) as client:
+        stock = (await client.get("/api/inventory")).json()
+    registry = ItemRegistry(str(ROOT / "config" / "item_id.json"))
+    predictor = RecordPredictor(registry.esp_map, stock)
+
+    sent: dict[int, float] = {}  # seq → 送出時間
+    expected: dict[tuple[str, int], list[float]] = {}  # (物品, 數量) → 送出時間
+    broadcast, records = Timer(), Timer()
+    counts = {"sent": 0, "expected": 0, "unmatched": 0}
+    done = asyncio.Event()
+
+    def finished() -> bool:
+        return not sent and not any(expected.values())
+
+    async def browser(ws: Any) -> None:
+        async for raw in ws:
+            at = time.perf_counter()
+            message = json.loads(raw)
+            seq = message.get("seq")
+            if seq is not None and seq in sent:
+                broadcast.latencies.append(at - sent.pop(seq))
+            if sending_done and finished():
+                done.set()
+
+    async def inventory(ws: Any) -> None:
+        async for raw in ws:
+            at = time.perf_counter()
+            event = json.loads(raw)
+            if event.get("event") != "change" or event.get("source") != "esp":
+                continue
+            times = expected.get((event["item"], event["amount"]))
+            if times:
+                records.latencies.append(at - times.pop(0))
+            else:
+                counts["unmatched"] += 1
+            if sending_done and finished():
+                done.set()
+
+    sending_done = False
+    observers = [
+        await websockets.connect(f"{url}/ws/client"),
+        await websockets.connect(f"{url}/ws/client?topic=inventory"),
+    ]
+    for ws in observers:
+        await ws.recv()  # 初次連線的 status 訊息
+    tasks = [
+        asyncio.create_task(browser(observers[0])),
+        asyncio.create_task(inventory(observers[1])),
+    ]
+    esp = [await websockets.connect(f"{url}/ws/esp32") for _ in range(devices)]
+
+    origin = frames[0][0] if frames else 0
+    step = _mean_interval(frames) / speed / max(devices, 1)  # 裝置之間錯開
+    with broadcast, records:
+        started = time.perf_counter()
+        seq = 0
+        for offset, frame in frames:
+            target = started + (offset - origin) / 1000 / speed
+            for device, ws in enumerate(esp):
+                delay = target + device * step - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tagged = {**frame, "seq": seq, "device": device}
+                for key in predictor.feed(tagged):
+                    expected.setdefault(key, []).append(time.perf_counter())
+                    counts["expected"] += 1
+                sent[seq] = time.perf_counter()
+                await ws.send(json.dumps(tagged))
+                seq += 1
+        counts["sent"] = seq
+        send_seconds = time.perf_counter() - started
+        sending_done = True
+        if not finished():
+            try:
+                await asyncio.wait_for(done.wait(), settle)
+            except asyncio.TimeoutError:
+                pass
+
+    for ws in esp + observers:
+        await ws.close()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    duration = frames[-1][0] - origin if frames else 0
+    target_fps = counts["sent"] / (duration / 1000 / speed) if duration else 0
+    broadcast.elapsed = records.elapsed = send_seconds
+    result_broadcast = broadcast.summary(counts["sent"])
+    result_broadcast.update(
+        {
+            "missing": len(sent),
+            "devices": devices,
+            "speed": speed,
+            "target_fps": round(target_fps, 1),
+        }
+    )
+    result_record = records.summary(len(records.latencies))
+    result_record.update(
+        {
+            "expected": counts["expected"],
+            "missing": sum(len(v) for v in expected.values()),
+            "unmatched": counts["unmatched"],
+        }
+    )
+    return {
+        "esp.replay.broadcast": result_broadcast,
+        "esp.replay.record": result_record,
+    }
+
+
+def _mean_interval(frames: list[tuple[float, dict]]) -> float:
+    """平均幀間隔（秒）"""
+    if len(frames) < 2:
+        return 0.0
+    return (frames[-1][0] - frames[0][0]) / 1000 / (len(frames) - 1)
+
+
+def _print(results: dict[str, Any]) -> None:
+    print(
+        f"{'benchmark':24} {'ops':>7} {'ops/s':>9} "
+        f"{'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    )
+    for name, r in results.items():
+        print(
+            f"{name:24} {r['ops']:>7} {r['ops_per_sec']:>9} "
+            f"{r['p50_ms']:>9} {r['p99_ms']:>9} {r['max_ms']:>9}"
+        )
+    b, r = results["esp.replay.broadcast"], results["esp.replay.record"]
+    print(
+        f"目標 {b['target_fps']} 幀/秒 ({b['devices']} 裝置 × {b['speed']} 倍速)，"
+        f"未收到廣播 {b['missing']} 幀；預期寫入 {r['expected']} 筆，"
+        f"未收到 {r['missing']}，無法對應 {r['unmatched']}"
+    )
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="ESP32 流量錄製與加速重播")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    rec = sub.add_parser("record", help="錄製 app 收到的 ESP32 幀")
+    rec.add_argument("file")
+    rec.add_argument("--url", default="ws://127.0.0.1:5000")
+    rec.add_argument("--frames", type=int, default=0, help="錄製幾幀後停止")
+    rec.add_argument("--duration", type=float, default=0, help="錄製幾秒後停止")
+
+    syn = sub.add_parser("synth", help="產生合成錄製檔")
+    syn.add_argument("file")
+    syn.add_argument("--frames", type=int, default=2000)
+    syn.add_argument("--fps", type=float, default=20)
+
+    rep = sub.add_parser("replay", help="重播錄製檔並量測延遲")
+    rep.add_argument("file")
+    rep.add_argument("--url", default="ws://127.0.0.1:5000")
+    rep.add_argument("--speed", type=float, default=1.0, help="倍速 (1~100)")
+    rep.add_argument("--devices", type=int, default=1, help="模擬裝置數")
+    rep.add_argument("--settle", type=float, default=5.0, help="送完後最長等待秒數")
+    rep.add_argument("-o", "--output", help="輸出 JSON 檔案")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, str(ROOT))
+    if args.command == "record":
+        try:
+            count = asyncio.run(
+                record(args.url.rstrip("/"), args.file, args.frames, args.duration)
+            )
+        except KeyboardInterrupt:
+            count = None
+        print(f"錄製完成: {args.file}" + (f" ({count} 幀)" if count is not None else ""))
+        return 0
+    if args.command == "synth":
+        count = synthesize(args.file, args.frames, args.fps)
+        print(f"已產生 {count} 幀: {args.file}")
+        return 0
+
+    results = asyncio.run(
+        replay(args.url.rstrip("/"), args.file, args.speed, args.devices, args.settle)
+    )
+    _print(results)
+    if args.output:
+        report = {
+            "meta": {
+                "time": datetime.now().isoformat(timespec="seconds"),
+                "params": vars(args),
+            },
+            "results": results,
+        }
+        Path(args.output).write_text(
+            json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
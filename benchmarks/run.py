@@ -0,0 +1,112 @@
+"""
+倉庫系統效能測試
+
+使用範例:
+  python -m benchmarks.run                          # 自動選擇 mongod / mongomock
+  python -m benchmarks.run --backend mongod -o out.json
+  python -m benchmarks.run --compare last.json      # 與上次結果比較
+"""
+
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+
+ROOT = Path(__file__).resolve().parent.parent
+SUITES = ("depot", "http", "esp")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Depot 效能測試")
+    parser.add_argument(
+        "--backend", choices=("auto", "mongod", "mongomock", "memory"), default="auto"
+    )
+    parser.add_argument("--suite", default=",".join(SUITES), help="depot,http,esp")
+    parser.add_argument("--ops", type=int, default=2000, help="每項寫入筆數")
+    parser.add_argument("--skus", type=int, default=500, help="合成 SKU 數量")
+    parser.add_argument("--batch", type=int, default=50, help="批次大小")
+    parser.add_argument("--concurrency", type=int, default=16, help="非同步並行數")
+    parser.add_argument("--requests", type=int, default=200, help="每個端點請求數")
+    parser.add_argument("--frames", type=int, default=500, help="ESP 重播幀數")
+    parser.add_argument("--clients", type=int, default=20, help="模擬瀏覽器數")
+    parser.add_argument("--rate", type=float, default=0, help="ESP 每秒幀數，0=不限")
+    parser.add_argument("-o", "--output", help="輸出 JSON 檔案")
+    parser.add_argument("--compare", help="與先前的 JSON 結果比較")
+    args = parser.parse_args(argv)
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    # depot 與 app 以相對路徑讀取 ./config
+    os.chdir(ROOT)
+    sys.path.insert(0, str(ROOT))
+
+    from benchmarks.backend import mongo_backend
+
+    suites = [s for s in args.suite.split(",") if s]
+    results: dict[str, Any] = {}
+    with mongo_backend(args.backend) as backend:
+        if "depot" in suites:
+            from benchmarks import bench_depot
+
+            results.update(
+                bench_depot.run(args.ops, args.skus, args.batch, args.concurrency)
+            )
+        if "http" in suites:
+            from benchmarks import bench_http
+
+            results.update(
+                bench_http.run_endpoints(args.requests, args.skus, args.batch)
+            )
+        if "esp" in suites:
+            from benchmarks import bench_http
+
+            results.update(
+                bench_http.run_esp_replay(args.frames, args.clients, args.rate)
+            )
+
+    report = {
+        "meta": {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "backend": backend,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": vars(args),
+        },
+        "results": results,
+    }
+
+    _print_table(results, _load(args.compare))
+    if args.output:
+        Path(args.output).write_text(
+            json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8"
+        )
+    return 0
+
+
+def _load(path: str | None) -> dict[str, Any]:
+    """讀取先前的結果"""
+    if not path:
+        return {}
+    return json.loads(Path(path).read_text(encoding="utf-8")).get("results", {})
+
+
+def _print_table(results: dict[str, Any], baseline: dict[str, Any]) -> None:
+    """輸出結果表格，有 baseline 時附上 ops/sec 變化"""
+    print(f"{'benchmark':36} {'ops/s':>10} {'p50 ms':>9} {'p99 ms':>9}  diff")
+    for name, r in results.items():
+        diff = ""
+        old = baseline.get(name, {}).get("ops_per_sec")
+        if old:
+            diff = f"{(r['ops_per_sec'] / old - 1) * 100:+.1f}%"
+        print(
+            f"{name:36} {r['ops_per_sec']:>10} {r['p50_ms']:>9} {r['p99_ms']:>9}  {diff}"
+        )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
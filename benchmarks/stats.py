@@ -0,0 +1,69 @@
+"""效能測試統計工具"""
+
+from contextlib import contextmanager
+from typing import Any, Iterator
+import io
+import math
+import sys
+import time
+
+
+class Timer:
+    """收集每次操作的延遲 (秒)"""
+
+    def __init__(self) -> None:
+        self.latencies: list[float] = []
+        self.started = 0.0
+        self.elapsed = 0.0
+
+    def __enter__(self) -> "Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.elapsed = time.perf_counter() - self.started
+
+    @contextmanager
+    def op(self) -> Iterator[None]:
+        """量測單次操作"""
+        start = time.perf_counter()
+        yield
+        self.latencies.append(time.perf_counter() - start)
+
+    def summary(self, ops: int | None = None) -> dict[str, float]:
+        """
+        Args:
+            ops: 實際處理的筆數（批次寫入時大於操作次數），預設為操作次數
+
+        Returns:
+            dict[str, float]: ops / seconds / ops_per_sec / p50_ms / p99_ms / max_ms
+        """
+        ops = len(self.latencies) if ops is None else ops
+        ordered = sorted(self.latencies)
+        return {
+            "ops": ops,
+            "seconds": round(self.elapsed, 4),
+            "ops_per_sec": round(ops / self.elapsed, 1) if self.elapsed else 0.0,
+            "p50_ms": round(_percentile(ordered, 50) * 1000, 3),
+            "p99_ms": round(_percentile(ordered, 99) * 1000, 3),
+            "max_ms": round((ordered[-1] if ordered else 0) * 1000, 3),
+        }
+
+
+def _percentile(ordered: list[float], pct: float) -> float:
+    """最近秩法百分位數"""
+    if not ordered:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+
+@contextmanager
+def quiet() -> Iterator[None]:
+    """暫時丟棄 depot 的日誌輸出，避免終端機輸出影響量測"""
+    original = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        yield
+    finally:
+        sys.stdout = original
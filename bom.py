@@ -0,0 +1,190 @@
+from pathlib import Path
+from typing import Any
+import json
+import os
+import threading
+
+
+class BomStore:
+    """
+    物料清單 (BOM) 與預先展開的套件表\n
+    - definitions 產品定義 {產品: {零件或子產品: 數量}}\n
+    - set / remove 編輯定義（寫回檔案並重建展開表）\n
+    - expand 產品 → 原料數量（查表，不需遞迴）\n
+    - is_product 是否為已定義的產品\n
+    \n
+    定義檔: config/bom.json，手動修改檔案後會在下次查詢時自動重新載入
+    （格式錯誤或定義循環時記錄錯誤並保留目前的定義）\n
+    \n
+    範例 config/bom.json:\n
+      {
+        "螺絲組": {"小螺母": 2, "大螺母": 1},
+        "支架": {"鐵管": 2, "立布管": 1, "螺絲組": 4}
+      }
+    """
+
+    def __init__(self, path: str = "./config/bom.json") -> None:
+        """
+        Args:
+            path: 定義檔路徑（不存在時視為沒有任何產品）
+        """
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self._definitions: dict[str, dict[str, int]] = {}
+        self._table: dict[str, dict[str, int]] = {}  # 產品 → 展開後的原料數量
+        self._mtime: int | None = None
+        self._reload()
+
+    @property
+    def definitions(self) -> dict[str, dict[str, int]]:
+        """產品定義（副本）"""
+        self._reload()
+        return {k: dict(v) for k, v in self._definitions.items()}
+
+    @property
+    def table(self) -> dict[str, dict[str, int]]:
+        """展開表（副本）: {產品: {原料: 數量}}"""
+        self._reload()
+        return {k: dict(v) for k, v in self._table.items()}
+
+    def is_product(self, name: str) -> bool:
+        """是否為已定義的產品"""
+        self._reload()
+        return name in self._table
+
+    def expand(self, name: str, count: int = 1) -> dict[str, int]:
+        """
+        展開為原料數量
+
+        Args:
+            name: 產品或原料名稱（原料直接返回本身）
+            count: 數量
+
+        Returns:
+            dict[str, int]: {原料: 數量}
+        """
+        self._reload()
+        parts = self._table.get(name)
+        if parts is None:
+            return {name: count}
+        return {part: qty * count for part, qty in parts.items()}
+
+    def set(self, product: str, components: dict[str, Any]) -> dict[str, int]:
+        """
+        新增或覆寫產品定義
+
+        Args:
+            product: 產品名稱
+            components: {零件或子產品: 正整數數量}
+
+        Returns:
+            dict[str, int]: 該產品展開後的原料數量
+
+        Raises:
+            ValueError: 數量不是正整數或定義出現循環
+        """
+        _check_components(product, components)
+        with self.lock:
+            self._reload()
+            definitions = {**self._definitions, product: dict(components)}
+            table = _compile(definitions)  # 先驗證，成功才寫入
+            self._save(definitions, table)
+            return dict(table[product])
+
+    def remove(self, product: str) -> bool:
+        """
+        刪除產品定義（仍被其他產品引用時，該名稱會視為原料）
+
+        Returns:
+            bool: 是否有刪除
+        """
+        with self.lock:
+            self._reload()
+            if product not in self._definitions:
+                return False
+            definitions = {k: v for k, v in self._definitions.items() if k != product}
+            self._save(definitions, _compile(definitions))
+            return True
+
+    def _reload(self) -> None:
+        """
+        定義檔變更（mtime 不同）時重新載入並重建展開表\n
+        格式錯誤或定義循環時記錄錯誤並保留目前的定義（第一次載入時為空）
+        """
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime  # 格式錯誤時也只回報一次，等待下次修改
+        try:
+            definitions = {}
+            if mtime is not None:
+                definitions = json.loads(self.path.read_text(encoding="utf-8"))
+            self._table = _compile(definitions)
+            self._definitions = definitions
+        except (OSError, ValueError) as err:
+            from depot import _log_operation
+
+            _log_operation("ERROR", "bom.json 載入失敗，保留目前定義", str(err))
+
+    def _save(
+        self, definitions: dict[str, dict[str, int]], table: dict[str, dict[str, int]]
+    ) -> None:
+        """寫入暫存檔後替換，避免讀到寫到一半的檔案"""
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(
+            json.dumps(definitions, ensure_ascii=False, indent=4), encoding="utf-8"
+        )
+        os.replace(tmp, self.path)
+        self._definitions = definitions
+        self._table = table
+        self._mtime = self.path.stat().st_mtime_ns
+
+
+def _check_components(product: str, components: Any) -> None:
+    """
+    驗證產品定義
+
+    Raises:
+        ValueError: 沒有零件或數量不是正整數
+    """
+    if not isinstance(components, dict) or not components:
+        raise ValueError(f"產品 {product} 至少需要一項零件")
+    for part, qty in components.items():
+        if not isinstance(qty, int) or isinstance(qty, bool) or qty <= 0:
+            raise ValueError(f"產品 {product} 的零件 {part} 數量必須是正整數")
+
+
+def _compile(definitions: dict[str, dict[str, int]]) -> dict[str, dict[str, int]]:
+    """
+    驗證並將巢狀定義展開為 產品 → 原料數量（每個產品只展開一次）
+
+    Raises:
+        ValueError: 定義格式錯誤或出現循環
+    """
+    if not isinstance(definitions, dict):
+        raise ValueError("bom.json 必須是 {產品: {零件: 數量}}")
+    for product, components in definitions.items():
+        _check_components(product, components)
+    table: dict[str, dict[str, int]] = {}
+
+    def flatten(product: str, path: tuple[str, ...]) -> dict[str, int]:
+        if product in table:
+            return table[product]
+        if product in path:
+            raise ValueError(f"BOM 定義循環: {' → '.join(path + (product,))}")
+        parts: dict[str, int] = {}
+        for part, qty in definitions[product].items():
+            if part in definitions:
+                for sub, sub_qty in flatten(part, path + (product,)).items():
+                    parts[sub] = parts.get(sub, 0) + qty * sub_qty
+            else:
+                parts[part] = parts.get(part, 0) + qty
+        table[product] = parts
+        return parts
+
+    for product in definitions:
+        flatten(product, ())
+    return table
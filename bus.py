@@ -0,0 +1,312 @@
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+from pymongo import AsyncMongoClient, CursorType
+from pymongo.errors import CollectionInvalid, ConnectionFailure, OperationFailure
+from depot import _log_operation
+import asyncio
+import json
+import os
+import uuid
+
+Subscriber = Callable[[dict[str, Any], bool], Awaitable[None]]  # (訊息, 是否由本 worker 發布)
+EVENTS_SIZE = 16 * 1024 * 1024  # MongoDB 事件 capped collection 大小上限
+
+
+class EventBus(ABC):
+    """
+    事件匯流排（多個 uvicorn worker 之間共享即時事件）\n
+    - publish 發布訊息給所有 worker（包含自己）\n
+    - subscribe 訂閱主題，callback(訊息, local)，local 表示由本 worker 發布\n
+    - start / close 由 lifespan 呼叫\n
+    \n
+    主題:\n
+    - esp: ESP32 原始資料 {"raw"}\n
+    - status: ESP32 連線狀態 {"esp"}\n
+    - inventory: 庫存變動事件（同 Depot listener 事件）\n
+    \n
+    實作: LocalBus（單一行程，預設）/ UnixSocketBus / MongoBus，
+    由 server_config.json 的 bus.engine 選擇
+    """
+
+    def __init__(self) -> None:
+        self.origin = uuid.uuid4().hex  # 本 worker 的識別碼
+        self.subscribers: dict[str, list[Subscriber]] = {}
+
+    def subscribe(self, topic: str, callback: Subscriber) -> None:
+        """
+        訂閱主題
+
+        Args:
+            topic: 主題名稱
+            callback: async callback(訊息, local)
+        """
+        self.subscribers.setdefault(topic, []).append(callback)
+
+    @abstractmethod
+    async def publish(self, topic: str, message: dict[str, Any]) -> None:
+        """
+        發布訊息（需可 JSON 序列化）
+
+        Args:
+            topic: 主題名稱
+            message: 訊息內容
+        """
+
+    async def start(self) -> None:
+        """開始接收其他 worker 的訊息（預設無）"""
+
+    async def close(self) -> None:
+        """停止接收並釋放連線（預設無）"""
+
+    async def _dispatch(self, topic: str, message: dict[str, Any], origin: str) -> None:
+        """交給本 worker 的訂閱者，單一訂閱者失敗不影響其他訂閱者"""
+        local = origin == self.origin
+        for callback in self.subscribers.get(topic, []):
+            try:
+                await callback(message, local)
+            except Exception as e:
+                _log_operation("ERROR", "事件處理失敗", f"{topic}: {e}")
+
+
+class LocalBus(EventBus):
+    """單一行程: 直接呼叫訂閱者"""
+
+    async def publish(self, topic: str, message: dict[str, Any]) -> None:
+        await self._dispatch(topic, message, self.origin)
+
+
+class UnixSocketBus(EventBus):
+    """
+    同一台機器的多個 worker: 經由 Unix socket 轉發\n
+    第一個綁定 socket 的 worker 同時擔任 broker，將每一行轉發給所有連線（包含發布者）；
+    broker 結束時其他 worker 會重新連線並搶當新的 broker。
+    未連上 broker 時只交給本 worker 的訂閱者；
+    停止讀取超過 drain_timeout 秒的 worker 會被 broker 中斷連線（之後自行重新連線）。
+    僅支援 Unix（使用 fcntl 檔案鎖）
+    """
+
+    def __init__(
+        self,
+        path: str = "/tmp/depot-bus.sock",
+        retry_interval: float = 1.0,
+        drain_timeout: float = 5.0,
+    ):
+        """
+        Args:
+            path: socket 路徑
+            retry_interval: 與 broker 斷線時的重試間隔秒數
+            drain_timeout: broker 等待 worker 讀取的最長秒數
+        """
+        super().__init__()
+        self.path = path
+        self.retry_interval = retry_interval
+        self.drain_timeout = drain_timeout
+        self._server: asyncio.AbstractServer | None = None
+        self._peers: set[asyncio.StreamWriter] = set()  # broker: 所有 worker 連線
+        self._writer: asyncio.StreamWriter | None = None  # 本 worker 到 broker 的連線
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        reader = await self._connect()
+        self._task = asyncio.create_task(self._receive_loop(reader))
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._writer is not None:
+            self._writer.close()
+        if self._server is not None:
+            self._server.close()
+            for peer in list(self._peers):
+                peer.close()
+            await asyncio.sleep(0)  # 讓轉發中的連線讀到 EOF 後結束
+            Path(self.path).unlink(missing_ok=True)
+
+    async def publish(self, topic: str, message: dict[str, Any]) -> None:
+        if self._writer is None or self._writer.is_closing():
+            await self._dispatch(topic, message, self.origin)
+            return
+        line = json.dumps(
+            {"topic": topic, "origin": self.origin, "message": message},
+            ensure_ascii=False,
+        )
+        try:
+            self._writer.write(line.encode("utf-8") + b"\n")
+            await self._writer.drain()
+        except ConnectionError:
+            await self._dispatch(topic, message, self.origin)  # broker 剛結束
+
+    async def _connect(self) -> asyncio.StreamReader | None:
+        """連線到 broker，沒有 broker 時自己擔任（以檔案鎖避免多個 worker 同時擔任）"""
+        import fcntl  # 只有 Unix 有，其他引擎不需要
+
+        try:
+            with open(f"{self.path}.lock", "w") as lock:
+                while True:
+                    try:
+                        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        await asyncio.sleep(0.05)
+                try:
+                    reader, self._writer = await asyncio.open_unix_connection(self.path)
+                    return reader
+                except (FileNotFoundError, ConnectionRefusedError):
+                    pass
+                if os.path.exists(self.path):
+                    os.unlink(self.path)  # 上一個 broker 留下的檔案
+                self._server = await asyncio.start_unix_server(self._serve, self.path)
+            _log_operation("INFO", "事件匯流排", f"本 worker 擔任 broker ({self.path})")
+            reader, self._writer = await asyncio.open_unix_connection(self.path)
+            return reader
+        except OSError as e:
+            _log_operation("WARNING", "事件匯流排連線失敗", str(e))
+            self._writer = None
+            return None
+
+    async def _serve(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """broker: 轉發任一 worker 的每一行給所有 worker"""
+        self._peers.add(writer)
+        try:
+            while line := await reader.readline():
+                await asyncio.gather(
+                    *(self._forward(peer, line) for peer in list(self._peers))
+                )
+        except ConnectionError:
+            pass  # worker 斷線或已被 _forward 中斷
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+    async def _forward(self, peer: asyncio.StreamWriter, line: bytes) -> None:
+        """broker: 轉發一行給 worker，逾時未讀取（卡住）或已斷線時中斷該連線"""
+        try:
+            peer.write(line)
+            await asyncio.wait_for(peer.drain(), self.drain_timeout)
+        except asyncio.TimeoutError:
+            _log_operation("WARNING", "事件匯流排", "worker 停止讀取，中斷連線")
+            self._peers.discard(peer)
+            peer.close()
+        except ConnectionError:
+            self._peers.discard(peer)
+            peer.close()
+
+    async def _receive_loop(self, reader: asyncio.StreamReader | None) -> None:
+        """接收 broker 轉發的訊息，斷線時重新連線"""
+        while True:
+            if reader is None:
+                if self._writer is not None:
+                    self._writer.close()
+                reader = await self._connect()
+                if reader is None:
+                    await asyncio.sleep(self.retry_interval)
+                    continue
+            line = await reader.readline()
+            if not line:
+                reader = None
+                await asyncio.sleep(self.retry_interval)
+                continue
+            envelope = json.loads(line)
+            await self._dispatch(
+                envelope["topic"], envelope["message"], envelope["origin"]
+            )
+
+
+class MongoBus(EventBus):
+    """
+    跨機器的多個 worker: 經由 MongoDB capped collection 與 tailable cursor 轉發\n
+    單機 mongod 不支援 change stream，capped collection 在單機與 replica set 皆可使用。
+    資料庫斷線時只交給本 worker 的訂閱者。
+    """
+
+    def __init__(
+        self,
+        addr: str,
+        db_name: str = "depotDB",
+        collection: str = "events",
+        retry_interval: float = 1.0,
+    ) -> None:
+        """
+        Args:
+            addr: MongoDB 位址
+            db_name: 資料庫名稱
+            collection: capped collection 名稱（需列在 storage.SYSTEM_COLLECTIONS）
+            retry_interval: 斷線時的重試間隔秒數
+        """
+        super().__init__()
+        self.client = AsyncMongoClient(addr, serverSelectionTimeoutMS=2000)
+        self.db = self.client[db_name]
+        self.name = collection
+        self.events = self.db[collection]
+        self.retry_interval = retry_interval
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._tail_loop())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await self.client.close()
+
+    async def publish(self, topic: str, message: dict[str, Any]) -> None:
+        try:
+            await self.events.insert_one(
+                {"topic": topic, "origin": self.origin, "message": message}
+            )
+        except ConnectionFailure:
+            await self._dispatch(topic, message, self.origin)
+
+    async def _tail_loop(self) -> None:
+        """從最新一筆之後開始追蹤，游標失效或斷線時重新建立"""
+        last = None
+        while True:
+            try:
+                if last is None:
+                    await self._ensure_capped()
+                    latest = await self.events.find_one(sort=[("$natural", -1)])
+                    last = latest["_id"] if latest else 0
+                query = {"_id": {"$gt": last}} if last else {}
+                cursor = self.events.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+                while cursor.alive:
+                    async for doc in cursor:
+                        last = doc["_id"]
+                        await self._dispatch(doc["topic"], doc["message"], doc["origin"])
+                    await asyncio.sleep(0)
+                await asyncio.sleep(self.retry_interval)  # 空集合時游標會立即失效
+            except (ConnectionFailure, OperationFailure) as e:
+                _log_operation("WARNING", "事件匯流排讀取失敗", str(e))
+                await asyncio.sleep(self.retry_interval)
+
+    async def _ensure_capped(self) -> None:
+        try:
+            await self.db.create_collection(self.name, capped=True, size=EVENTS_SIZE)
+        except CollectionInvalid:
+            pass  # 已存在
+
+
+def create_bus(config: dict[str, Any], mongo_addr: str) -> EventBus:
+    """
+    依設定建立事件匯流排
+
+    Args:
+        config: server_config.json 的 bus 欄位
+            {"engine": "local" | "unix" | "mongo", "path", "drain_timeout"}
+        mongo_addr: MongoDB 位址（mongo 引擎使用）
+    """
+    engine = config.get("engine", "local")
+    if engine == "local":
+        return LocalBus()
+    if engine == "unix":
+        return UnixSocketBus(
+            config.get("path") or "/tmp/depot-bus.sock",
+            drain_timeout=config.get("drain_timeout", 5.0),
+        )
+    if engine == "mongo":
+        return MongoBus(mongo_addr)
+    raise ValueError(f"未知的事件匯流排: {engine}")
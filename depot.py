@@ -1,14 +1,46 @@
-from datetime import datetime, date
-from typing import Literal, Any, Iterator
-from pymongo import MongoClient, AsyncMongoClient
+from collections import OrderedDict
+from datetime import datetime, date, timedelta
+from typing import (
+    Literal,
+    Any,
+    AsyncIterator,
+    Iterator,
+    Callable,
+    Awaitable,
+    Generator,
+    TypeVar,
+)
+from storage import (
+    Storage,
+    AsyncStorage,
+    MongoStorage,
+    MemoryStorage,
+    AsyncMongoStorage,
+    AsyncMemoryStorage,
+    create_storage,
+    create_async_storage,
+)
+from pymongo.errors import ConnectionFailure
+from bom import BomStore
+from registry import item_tag
+from archive import RecordArchive, create_archive, daily_rollup
+from record_buffer import RecordBuffer
+from record_json import decode_batch, encode_batch, encode_records
+import asyncio
+import inspect
 import json
 import logging
 import sys
 
 MONGO_ADDR = "mongodb://localhost:27017/"
+SNAPSHOT_EVERY = 500  # 預設每 500 筆寫入保存一次庫存快照
+SNAPSHOT_SKEW = timedelta(seconds=1)  # 重播起始日的容許誤差（跨午夜寫入的紀錄）
+
+T = TypeVar("T")
 
 # 全局設定
 ENABLE_COLORS = True  # 設置為 False 可關閉顏色輸出
+ENABLE_SUCCESS_LOG = True  # 設置為 False 可關閉逐筆的成功日誌（大量匯入用）
 
 
 def set_color_mode(enabled: bool) -> None:
@@ -86,6 +118,9 @@ def _log_operation(
         item: 物品名稱
         amount: 數量
     """
+    if level == "SUCCESS" and not ENABLE_SUCCESS_LOG:
+        return
+
     # 根據等級選擇顏色和前綴
     if ENABLE_COLORS:
         if level == "SUCCESS":
@@ -139,11 +174,209 @@ def _log_operation(
         print(plain_message)
 
 
+def _change_event(
+    type: str,
+    item: str,
+    amount: int,
+    new_amount: int,
+    time: datetime,
+    source: str,
+    record_id: Any,
+    removed: bool = False,
+) -> dict[str, Any]:
+    """
+    組合庫存變動事件
+
+    Args:
+        type: 操作類型
+        item: 物品名稱
+        amount: 本次異動數量
+        new_amount: 異動後庫存數量
+        time: 紀錄時間
+        source: 資料來源
+        record_id: 紀錄 ID
+        removed: 物品是否已因歸零被移出倉庫
+
+    Returns:
+        dict[str, Any]: 可直接 JSON 序列化的事件字典
+    """
+    return {
+        "event": "change",
+        "item": item,
+        "amount": new_amount,
+        "op": type,
+        "delta": amount,
+        "source": source,
+        "record_id": str(record_id),
+        "time": time.isoformat(),
+        "removed": removed,
+    }
+
+
+class _LRUCache:
+    """固定大小的 LRU 快取 (idempotency key 的記憶體前端)"""
+
+    def __init__(self, maxsize: int = 1024) -> None:
+        self.maxsize = maxsize
+        self.data: OrderedDict[str, dict[str, Any]] = OrderedDict()
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        value = self.data.get(key)
+        if value is not None:
+            self.data.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: dict[str, Any]) -> None:
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+
+def _replayed(event: dict[str, Any]) -> dict[str, Any]:
+    """標記為重送的事件"""
+    return {**event, "replayed": True}
+
+
+def _snapshot_doc(docs: list[dict[str, Any]], seq: int) -> dict[str, Any]:
+    """
+    組合快照文件（物品以列表保存，避免名稱含 "." 或 "$" 無法作為欄位名稱）
+
+    Args:
+        docs: 庫存文件（含最後套用的紀錄序號 seq）
+        seq: 讀取庫存前已保留的最大紀錄序號
+
+    Note:
+        以紀錄序號（寫入順序）而非時間界定快照已計入哪些紀錄:
+        物品的 seq 與數量在同一次更新中寫入，重播時只套用序號更大的紀錄；
+        快照中沒有 seq 的物品（不存在或尚未以序號寫入）以快照的 seq 為界
+    """
+    now = datetime.now()
+    items = []
+    for doc in docs:
+        item = {"item": doc["item"], "amount": doc.get("amount", -32768)}
+        if doc.get("seq") is not None:
+            item["seq"] = doc["seq"]
+        items.append(item)
+    return {
+        "time": now.replace(microsecond=now.microsecond // 1000 * 1000),
+        "seq": seq,
+        "items": items,
+    }
+
+
+def _replay_days(
+    snapshot: dict[str, Any] | None, at: datetime, days: list[str]
+) -> list[str]:
+    """
+    需要重播的紀錄資料表: 快照當天（含）到 at 當天（含）
+
+    Args:
+        snapshot: 起點快照，None 表示從第一筆紀錄開始
+        at: 目標時間
+        days: 所有紀錄資料表名稱
+    """
+    first = f"{(snapshot['time'] - SNAPSHOT_SKEW).date()}" if snapshot else ""
+    return sorted(d for d in days if first <= d <= f"{at.date()}")
+
+
+def _replay_records(
+    snapshot: dict[str, Any] | None, records: list[dict[str, Any]], at: datetime
+) -> dict[str, int]:
+    """
+    從快照開始，依寫入順序重播快照未計入、時間在 at（含）之前的紀錄
+
+    Args:
+        snapshot: 起點快照，None 表示從空倉庫開始
+        records: 候選紀錄（可包含範圍外的紀錄）
+        at: 目標時間
+
+    Returns:
+        dict[str, int]: 物品名稱與數量
+    """
+    inventory: dict[str, int] = {}
+    tail = [r for r in records if r["time"] <= at]
+    if snapshot is not None:
+        inventory = {i["item"]: i["amount"] for i in snapshot["items"]}
+        if "seq" in snapshot:
+            default = snapshot["seq"]
+            floor = {i["item"]: i.get("seq", default) for i in snapshot["items"]}
+            tail = [
+                r for r in tail if (r.get("seq") or 0) > floor.get(r["item"], default)
+            ]
+        else:  # 舊格式快照: 以時間與快照保存的已計入紀錄 ID 判斷
+            since = snapshot["time"] - SNAPSHOT_SKEW
+            applied = set(snapshot.get("applied", []))
+            tail = [r for r in tail if r["time"] >= since and r["_id"] not in applied]
+
+    # 依序號（寫入順序）排序；沒有序號的舊紀錄在前，依時間排序
+    tail.sort(key=lambda r: (r.get("seq") or 0, r["time"]))
+    for r in tail:
+        current = inventory.get(r["item"], 0)
+        if r["type"] == "in":
+            inventory[r["item"]] = current + r["amount"]
+        elif r["type"] == "out":
+            inventory[r["item"]] = current - r["amount"]
+        else:  # set
+            inventory[r["item"]] = r["amount"]
+    return inventory
+
+
+def _inventory_drift(
+    inventory: dict[str, int], derived: dict[str, int]
+) -> dict[str, dict[str, int]]:
+    """
+    比對庫存表與紀錄重播結果（不存在的物品視為 0）
+
+    Returns:
+        dict[str, dict[str, int]]: {物品: {"inventory": 庫存表數量, "log": 紀錄重播數量}}，
+            一致時為空字典
+    """
+    return {
+        item: {"inventory": inventory.get(item, 0), "log": derived.get(item, 0)}
+        for item in sorted(set(inventory) | set(derived))
+        if inventory.get(item, 0) != derived.get(item, 0)
+    }
+
+
+def _archivable(days: list[str], keep_days: int) -> list[str]:
+    """超過保留天數的紀錄資料表（只處理 YYYY-MM-DD 名稱，今天永遠保留）"""
+    cutoff = date.today() - timedelta(days=max(keep_days, 1))
+    result = []
+    for day in days:
+        try:
+            if date.fromisoformat(day) < cutoff:
+                result.append(day)
+        except ValueError:
+            continue
+    return sorted(result)
+
+
+def _kit_parts(bom: BomStore, product: str) -> dict[str, int]:
+    """
+    取得產品展開後的原料數量
+
+    Raises:
+        DepotError: 產品未定義
+    """
+    if not bom.is_product(product):
+        raise DepotError(f"警告: BOM 中未定義產品 {product}。", "product")
+    return bom.expand(product)
+
+
+def _buildable(parts: dict[str, int], amounts: dict[str, int]) -> int:
+    """可組裝數量 = 各原料 (庫存 // 單位用量) 的最小值（沒有原料時為 0）"""
+    return min((max(amounts[p], 0) // qty for p, qty in parts.items()), default=0)
+
+
 class DepotItem:
     """
     模塊化紀錄倉庫進出\n
+    使用 __slots__（無每筆的 __dict__）；大量資料請用 item_batch.DepotItemBatch 整批驗證
     """
 
+    __slots__ = ("type", "item", "amount", "time")
+
     def __init__(
         self,
         type: Literal["in", "out", "auto", "set"],
@@ -187,6 +420,21 @@ class DepotItem:
     def __iter__(self) -> Any:
         return iter((self.type, self.item, self.amount, self.time))
 
+    def __repr__(self) -> str:
+        return f"DepotItem({self.type!r}, {self.item!r}, {self.amount!r}, {self.time!r})"
+
+    @classmethod
+    def _validated(
+        cls, type: Literal["in", "out", "set"], item: str, amount: int, time: datetime
+    ) -> "DepotItem":
+        """建立已驗證過的項目（跳過 __init__ 的檢查，供整批驗證後使用）"""
+        self = cls.__new__(cls)
+        self.type = type
+        self.item = item
+        self.amount = amount
+        self.time = time
+        return self
+
 
 class DepotError(Exception):
     """depot.py 報錯格式"""
@@ -206,17 +454,442 @@ class DepotError(Exception):
         super().__init__(error_msg)
 
 
-class Depot:
+def _next_amount(
+    type: Literal["in", "out", "set"], item: str, current_amount: int, amount: int
+) -> int:
+    """
+    計算異動後數量（Depot 與 AsyncDepot 共用）
+
+    Raises:
+        DepotError: 出庫後數量為負數
+    """
+    if type == "in":
+        return current_amount + amount
+    if type == "out":
+        if current_amount < amount:
+            raise DepotError(
+                f"警告: 紀錄目標 {item} 為負數，當前: {current_amount}，目標: {current_amount - amount}，已忽略此筆。"
+            )
+        return current_amount - amount
+    return amount  # set
+
+
+def _default_items() -> list[tuple[str, dict[str, Any]]]:
+    """
+    讀取 config/item_id.json 的預設物品
+
+    Returns:
+        list[tuple[str, dict[str, Any]]]: (物品名稱, tag) 列表
+    """
+    with open("./config/item_id.json", encoding="utf-8") as f:
+        j: list[dict[str, Any]] = json.load(f)
+    return [(i["name"], item_tag(i.get("setting", {}))) for i in j]
+
+
+def _replay_or_raise(key: str, doc: dict[str, Any] | None) -> dict[str, Any]:
+    """
+    key 已被佔用時的處理：已完成則返回原始事件，否則報錯
+
+    Raises:
+        DepotError: 相同 key 的寫入仍在處理中
+    """
+    if doc is not None and doc.get("result") is not None:
+        _log_operation("INFO", "重送請求", f"key: {key}，返回原始結果")
+        return doc["result"]
+    raise DepotError(
+        f"警告: 相同 idempotency key ({key}) 的寫入仍在處理中，已忽略此筆。",
+        "idempotency_key",
+    )
+
+
+Step = tuple[Any, ...]  # (函數, *參數): 交由 Depot / AsyncDepot 執行的一次 I/O
+Steps = Generator[Step, Any, T]
+
+
+def _run_steps(steps: Steps[T]) -> T:
+    """同步執行核心步驟: 逐一呼叫 yield 出的 I/O，結果 (或例外) 送回 generator"""
+    try:
+        step = next(steps)
+        while True:
+            fn, *args = step
+            try:
+                result = fn(*args)
+            except BaseException as err:  # 含 KeyboardInterrupt，讓核心可以清理
+                step = steps.throw(err)
+            else:
+                step = steps.send(result)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def _arun_steps(steps: Steps[T]) -> T:
+    """非同步執行核心步驟: 協程直接 await，其餘（封存檔等阻塞 I/O）移到背景執行緒"""
+    try:
+        step = next(steps)
+        while True:
+            fn, *args = step
+            try:
+                if inspect.iscoroutinefunction(fn):
+                    result = await fn(*args)
+                else:
+                    result = await asyncio.to_thread(fn, *args)
+            except BaseException as err:  # 含 CancelledError，讓核心可以清理
+                step = steps.throw(err)
+            else:
+                step = steps.send(result)
+    except StopIteration as stop:
+        return stop.value
+
+
+def _record_doc(
+    type: str, item: str, amount: int, time: datetime, source: str, seq: int
+) -> dict[str, Any]:
+    """組合紀錄文件"""
+    return {
+        "type": type,
+        "item": item,
+        "amount": amount,
+        "time": time,
+        "source": source,
+        "seq": seq,
+    }
+
+
+def _inventory_dict(docs: list[dict[str, Any]]) -> dict[str, int]:
+    """庫存文件 → {物品: 數量}"""
+    return {doc["item"]: doc.get("amount", -32768) for doc in docs}
+
+
+def _check_items(items: list[DepotItem], field: str) -> None:
+    """
+    檢查寫入項目的型別
+
+    Raises:
+        DepotError: 項目不是 DepotItem
+    """
+    for DItem in items:
+        if not isinstance(DItem, DepotItem):
+            expected = "DepotItem 實例" if field == "DItem" else "DepotItem 列表"
+            raise DepotError(
+                f"警告: {field} 必須是 {expected}，接收到 {type(DItem).__name__}",
+                field,
+            )
+
+
+def _missing_item(item: str) -> DepotError:
+    """物品不存在於倉庫的錯誤"""
+    return DepotError(f"警告: 倉庫內未找到 {item} 請確認已添加物品，已忽略此筆。")
+
+
+class _DepotCore:
+    """
+    Depot / AsyncDepot 共用的核心（不直接做 I/O）\n
+    - 驗證、紀錄與事件組合、idempotency、快照與重播、啟動與封存流程只寫一次\n
+    - 需要 I/O 的流程寫成 generator: yield (函數, *參數)，由外殼執行後把結果送回\n
+    - Depot 以 _run_steps 同步執行，AsyncDepot 以 _arun_steps await 執行
+    """
+
+    storage: Any  # Storage / AsyncStorage
+
+    def __init__(self, archive: RecordArchive | None) -> None:
+        self.archive: RecordArchive = archive or create_archive()  # 舊紀錄封存
+
+        self.remove_on_zero: bool = False  # 是否清除已歸零的倉位
+        self.idempotency_cache = _LRUCache()  # idempotency key 記憶體快取
+        self.snapshot_every: int = SNAPSHOT_EVERY  # 每幾筆寫入自動保存快照
+        self._writes_since_snapshot = 0
+        self.bom = BomStore()  # 產品物料清單 (config/bom.json)
+
+    def _seed_defaults(self, storage: Storage) -> None:
+        """配合 ESP 設備，於建構時（同步）插入 config/item_id.json 的預設物品"""
+        try:
+            for name, tag in _default_items():
+                storage.seed_item(name, 0, tag)
+        except ConnectionFailure as e:
+            # 資料庫未啟動: 由 Tool.warm_start / clear_inventory 補上
+            _log_operation("WARNING", "初始化預設物品失敗", str(e))
+
+    def _kit_items(self, product: str, count: int) -> list[DepotItem]:
+        """產品所需原料的出庫項目"""
+        _kit_parts(self.bom, product)
+        return [
+            DepotItem("out", part, qty)
+            for part, qty in self.bom.expand(product, count).items()
+        ]
+
+    # ---- 寫入 ----
+    def _idempotent_steps(
+        self, key: str | None, run: Steps[dict[str, Any]]
+    ) -> Steps[dict[str, Any]]:
+        """以 idempotency key 包裝寫入: 相同 key 只執行一次，重送時返回原始結果"""
+        if key is None:
+            return (yield from run)
+
+        cached = self.idempotency_cache.get(key)
+        if cached is not None:
+            return _replayed(cached)
+        if not (yield (self.storage.insert_key, key)):
+            event = _replay_or_raise(key, (yield (self.storage.get_key, key)))
+            self.idempotency_cache.put(key, event)
+            return _replayed(event)
+
+        try:
+            event = yield from run
+        except BaseException:
+            # 寫入失敗或被中斷 (Ctrl-C / 取消) 時釋放 key，讓客戶端可以重試
+            yield (self.storage.release_key, key)
+            raise
+
+        yield (self.storage.store_key_result, key, event)
+        self.idempotency_cache.put(key, event)
+        return event
+
+    def _write_steps(self, DItem: DepotItem, source: str) -> Steps[dict[str, Any]]:
+        """寫入庫存與當日紀錄"""
+        type, item, amount, time = DItem
+
+        # 取得現有庫存
+        item_doc = yield (self.storage.find_item, item)
+        current_amount = item_doc["amount"] if item_doc else 0
+        new_amount = _next_amount(type, item, current_amount, amount)
+
+        # 更新或新增庫存（與紀錄序號一起寫入，快照依序號判斷已計入的紀錄）
+        seq = yield (self.storage.reserve_seq, 1)
+        yield (self.storage.set_amount, item, new_amount, seq)
+
+        # 寫入當天的紀錄表
+        record = _record_doc(type, item, amount, time, source, seq)
+        record_id = yield (self._append_record, f"{date.today()}", record)
+        _log_operation(
+            "SUCCESS",
+            f"倉庫 {type} 操作",
+            f"紀錄 ID: {record_id}",
+            item,
+            amount,
+        )
+
+        # 刪除歸零倉庫位
+        removed = self.remove_on_zero and (
+            yield (self.storage.remove_if_empty, item)
+        )
+        if removed:
+            _log_operation("SUCCESS", "自動移除空物品", "", item)
+
+        event = _change_event(
+            type, item, amount, new_amount, time, source, record_id, removed
+        )
+        yield from self._committed_steps(event)
+        return event
+
+    def _batch_steps(
+        self, items: list[DepotItem], source: str
+    ) -> Steps[dict[str, Any]]:
+        """以單一交易寫入多筆庫存與紀錄"""
+        first = yield (self.storage.reserve_seq, len(items))
+        records = [
+            _record_doc(*DItem, source, first + i) for i, DItem in enumerate(items)
+        ]
+        results = yield (
+            self.storage.write_batch,
+            f"{date.today()}",
+            records,
+            _next_amount,
+        )
+
+        events = []
+        for r, (record_id, new_amount) in zip(records, results):
+            _log_operation(
+                "SUCCESS",
+                f"倉庫 {r['type']} 操作 (交易)",
+                f"紀錄 ID: {record_id}",
+                r["item"],
+                r["amount"],
+            )
+            events.append(
+                _change_event(
+                    r["type"],
+                    r["item"],
+                    r["amount"],
+                    new_amount,
+                    r["time"],
+                    source,
+                    record_id,
+                )
+            )
+
+        if self.remove_on_zero:
+            # 以每個物品的最後一筆事件標記移除
+            last = {event["item"]: event for event in events}
+            for item, event in last.items():
+                if (yield (self.storage.remove_if_empty, item)):
+                    event["removed"] = True
+                    _log_operation("SUCCESS", "自動移除空物品", "", item)
+
+        for event in events:
+            yield from self._committed_steps(event)
+        return {"event": "transaction", "events": events}
+
+    def _committed_steps(self, event: dict[str, Any]) -> Steps[None]:
+        """寫入完成後: 通知訂閱者，並累計自動快照"""
+        yield (self._notify, event)
+        self._writes_since_snapshot += 1
+        if self.snapshot_every and self._writes_since_snapshot >= self.snapshot_every:
+            yield from self._snapshot_steps()
+
+    # ---- 查詢 ----
+    def _inventory_steps(self) -> Steps[dict[str, int]]:
+        return _inventory_dict((yield (self.storage.list_items,)))
+
+    def _existing_steps(self, item: str) -> Steps[dict[str, Any]]:
+        """
+        取得物品文件
+
+        Raises:
+            DepotError: 物品不存在於倉庫中
+        """
+        doc = yield (self.storage.find_item, item)
+        if doc is None:
+            raise _missing_item(item)
+        return doc
+
+    def _set_tag_steps(self, item: str, tag: dict[str, Any]) -> Steps[None]:
+        yield from self._existing_steps(item)
+        yield (self.storage.set_tag, item, tag)
+
+    def _find_records_steps(self, date: str) -> Steps[list[Any] | None]:
+        if self.archive.has(date):
+            return (yield (self.archive.read, date))
+        if date not in (yield (self.storage.record_days,)):
+            return None
+        return (yield (self.storage.find_records, date))
+
+    def _rollup_steps(self, date: str) -> Steps[dict[str, dict[str, int]] | None]:
+        rollup = self.archive.rollup(date)
+        if rollup is not None:
+            return rollup
+        records = yield from self._find_records_steps(date)
+        return None if records is None else daily_rollup(records)
+
+    # ---- 快照與重播 ----
+    def _snapshot_steps(self) -> Steps[dict[str, Any]]:
+        seq = yield (self.storage.last_seq,)  # 先讀序號，再讀庫存
+        snapshot = _snapshot_doc((yield (self.storage.list_items,)), seq)
+        yield (self.storage.save_snapshot, snapshot)
+        self._writes_since_snapshot = 0
+        _log_operation("INFO", "保存庫存快照", f"{len(snapshot['items'])} 項物品")
+        return snapshot
+
+    def _inventory_at_steps(self, timestamp: datetime) -> Steps[dict[str, int]]:
+        snapshot = yield (self.storage.find_snapshot, timestamp)
+        records = []
+        days = list({*(yield (self.storage.record_days,)), *self.archive.days()})
+        for day in _replay_days(snapshot, timestamp, days):
+            records.extend((yield from self._find_records_steps(day)) or [])
+        return _replay_records(snapshot, records, timestamp)
+
+    def _consistency_steps(self) -> Steps[dict[str, dict[str, int]]]:
+        inventory = yield from self._inventory_steps()
+        derived = yield from self._inventory_at_steps(datetime.now())
+        drift = _inventory_drift(inventory, derived)
+        if drift:
+            _log_operation("WARNING", "庫存與紀錄不一致", f"{len(drift)} 項: {drift}")
+        else:
+            _log_operation("SUCCESS", "庫存與紀錄一致")
+        return drift
+
+    # ---- 管理工具 (Tool) ----
+    def _clear_steps(self, double_check: bool) -> Steps[bool]:
+        if not double_check:
+            _log_operation(
+                "WARNING",
+                "清空倉庫操作",
+                "double_check 參數必須為 True 才能執行清空操作",
+            )
+            return False
+
+        try:
+            # 刪除 inventory 資料表中的所有文件
+            deleted = yield (self.storage.clear_inventory,)
+            _log_operation("SUCCESS", "清空倉庫", f"共刪除 {deleted} 筆資料")
+            for name, tag in _default_items():
+                yield (self.storage.seed_item, name, 0, tag)
+            yield from self._snapshot_steps()  # 清空不留紀錄，以快照作為新的重播起點
+            inventory = yield from self._inventory_steps()
+            yield (self._notify, {"event": "reset", "items": inventory})
+            return True
+        except Exception as e:
+            _log_operation("ERROR", "清空倉庫失敗", str(e))
+            return False
+
+    def _warm_start_steps(self, repair: bool) -> Steps[dict[str, Any]]:
+        existing = {d["item"] for d in (yield (self.storage.list_items,))}
+        seeded = []
+        for name, tag in _default_items():
+            if name not in existing:
+                yield (self.storage.seed_item, name, 0, tag)
+                seeded.append(name)
+
+        drift = yield from self._consistency_steps()
+        if drift and repair:
+            for item, amounts in drift.items():
+                yield (self.storage.set_amount, item, amounts["log"])
+            _log_operation(
+                "WARNING", "以紀錄修正庫存", f"{len(drift)} 項: {list(drift)}"
+            )
+        # 不修正時差異已記錄於日誌與回傳值，仍保存快照，下次啟動不必重播全部紀錄
+        yield from self._snapshot_steps()
+
+        inventory = yield from self._inventory_steps()
+        _log_operation(
+            "SUCCESS",
+            "保留庫存啟動",
+            f"{len(inventory)} 項物品，補上 {len(seeded)} 項",
+        )
+        yield (self._notify, {"event": "reset", "items": inventory})
+        return {"seeded": seeded, "drift": drift, "repaired": bool(drift) and repair}
+
+    def _archive_steps(self, keep_days: int) -> Steps[list[str]]:
+        archived = []
+        for day in _archivable((yield (self.storage.record_days,)), keep_days):
+            try:
+                records = yield (self.storage.find_records, day)
+                if not self.archive.has(day):
+                    yield (self.archive.write, day, records)
+                yield (self.storage.drop_records, day)
+                archived.append(day)
+            except Exception as e:
+                _log_operation("ERROR", "封存紀錄失敗", f"{day}: {e}")
+                break
+        if archived:
+            _log_operation(
+                "SUCCESS",
+                "封存紀錄",
+                f"{len(archived)} 天 ({archived[0]} ~ {archived[-1]})",
+            )
+        return archived
+
+
+class Depot(_DepotCore):
     """
     倉庫紀錄\n
     - write 將紀錄寫入資料庫\n
+    - write_transaction 以單一交易寫入多筆紀錄（全部成功或全部不寫入）\n
+    - buildable 依 BOM 計算產品目前可組裝數量\n
+    - consume_kit 依 BOM 一次扣除產品所需的全部原料\n
     - show_inventory 打印當前倉庫\n
     - get_inventory 輸出當前倉庫\n
     - in_inventory 該資料是否存在\n
     - set_tag 設定tag標籤\n
     - get_tag_json 取得該物品的tag頁\n
-    - find_records 依據日期尋找資料表\n
+    - find_records 依據日期尋找資料表（已封存的日期自動讀取封存檔）\n
+    - iter_records / iter_records_json 依日期分批輸出紀錄 / JSON（大量紀錄用）\n
     - date_collections 獲取所有非 inventory 的子資料表\n
+    - archived_days 已封存的日期\n
+    - rollup 每日各物品的進出彙總\n
+    - add_listener 訂閱庫存變動事件\n
+    - take_snapshot 保存庫存快照\n
+    - inventory_at 還原指定時間的庫存（最近快照 + 重播之後的紀錄）\n
+    - check_consistency 檢查庫存表與紀錄是否一致\n
     \n
     使用範例: \n
       from depot import Depot, DepotItem
@@ -228,40 +901,153 @@ class Depot:
     \n
     設定: \n
     - 可設定 Depot.remove_on_zero 進行移除等於零的欄位\n
+    - 可設定 Depot.snapshot_every 調整自動快照的寫入間隔 (0 關閉)\n
+    - 儲存引擎由 server_config.json 的 storage.engine 選擇 ("mongo" / "memory")，
+      或直接傳入 Depot(storage=MemoryStorage())\n
+    - 舊紀錄由 tool.archive_records 移到 storage.archive 目錄，或傳入 Depot(archive=RecordArchive(...))\n
+    \n
+    邏輯與 AsyncDepot 共用（_DepotCore），此類別只負責同步執行 I/O
     """
 
-    def __init__(self) -> None:
-        # 連線
-        self.client = MongoClient(MONGO_ADDR)
-        self.db = self.client["depotDB"]
-
-        # 資料表
-        self.inventory = self.db["inventory"]  # 倉庫
-        self.collection = self.__today_collection  # 當日交易紀錄
-
-        self.remove_on_zero: bool = False  # 是否清除已歸零的倉位
+    def __init__(
+        self,
+        storage: Storage | None = None,
+        archive: RecordArchive | None = None,
+        seed_items: bool = True,
+    ) -> None:
+        """
+        Args:
+            storage: 儲存引擎，預設依 server_config.json 建立
+            archive: 舊紀錄封存，預設依 server_config.json 建立
+            seed_items: 是否在建構時插入缺少的預設物品
+        """
+        # 儲存引擎
+        self.storage: Storage = storage or create_storage(MONGO_ADDR)
+        self.listeners: list[Callable[[dict[str, Any]], None]] = []  # 庫存變動訂閱者
+        super().__init__(archive)
 
         # 添加預設資料
-        self.__init_default_items()
+        if seed_items:
+            self._seed_defaults(self.storage)
 
         # 初始化工具類別
         self.tool = self.Tool(self)
 
-    def write(self, DItem: DepotItem, source: str = "local") -> None:
+    _run = staticmethod(_run_steps)
+
+    def write(
+        self,
+        DItem: DepotItem,
+        source: str = "local",
+        idempotency_key: str | None = None,
+    ) -> dict[str, Any]:
         """
         新增一筆進出貨資料
 
         Args:
             DItem: DepotItem 實例，包含操作詳細資訊
             source: 資料來源標識，預設為 "local"
+            idempotency_key: 重送識別碼（可選），相同 key 只會寫入一次
+
+        Returns:
+            dict[str, Any]: 庫存變動事件（格式見 add_listener），
+                重送時返回原始事件並附加 "replayed": True
         """
-        if not isinstance(DItem, DepotItem):
-            raise DepotError(
-                f"警告: DItem 必須是 DepotItem 實例，接收到 {type(DItem).__name__}",
-                "DItem",
-            )
+        _check_items([DItem], "DItem")
+        return self._run(
+            self._idempotent_steps(idempotency_key, self._write_steps(DItem, source))
+        )
 
-        self.__write_to_db(*DItem, source=source)
+    def write_transaction(
+        self,
+        items: list[DepotItem],
+        source: str = "local",
+        idempotency_key: str | None = None,
+    ) -> dict[str, Any]:
+        """
+        以單一交易寫入多筆進出貨資料，任一筆失敗（例如出庫後為負數）則全部不寫入
+
+        Args:
+            items: DepotItem 列表，依序套用（同一物品可出現多次）
+            source: 資料來源標識，預設為 "local"
+            idempotency_key: 重送識別碼（可選），相同 key 整批只會寫入一次
+
+        Returns:
+            dict[str, Any]: {"event": "transaction", "events": [庫存變動事件]}，
+                重送時返回原始結果並附加 "replayed": True
+
+        範例:\n
+          depot.write_transaction(
+              [DepotItem("out", "麵粉", 2), DepotItem("out", "雞蛋", 3)], "menu", "order-42"
+          )
+        """
+        _check_items(items, "items")
+        return self._run(
+            self._idempotent_steps(idempotency_key, self._batch_steps(items, source))
+        )
+
+    def buildable(self, product: str) -> int:
+        """
+        依 BOM 計算產品目前可組裝的數量
+
+        Args:
+            product: 產品名稱（定義於 config/bom.json）
+
+        Returns:
+            int: 可組裝數量（受最缺的原料限制）
+        """
+        parts = _kit_parts(self.bom, product)
+        return _buildable(
+            parts,
+            {p: (self.storage.find_item(p) or {}).get("amount", 0) for p in parts},
+        )
+
+    def consume_kit(
+        self,
+        product: str,
+        count: int = 1,
+        source: str = "local",
+        idempotency_key: str | None = None,
+    ) -> dict[str, Any]:
+        """
+        依 BOM 以單一交易扣除產品所需的全部原料（任一原料不足則全部不扣）
+
+        Args:
+            product: 產品名稱
+            count: 產品數量
+            source: 資料來源標識
+            idempotency_key: 重送識別碼（可選）
+
+        Returns:
+            dict[str, Any]: 同 write_transaction
+        """
+        items = self._kit_items(product, count)
+        return self.write_transaction(items, source, idempotency_key)
+
+    def _append_record(self, day: str, record: dict[str, Any]) -> Any:
+        return self.storage.append_record(day, record)
+
+    def add_listener(self, callback: Callable[[dict[str, Any]], None]) -> None:
+        """
+        訂閱庫存變動事件，每次寫入成功後呼叫
+
+        Args:
+            callback: 接收事件字典的函數，事件格式:
+                - {"event": "change", "item", "amount"(新數量), "op", "delta", "source", "record_id", "time", "removed"}
+                - {"event": "reset", "items": {物品: 數量}}
+
+        Note:
+            訂閱者拋出的例外只會記錄，不影響寫入結果
+        """
+        self.listeners.append(callback)
+
+    def _notify(self, event: dict[str, Any]) -> None:
+        """通知所有訂閱者"""
+        for callback in self.listeners:
+            try:
+                callback(event)
+            except Exception as err:
+                _log_operation("WARNING", "庫存事件通知失敗", str(err))
 
     def get_inventory(self) -> dict[str, int] | None:
         """
@@ -276,11 +1062,7 @@ class Depot:
            for name, amount in inventory.items():
             print(name, amount)
         """
-        Doc = list(self.inventory.find())
-        if Doc == []:
-            return None
-        else:
-            return {items["item"]: items.get("amount", -32768) for items in Doc}
+        return self._run(self._inventory_steps()) or None
 
     def show_inventory(self) -> None:
         """
@@ -298,71 +1080,6 @@ class Depot:
         else:
             _log_operation("INFO", "倉庫狀態", "倉庫為空")
 
-    def __write_to_db(
-        self,
-        type: Literal["in", "out", "set"],
-        item: str,
-        amount: int,
-        time: datetime,
-        source: str,
-    ) -> None:
-        # 重新獲取日期
-        self.collection = self.__today_collection
-
-        # 取得現有庫存
-        item_doc = self.inventory.find_one({"item": item})
-        current_amount = item_doc["amount"] if item_doc else 0
-
-        if type == "in":
-            new_amount = current_amount + amount
-        elif type == "out":
-            if current_amount < amount:
-                raise DepotError(
-                    f"警告: 紀錄目標 {item} 為負數，當前: {current_amount}，目標: {current_amount - amount}，已忽略此筆。"
-                )
-            else:
-                new_amount = current_amount - amount
-        elif type == "set":
-            new_amount = amount
-
-        # 更新或新增庫存
-        self.inventory.update_one(
-            {"item": item},
-            {"$set": {"amount": new_amount}, "$setOnInsert": {"tag": {}}},
-            upsert=True,
-        )
-
-        # 寫入當天的紀錄表
-        record = {
-            "type": type,
-            "item": item,
-            "amount": amount,
-            "time": time,
-            "source": source,
-        }
-        result = self.collection.insert_one(record)
-        _log_operation(
-            "SUCCESS",
-            f"倉庫 {type} 操作",
-            f"紀錄 ID: {result.inserted_id}",
-            item,
-            amount,
-        )
-
-        # 刪除歸零倉庫位
-        if self.remove_on_zero:
-            self.inventory.delete_one(
-                {
-                    "item": item,
-                    "amount": 0,
-                    "$or": [
-                        {"tag.no_auto_remove": {"$ne": True}},
-                        {"tag.no_auto_remove": {"$exists": False}},
-                    ],
-                }
-            )
-            _log_operation("SUCCESS", "自動移除空物品", "", item)
-
     def set_tag(self, item: str, tag: dict[str, Any]) -> None:
         """
         為倉庫資料插入 tag 屬性
@@ -374,14 +1091,12 @@ class Depot:
         Note:
             如果物品不存在於倉庫中，將輸出警告訊息
         """
-        data = self.inventory.find_one({"item": item})
-        if data == None:
+        if self.storage.find_item(item) is None:
             _log_operation(
                 "WARNING", "設置標籤失敗", "倉庫內未找到物品，請確認已添加物品", item
             )
             return None
-
-        self.inventory.update_one({"item": item}, {"$set": {f"tag": tag}}, upsert=True)
+        self.storage.set_tag(item, tag)
 
     def get_tag_json(self, item: str) -> dict[str, Any] | None:
         """
@@ -393,13 +1108,12 @@ class Depot:
         Returns:
             dict[str, Any] | None: 標籤字典，如果物品不存在則返回 None
         """
-        data = self.inventory.find_one({"item": item})
-        if data == None:
+        data = self.storage.find_item(item)
+        if data is None:
             _log_operation(
                 "WARNING", "獲取標籤失敗", "倉庫內未找到物品，請確認已添加物品", item
             )
             return None
-
         return dict(data).get("tag", {})
 
     def in_inventory(self, item: str) -> bool:
@@ -412,7 +1126,7 @@ class Depot:
         Returns:
             bool: 物品是否存在於倉庫中
         """
-        if self.inventory.find_one({"item": item}) is None:
+        if self.storage.find_item(item) is None:
             _log_operation(
                 "WARNING", "檢查物品存在性", "倉庫內未找到物品，請確認已添加物品", item
             )
@@ -429,20 +1143,45 @@ class Depot:
         Returns:
             list | None: 該日期的紀錄列表，如果不存在則返回 None
         """
+        return self._run(self._find_records_steps(date))
 
-        if date not in self.date_collections:
-            return None
-        return list(self.db[date].find())
+    def iter_records(self, date: str) -> Iterator[dict[str, Any]]:
+        """
+        依日期逐筆輸出紀錄（分批讀取，記憶體用量不隨當日筆數增加）
 
-    @property
-    def __today_collection(self):
+        Args:
+            date: 日期字串，格式為 YYYY-MM-DD（需先確認存在）
+
+        Yields:
+            dict[str, Any]: 紀錄
         """
-        當日資料表
+        if self.archive.has(date):
+            yield from self.archive.read(date) or []
+            return
+        for raw in self.storage.iter_record_batches(date):
+            yield from decode_batch(raw)
 
-        Returns:
-            Collection: 當前日期對應的 MongoDB 集合
+    def iter_records_json(self, date: str) -> Iterator[bytes]:
+        """
+        依日期以 JSON 陣列分段輸出紀錄（不建立整天的紀錄列表）
+
+        Args:
+            date: 日期字串，格式為 YYYY-MM-DD（需先確認存在）
+
+        Yields:
+            bytes: JSON 片段，串接後為 [{"_id", "type", "item", "amount", "time", "source"}]
         """
-        return self.db[f"{date.today()}"]
+        yield b"["
+        if self.archive.has(date):
+            yield encode_records(self.archive.read(date) or [])
+        else:
+            first = True
+            for raw in self.storage.iter_record_batches(date):
+                chunk = encode_batch(raw)
+                if chunk:
+                    yield chunk if first else b"," + chunk
+                    first = False
+        yield b"]"
 
     @property
     def date_collections(self) -> list[str]:
@@ -452,39 +1191,62 @@ class Depot:
         Returns:
             list[str]: 日期格式的資料表名稱列表
         """
-        return [i for i in self.db.list_collection_names() if i != "inventory"]
+        return self.storage.record_days()
 
-    def __init_default_items(self):
+    @property
+    def archived_days(self) -> list[str]:
         """
-        配合 ESP 設備，給資料庫插入預設物品
+        已封存（不在資料庫中）的日期
 
-        Note:
-            從 config/item_id.json 讀取配置並初始化預設物品至資料庫
-        """
-        j: dict = json.load(open("./config/item_id.json", encoding="utf-8"))
-        lst = [j[i]["name"] for i in range(len(j))]
-        for i in range(len(lst)):
-            self.inventory.update_one(
-                {"item": j[i]["name"]},
-                {
-                    # "$setOnInsert": {
-                    #     "amount": 0,
-                    # },
-                    "$set": {
-                        "amount": 0,
-                        "tag": {
-                            "no_auto_remove": j[i]["setting"].get(
-                                "no_auto_remove", False
-                            ),
-                            "unit_weight": j[i]["setting"].get("unit_weight", 0),
-                            "min_weight_warning": j[i]["setting"].get(
-                                "min_weight_warning", 0
-                            ),
-                        },
-                    },
-                },
-                upsert=True,
-            )
+        Returns:
+            list[str]: 日期格式的名稱列表
+        """
+        return self.archive.days()
+
+    def rollup(self, date: str) -> dict[str, dict[str, int]] | None:
+        """
+        每日各物品的進出彙總（已封存的日期直接讀取索引，不需解壓）
+
+        Args:
+            date: 日期字串，格式為 YYYY-MM-DD
+
+        Returns:
+            dict[str, dict[str, int]] | None: {物品: {"in", "out", "set", "count"}}，日期不存在時為 None
+        """
+        return self._run(self._rollup_steps(date))
+
+    def take_snapshot(self) -> dict[str, Any]:
+        """
+        保存目前庫存的快照，作為 inventory_at 重播的起點
+
+        Returns:
+            dict[str, Any]: 快照文件 {"time", "seq", "items"}
+        """
+        return self._run(self._snapshot_steps())
+
+    def inventory_at(self, timestamp: datetime) -> dict[str, int]:
+        """
+        還原指定時間的庫存: 載入不晚於該時間的最近快照，只重播之後的紀錄
+
+        Args:
+            timestamp: 目標時間
+
+        Returns:
+            dict[str, int]: 物品名稱與數量的字典
+
+        範例:\n
+          depot.inventory_at(datetime(2025, 6, 3, 14, 0))
+        """
+        return self._run(self._inventory_at_steps(timestamp))
+
+    def check_consistency(self) -> dict[str, dict[str, int]]:
+        """
+        檢查 inventory 資料表與紀錄重播結果是否一致
+
+        Returns:
+            dict[str, dict[str, int]]: 不一致的物品 {物品: {"inventory", "log"}}，一致時為空字典
+        """
+        return self._run(self._consistency_steps())
 
     class Tool:
         """
@@ -501,9 +1263,7 @@ class Depot:
                 parent_depot: 父級 Depot 實例
             """
             self.parent = parent_depot
-            self.client = parent_depot.client
-            self.db = parent_depot.db
-            self.inventory = parent_depot.inventory
+            self.storage = parent_depot.storage
 
         def clear_inventory(self, double_check: bool) -> bool:
             """
@@ -515,36 +1275,54 @@ class Depot:
             Returns:
                 bool: 操作是否成功
             """
-            if not double_check:
-                _log_operation(
-                    "WARNING",
-                    "清空倉庫操作",
-                    "double_check 參數必須為 True 才能執行清空操作",
-                )
-                return False
+            return self.parent._run(self.parent._clear_steps(double_check))
 
-            try:
-                # 刪除 inventory 資料表中的所有文件
-                result = self.inventory.delete_many({})
-                _log_operation(
-                    "SUCCESS", "清空倉庫", f"共刪除 {result.deleted_count} 筆資料"
-                )
-                self.parent.__init__()
-                return True
-            except Exception as e:
-                _log_operation("ERROR", "清空倉庫失敗", str(e))
-                return False
+        def warm_start(self, repair: bool = False) -> dict[str, Any]:
+            """
+            保留現有庫存啟動（取代 clear_inventory）:
+            只補上缺少的預設物品，並從最近快照重播之後的紀錄驗證庫存，再保存新快照作為下次的起點
+
+            Args:
+                repair: 不一致時是否以紀錄重播結果覆寫庫存數量
 
+            Returns:
+                dict[str, Any]: {"seeded": 補上的物品, "drift": 不一致的物品, "repaired": 是否已覆寫}
+            """
+            return self.parent._run(self.parent._warm_start_steps(repair))
+
+        def archive_records(self, keep_days: int) -> list[str]:
+            """
+            將超過保留天數的紀錄資料表移到封存檔（寫入封存後才刪除資料表）
 
-class AsyncDepot:
+            Args:
+                keep_days: 資料庫中保留的天數
+
+            Returns:
+                list[str]: 本次封存的日期
+            """
+            return self.parent._run(self.parent._archive_steps(keep_days))
+
+
+class AsyncDepot(_DepotCore):
     """
     非同步-倉庫紀錄\n
     - write 將紀錄寫入資料庫\n
+    - write_transaction 以單一交易寫入多筆紀錄（全部成功或全部不寫入）\n
+    - buildable 依 BOM 計算產品目前可組裝數量\n
+    - consume_kit 依 BOM 一次扣除產品所需的全部原料\n
     - get_inventory 輸出當前倉庫\n
+    - in_inventory 該資料是否存在\n
     - set_tag 設定tag標籤\n
     - get_tag_json 取得該物品的tag頁\n
-    - find_records 依據日期尋找資料表\n
+    - find_records 依據日期尋找資料表（已封存的日期自動讀取封存檔）\n
+    - iter_records / iter_records_json 依日期分批輸出紀錄 / JSON（大量紀錄的串流回應）\n
     - date_collections 獲取所有非 inventory 的子資料表\n
+    - archived_days 已封存的日期\n
+    - rollup 每日各物品的進出彙總\n
+    - add_listener 訂閱庫存變動事件\n
+    - take_snapshot 保存庫存快照\n
+    - inventory_at 還原指定時間的庫存（最近快照 + 重播之後的紀錄）\n
+    - check_consistency 檢查庫存表與紀錄是否一致\n
     \n
     使用範例:\n
 
@@ -561,102 +1339,150 @@ class AsyncDepot:
     \n
     設定: \n
     - 可設定 Depot.remove_on_zero 進行移除等於零的欄位\n
+    - 可設定 Depot.snapshot_every 調整自動快照的寫入間隔 (0 關閉)\n
+    - 儲存引擎同 Depot，可傳入 AsyncDepot(storage=AsyncMemoryStorage(...))\n
+    - 封存同 Depot，可傳入 AsyncDepot(archive=RecordArchive(...))\n
+    - 可設定 AsyncDepot.record_buffer = RecordBuffer(...) 將紀錄集中批次寫入 (None 關閉)\n
+    \n
+    邏輯與 Depot 共用（_DepotCore），此類別只負責以 await 執行 I/O
     """
 
-    def __init__(self) -> None:
-        # 連線
-        self.client = AsyncMongoClient(MONGO_ADDR)
-        self.db = self.client["depotDB"]
-
-        # 資料表
-        self.inventory = self.db["inventory"]  # 倉庫
-        self.collection = self.db[f"{date.today()}"]  # 交易紀錄
-
-        self.remove_on_zero: bool = False  # 是否清除已歸零的倉位
+    def __init__(
+        self,
+        storage: AsyncStorage | None = None,
+        archive: RecordArchive | None = None,
+        seed_items: bool = True,
+    ) -> None:
+        """
+        Args:
+            storage: 儲存引擎，預設依 server_config.json 建立
+            archive: 舊紀錄封存，預設依 server_config.json 建立
+            seed_items: 是否在建構時（同步）插入缺少的預設物品；
+                False 時不連線資料庫，由 tool.warm_start / clear_inventory 在啟動後補上
+        """
+        # 儲存引擎
+        self.storage: AsyncStorage = storage or create_async_storage(MONGO_ADDR)
+        self.listeners: list[Callable[[dict[str, Any]], Awaitable[None]]] = []  # 庫存變動訂閱者
+        self.record_buffer: RecordBuffer | None = None  # 紀錄 write-behind 緩衝
+        super().__init__(archive)
 
-        # 添加預設資料
-        sync_depot = Depot()
-        sync_depot._Depot__init_default_items()  # type: ignore
+        # 添加預設資料（以同步介面在建構時完成）
+        if seed_items:
+            self._seed_defaults(self.storage.sync)
 
         # 初始化工具類別
         self.tool = self.Tool(self)
 
-    async def write(self, DItem: DepotItem, source: str = "local") -> None:
+    _run = staticmethod(_arun_steps)
+
+    async def write(
+        self,
+        DItem: DepotItem,
+        source: str = "local",
+        idempotency_key: str | None = None,
+    ) -> dict[str, Any]:
         """
         新增一筆進出貨資料（非同步版本）
 
         Args:
             DItem: DepotItem 實例，包含操作詳細資訊
             source: 資料來源標識，預設為 "local"
-        """
-        if not isinstance(DItem, DepotItem):
-            raise DepotError(
-                f"警告: DItem 必須是 DepotItem 實例，接收到 {type(DItem).__name__}",
-                "DItem",
-            )
+            idempotency_key: 重送識別碼（可選），相同 key 只會寫入一次
 
-        # 重新獲取日期
-        self.collection = self.db[f"{date.today()}"]
+        Returns:
+            dict[str, Any]: 庫存變動事件（格式見 Depot.add_listener），
+                重送時返回原始事件並附加 "replayed": True
+        """
+        _check_items([DItem], "DItem")
+        return await self._run(
+            self._idempotent_steps(idempotency_key, self._write_steps(DItem, source))
+        )
 
-        # 解包資料
-        operation_type: Literal["in", "out", "set"] = DItem.type
-        item: str = DItem.item
-        amount: int = DItem.amount
-        time: datetime = DItem.time
+    async def write_transaction(
+        self,
+        items: list[DepotItem],
+        source: str = "local",
+        idempotency_key: str | None = None,
+    ) -> dict[str, Any]:
+        """
+        以單一交易寫入多筆進出貨資料（非同步版本），任一筆失敗則全部不寫入
 
-        # 取得現有庫存
-        item_doc = await self.inventory.find_one({"item": item})
-        current_amount = item_doc["amount"] if item_doc else 0
+        Args:
+            items: DepotItem 列表，依序套用（同一物品可出現多次）
+            source: 資料來源標識，預設為 "local"
+            idempotency_key: 重送識別碼（可選），相同 key 整批只會寫入一次
 
-        if operation_type == "in":
-            new_amount = current_amount + amount
-        elif operation_type == "out":
-            if current_amount < amount:
-                raise DepotError(
-                    f"警告: 紀錄目標 {item} 為負數，當前: {current_amount}，目標: {current_amount - amount}，已忽略此筆。"
-                )
-            else:
-                new_amount = current_amount - amount
-        elif operation_type == "set":
-            new_amount = amount
-
-        # 更新或新增庫存
-        await self.inventory.update_one(
-            {"item": item},
-            {"$set": {"amount": new_amount}, "$setOnInsert": {"tag": {}}},
-            upsert=True,
+        Returns:
+            dict[str, Any]: {"event": "transaction", "events": [庫存變動事件]}，
+                重送時返回原始結果並附加 "replayed": True
+        """
+        _check_items(items, "items")
+        return await self._run(
+            self._idempotent_steps(idempotency_key, self._batch_steps(items, source))
         )
 
-        # 寫入當天的紀錄表
-        record = {
-            "type": operation_type,
-            "item": item,
-            "amount": amount,
-            "time": time,
-            "source": source,
-        }
-        result = await self.collection.insert_one(record)
-        _log_operation(
-            "SUCCESS",
-            f"倉庫 {operation_type} 操作",
-            f"紀錄 ID: {result.inserted_id}",
-            item,
-            amount,
+    async def buildable(self, product: str) -> int:
+        """
+        依 BOM 計算產品目前可組裝的數量（非同步版本）
+
+        Args:
+            product: 產品名稱（定義於 config/bom.json）
+
+        Returns:
+            int: 可組裝數量（受最缺的原料限制）
+        """
+        parts = _kit_parts(self.bom, product)
+        docs = await asyncio.gather(*(self.storage.find_item(p) for p in parts))
+        return _buildable(
+            parts, {p: (d or {}).get("amount", 0) for p, d in zip(parts, docs)}
         )
 
-        # 刪除歸零倉庫位
-        if self.remove_on_zero:
-            await self.inventory.delete_one(
-                {
-                    "item": item,
-                    "amount": 0,
-                    "$or": [
-                        {"tag.no_auto_remove": {"$ne": True}},
-                        {"tag.no_auto_remove": {"$exists": False}},
-                    ],
-                }
-            )
-            _log_operation("SUCCESS", "自動移除空物品", "", item)
+    async def consume_kit(
+        self,
+        product: str,
+        count: int = 1,
+        source: str = "local",
+        idempotency_key: str | None = None,
+    ) -> dict[str, Any]:
+        """
+        依 BOM 以單一交易扣除產品所需的全部原料（非同步版本）
+
+        Args:
+            product: 產品名稱
+            count: 產品數量
+            source: 資料來源標識
+            idempotency_key: 重送識別碼（可選）
+
+        Returns:
+            dict[str, Any]: 同 write_transaction
+        """
+        items = self._kit_items(product, count)
+        return await self.write_transaction(items, source, idempotency_key)
+
+    async def _append_record(self, day: str, record: dict[str, Any]) -> Any:
+        """寫入紀錄（有緩衝時與其他寫入合併成一次 insert_many）"""
+        if self.record_buffer is not None:
+            return await self.record_buffer.append(day, record)
+        return await self.storage.append_record(day, record)
+
+    def add_listener(
+        self, callback: Callable[[dict[str, Any]], Awaitable[None]]
+    ) -> None:
+        """
+        訂閱庫存變動事件（非同步版本），每次寫入成功後 await 呼叫
+
+        Args:
+            callback: 接收事件字典的 async 函數，事件格式同 Depot.add_listener
+        """
+        self.listeners.append(callback)
+
+    async def _notify(self, event: dict[str, Any]) -> None:
+        """通知所有訂閱者（非同步版本）"""
+        for callback in self.listeners:
+            try:
+                await callback(event)
+            except Exception as err:
+                _log_operation("WARNING", "庫存事件通知失敗", str(err))
 
     async def get_inventory(self) -> dict[str, int]:
         """
@@ -672,10 +1498,7 @@ class AsyncDepot:
             for name, amount in inventory.items():
               print(name, amount)
         """
-        return {
-            items["item"]: items.get("amount", -32768)
-            async for items in self.inventory.find()
-        }
+        return await self._run(self._inventory_steps())
 
     async def set_tag(self, item: str, tag: dict[str, Any]) -> None:
         """
@@ -688,17 +1511,9 @@ class AsyncDepot:
         Raises:
             DepotError: 如果物品不存在於倉庫中
         """
-        data = await self.inventory.find_one({"item": item})
-        if data is None:
-            raise DepotError(
-                f"警告: 倉庫內未找到 {item} 請確認已添加物品，已忽略此筆。"
-            )
+        await self._run(self._set_tag_steps(item, tag))
 
-        await self.inventory.update_one(
-            {"item": item}, {"$set": {f"tag": tag}}, upsert=True
-        )
-
-    async def get_tag_json(self, item: str) -> dict[str, Any] | None:
+    async def get_tag_json(self, item: str) -> dict[str, Any]:
         """
         返回指定物品的 tag 標籤資料（非同步版本）
 
@@ -706,18 +1521,24 @@ class AsyncDepot:
             item: 物品名稱
 
         Returns:
-            dict[str, Any] | None: 標籤字典
+            dict[str, Any]: 標籤字典
 
         Raises:
             DepotError: 如果物品不存在於倉庫中
         """
-        data = await self.inventory.find_one({"item": item})
-        if data is None:
-            raise DepotError(
-                f"警告: 倉庫內未找到 {item} 請確認已添加物品，已忽略此筆。"
-            )
+        return dict(await self._run(self._existing_steps(item))).get("tag", {})
 
-        return dict(data).get("tag", {})
+    async def in_inventory(self, item: str) -> bool:
+        """
+        檢查該物品是否存在於倉庫內（非同步版本）
+
+        Args:
+            item: 物品名稱
+
+        Returns:
+            bool: 物品是否存在於倉庫中
+        """
+        return await self.storage.find_item(item) is not None
 
     async def find_records(self, date: str) -> list[Any] | None:
         """
@@ -729,9 +1550,48 @@ class AsyncDepot:
         Returns:
             list[Any] | None: 該日期的紀錄列表，如果不存在則返回 None
         """
-        if date not in await self.date_collections:
-            return None
-        return [i async for i in self.db[date].find()]
+        return await self._run(self._find_records_steps(date))
+
+    async def iter_records(self, date: str) -> AsyncIterator[dict[str, Any]]:
+        """
+        依日期逐筆輸出紀錄（分批讀取，記憶體用量不隨當日筆數增加）
+
+        Args:
+            date: 日期字串，格式為 YYYY-MM-DD（需先確認存在）
+
+        Yields:
+            dict[str, Any]: 紀錄
+        """
+        if self.archive.has(date):
+            for record in await asyncio.to_thread(self.archive.read, date) or []:
+                yield record
+            return
+        async for raw in self.storage.iter_record_batches(date):
+            for record in decode_batch(raw):
+                yield record
+
+    async def iter_records_json(self, date: str) -> AsyncIterator[bytes]:
+        """
+        依日期以 JSON 陣列分段輸出紀錄（不建立整天的紀錄列表，可直接串流回應）
+
+        Args:
+            date: 日期字串，格式為 YYYY-MM-DD（需先確認存在）
+
+        Yields:
+            bytes: JSON 片段，串接後為 [{"_id", "type", "item", "amount", "time", "source"}]
+        """
+        yield b"["
+        if self.archive.has(date):
+            records = await asyncio.to_thread(self.archive.read, date)
+            yield encode_records(records or [])
+        else:
+            first = True
+            async for raw in self.storage.iter_record_batches(date):
+                chunk = encode_batch(raw)
+                if chunk:
+                    yield chunk if first else b"," + chunk
+                    first = False
+        yield b"]"
 
     @property
     async def date_collections(self) -> list[str]:
@@ -741,7 +1601,59 @@ class AsyncDepot:
         Returns:
             list[str]: 日期格式的資料表名稱列表
         """
-        return [i for i in await self.db.list_collection_names() if i != "inventory"]
+        return await self.storage.record_days()
+
+    @property
+    def archived_days(self) -> list[str]:
+        """
+        已封存（不在資料庫中）的日期
+
+        Returns:
+            list[str]: 日期格式的名稱列表
+        """
+        return self.archive.days()
+
+    async def rollup(self, date: str) -> dict[str, dict[str, int]] | None:
+        """
+        每日各物品的進出彙總（非同步版本）
+
+        Args:
+            date: 日期字串，格式為 YYYY-MM-DD
+
+        Returns:
+            dict[str, dict[str, int]] | None: {物品: {"in", "out", "set", "count"}}，日期不存在時為 None
+        """
+        return await self._run(self._rollup_steps(date))
+
+    async def take_snapshot(self) -> dict[str, Any]:
+        """
+        保存目前庫存的快照（非同步版本），作為 inventory_at 重播的起點
+
+        Returns:
+            dict[str, Any]: 快照文件 {"time", "seq", "items"}
+        """
+        return await self._run(self._snapshot_steps())
+
+    async def inventory_at(self, timestamp: datetime) -> dict[str, int]:
+        """
+        還原指定時間的庫存（非同步版本）
+
+        Args:
+            timestamp: 目標時間
+
+        Returns:
+            dict[str, int]: 物品名稱與數量的字典
+        """
+        return await self._run(self._inventory_at_steps(timestamp))
+
+    async def check_consistency(self) -> dict[str, dict[str, int]]:
+        """
+        檢查 inventory 資料表與紀錄重播結果是否一致（非同步版本）
+
+        Returns:
+            dict[str, dict[str, int]]: 不一致的物品 {物品: {"inventory", "log"}}，一致時為空字典
+        """
+        return await self._run(self._consistency_steps())
 
     class Tool:
         """
@@ -758,9 +1670,7 @@ class AsyncDepot:
                 parent_depot: 父級 AsyncDepot 實例
             """
             self.parent = parent_depot
-            self.client = parent_depot.client
-            self.db = parent_depot.db
-            self.inventory = parent_depot.inventory
+            self.storage = parent_depot.storage
 
         async def clear_inventory(self, double_check: bool) -> bool:
             """
@@ -772,26 +1682,37 @@ class AsyncDepot:
             Returns:
                 bool: 操作是否成功
             """
-            if not double_check:
-                _log_operation(
-                    "WARNING",
-                    "清空倉庫操作",
-                    "double_check 參數必須為 True 才能執行清空操作",
-                )
-                return False
+            return await self.parent._run(self.parent._clear_steps(double_check))
 
-            try:
-                # 刪除 inventory 資料表中的所有文件
-                result = await self.inventory.delete_many({})
-                _log_operation(
-                    "SUCCESS", "清空倉庫", f"共刪除 {result.deleted_count} 筆資料"
-                )
-                self.parent.__init__()
-                return True
-            except Exception as e:
-                _log_operation("ERROR", "清空倉庫失敗", str(e))
-                return False
+        async def warm_start(self, repair: bool = False) -> dict[str, Any]:
+            """
+            保留現有庫存啟動（非同步版本，取代 clear_inventory）:
+            只補上缺少的預設物品，並從最近快照重播之後的紀錄驗證庫存，再保存新快照作為下次的起點
+
+            Args:
+                repair: 不一致時是否以紀錄重播結果覆寫庫存數量
+
+            Returns:
+                dict[str, Any]: {"seeded": 補上的物品, "drift": 不一致的物品, "repaired": 是否已覆寫}
+            """
+            return await self.parent._run(self.parent._warm_start_steps(repair))
+
+        async def archive_records(self, keep_days: int) -> list[str]:
+            """
+            將超過保留天數的紀錄資料表移到封存檔（非同步版本，壓縮在背景執行緒進行）
+
+            Args:
+                keep_days: 資料庫中保留的天數
+
+            Returns:
+                list[str]: 本次封存的日期
+            """
+            return await self.parent._run(self.parent._archive_steps(keep_days))
 
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["import"]:  # python -m depot import 檔案
+        from importer import main
+
+        sys.exit(main(sys.argv[2:]))
     depot = Depot()
@@ -0,0 +1,254 @@
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Any, Literal
+import queue
+import threading
+import time
+import uuid
+
+Status = Literal["queued", "running", "retrying", "done", "failed"]
+FINISHED = ("done", "failed")
+RETRY_STATUS = (429, 502, 503, 504)  # 控制器忙碌或暫時無法連線，稍後重試
+
+
+@dataclass
+class Job:
+    """轉發任務（to_dict 為狀態 API / WebSocket 推送的內容）"""
+
+    id: str
+    target: str
+    payload: Any
+    status: Status = "queued"
+    attempts: int = 0
+    created: float = field(default_factory=time.time)
+    finished: float | None = None
+    response_status: int | None = None
+    response: Any = None
+    error: str | None = None
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+class CommandDispatcher:
+    """
+    機器人指令轉發佇列（/sc 自走車、/xc 機械臂）\n
+    - submit 排入任務並立即返回 Job（佇列已滿時拋出 queue.Full）\n
+    - get / recent 查詢任務狀態，stats 各目標的排隊與執行數\n
+    - watch / unwatch 訂閱任務狀態變化（WebSocket 推送用）\n
+    \n
+    每個目標有獨立的佇列與 concurrency 個 worker thread（即同時送往該控制器的上限），
+    每個 worker 持有自己的 requests.Session，連線保持 keep-alive 重複使用。\n
+    \n
+    重試: 建立連線失敗（拒絕連線、DNS、連線逾時，請求確定未送出）或 429 / 502 / 503 / 504
+    時以指數退避重試 retries 次；送出後才斷線、讀取逾時與其他錯誤不重試，避免同一指令被執行兩次。\n
+    已完成的任務只保留最近 keep 筆
+    """
+
+    def __init__(
+        self,
+        targets: dict[str, str],
+        concurrency: int = 1,
+        retries: int = 2,
+        backoff: float = 0.5,
+        timeout: float = 30,
+        max_pending: int = 20,
+        keep: int = 500,
+    ) -> None:
+        """
+        Args:
+            targets: 目標名稱 → 控制器 URL
+            concurrency: 每個目標同時處理的任務數
+            retries: 最多重試次數
+            backoff: 第一次重試前等待的秒數（之後每次加倍）
+            timeout: 單次請求逾時秒數
+            max_pending: 每個目標最多排隊的任務數
+            keep: 最多保留的任務數
+        """
+        self.targets = targets
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.keep = keep
+        self.jobs: OrderedDict[str, Job] = OrderedDict()
+        self.queues = {name: queue.Queue(max_pending) for name in targets}
+        self.running = {name: 0 for name in targets}
+        self.lock = threading.Lock()
+        self._watchers: set[queue.SimpleQueue] = set()
+        self._local = threading.local()
+        self._started = False
+
+    def submit(self, target: str, payload: Any) -> Job:
+        """
+        排入轉發任務
+
+        Args:
+            target: 目標名稱
+            payload: 轉發的 JSON 內容
+
+        Returns:
+            Job: 新任務（狀態為 queued）
+
+        Raises:
+            ValueError: 未知的目標
+            queue.Full: 該目標的佇列已滿
+        """
+        if target not in self.targets:
+            raise ValueError(f"未知的目標: {target}")
+        self._start()
+        job = Job(uuid.uuid4().hex[:12], target, payload)
+        with self.lock:
+            self.queues[target].put_nowait(job)  # 佇列已滿時不記錄任務
+            self.jobs[job.id] = job
+            self._trim()
+        self._notify(job)
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        """查詢任務"""
+        return self.jobs.get(job_id)
+
+    def recent(self, limit: int = 50) -> list[dict[str, Any]]:
+        """最近的任務（新到舊）"""
+        with self.lock:
+            jobs = list(self.jobs.values())[-limit:]
+        return [job.to_dict() for job in reversed(jobs)]
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """各目標的 {"pending": 排隊數, "running": 執行中}"""
+        return {
+            name: {"pending": self.queues[name].qsize(), "running": self.running[name]}
+            for name in self.targets
+        }
+
+    def watch(self) -> queue.SimpleQueue:
+        """
+        訂閱任務狀態變化
+
+        Returns:
+            queue.SimpleQueue: 每次變化放入 Job.to_dict()，不再使用時需 unwatch
+        """
+        updates: queue.SimpleQueue = queue.SimpleQueue()
+        with self.lock:
+            self._watchers.add(updates)
+        return updates
+
+    def unwatch(self, updates: queue.SimpleQueue) -> None:
+        with self.lock:
+            self._watchers.discard(updates)
+
+    def _start(self) -> None:
+        """第一次 submit 時啟動 worker"""
+        with self.lock:
+            if self._started:
+                return
+            self._started = True
+        for name in self.targets:
+            for i in range(self.concurrency):
+                threading.Thread(
+                    target=self._worker,
+                    args=(name,),
+                    name=f"dispatch-{name}-{i}",
+                    daemon=True,
+                ).start()
+
+    def _trim(self) -> None:
+        """移除超過 keep 的已完成任務（需持有 lock）"""
+        excess = len(self.jobs) - self.keep
+        for job_id in [i for i, job in self.jobs.items() if job.status in FINISHED]:
+            if excess <= 0:
+                break
+            del self.jobs[job_id]
+            excess -= 1
+
+    def _notify(self, job: Job) -> None:
+        message = job.to_dict()
+        with self.lock:
+            watchers = list(self._watchers)
+        for updates in watchers:
+            updates.put(message)
+
+    def _update(self, job: Job, status: Status, error: str | None = None) -> None:
+        job.status = status
+        job.error = error
+        if status in FINISHED:
+            job.finished = time.time()
+        self._notify(job)
+
+    def _session(self) -> Any:
+        """本 worker thread 的 Session（保持一條 keep-alive 連線）"""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            self._local.session = session
+        return session
+
+    def _worker(self, target: str) -> None:
+        jobs = self.queues[target]
+        while True:
+            job = jobs.get()
+            with self.lock:
+                self.running[target] += 1
+            try:
+                self._run(job)
+            except Exception as e:  # worker 不可中斷
+                self._update(job, "failed", f"Internal error: {e}")
+            finally:
+                with self.lock:
+                    self.running[target] -= 1
+
+    def _run(self, job: Job) -> None:
+        import requests
+
+        session = self._session()
+        url = self.targets[job.target]
+        while True:
+            job.attempts += 1
+            self._update(job, "running")
+            retry = False
+            try:
+                response = session.post(url, json=job.payload, timeout=self.timeout)
+            except requests.exceptions.ConnectionError as e:
+                error, retry = f"Failed to forward request: {e}", _not_sent(e)
+            except requests.exceptions.RequestException as e:
+                error = f"Failed to forward request: {e}"
+            else:
+                job.response_status = response.status_code
+                if response.ok:
+                    job.response = _response_body(response)
+                    self._update(job, "done")
+                    return
+                error = f"HTTP {response.status_code}: {response.text[:200]}"
+                retry = response.status_code in RETRY_STATUS
+
+            if not retry or job.attempts > self.retries:
+                break
+            self._update(job, "retrying", error)
+            time.sleep(self.backoff * 2 ** (job.attempts - 1))
+
+        self._update(job, "failed", error)
+        from depot import _log_operation
+
+        _log_operation("ERROR", f"{job.target} 指令轉發失敗", f"{job.id}: {error}")
+
+
+def _not_sent(error: Exception) -> bool:
+    """連線階段就失敗（請求確定未送達控制器，可以安全重試）"""
+    from urllib3.exceptions import ConnectTimeoutError  # 含 NewConnectionError
+
+    reason = error.args[0] if error.args else None
+    return isinstance(getattr(reason, "reason", reason), ConnectTimeoutError)
+
+
+def _response_body(response: Any) -> Any:
+    """控制器回應（JSON 或前 200 個字元）"""
+    try:
+        return response.json()
+    except ValueError:
+        return response.text[:200] or None
@@ -0,0 +1,209 @@
+from datetime import date, timedelta
+from typing import TYPE_CHECKING, Any
+import math
+
+if TYPE_CHECKING:  # numpy 在第一次計算預測時才載入，縮短啟動時間
+    import numpy as np
+
+
+class Forecaster:
+    """
+    物品消耗預測與補貨點\n
+    - refresh 載入近期每日出庫量（已載入的日期不重複讀取）\n
+    - observe 庫存事件訂閱者，即時累加今天的出庫量\n
+    - forecast 計算每日消耗率、補貨點與剩餘天數（結果快取到下次變動）\n
+    \n
+    模型:\n
+    - 每日消耗率 = 近 7 天與近 28 天平均的加權（只用已結束的日子）\n
+    - 星期季節性 = 各星期幾的平均 / 整體平均，資料不足 4 週時往 1 收斂\n
+    - 補貨點 = 前置期內的預估消耗 + z × 每日標準差 × √前置天數\n
+    \n
+    使用範例:\n
+      forecaster = Forecaster()
+      depot.add_listener(forecaster.observe)
+      await forecaster.refresh(depot)
+      forecaster.forecast(await depot.get_inventory())
+    """
+
+    def __init__(
+        self,
+        history_days: int = 56,
+        lead_time_days: int = 3,
+        service_z: float = 1.65,
+        horizon_days: int = 90,
+    ) -> None:
+        """
+        Args:
+            history_days: 使用的歷史天數
+            lead_time_days: 補貨前置天數
+            service_z: 安全庫存的 z 值（1.65 約 95% 服務水準）
+            horizon_days: 剩餘天數的最長預測範圍
+        """
+        self.history_days = history_days
+        self.lead_time_days = lead_time_days
+        self.service_z = service_z
+        self.horizon_days = horizon_days
+
+        self.usage: dict[str, dict[str, int]] = {}  # {日期: {物品: 出庫量}}
+        self._results: dict[str, dict[str, Any]] | None = None
+        self._stock: dict[str, int] = {}
+
+    async def refresh(self, depot: Any) -> None:
+        """
+        載入尚未讀取的日期（今天只在第一次讀取，之後由 observe 累加）
+
+        Args:
+            depot: AsyncDepot
+        """
+        days = [f"{d}" for d in self._window()]
+        available = set(await depot.date_collections)
+        for day in days:
+            if day in self.usage:
+                continue
+            usage: dict[str, int] = {}
+            rollup = depot.archive.rollup(day)  # 已封存的日期直接使用每日彙總
+            if rollup is not None:
+                usage = {i: r["out"] for i, r in rollup.items() if r["out"]}
+            elif day in available:
+                for r in await depot.find_records(day) or []:
+                    if r.get("type") == "out":
+                        usage[r["item"]] = usage.get(r["item"], 0) + r["amount"]
+            self.usage[day] = usage
+            self._results = None
+        for day in [d for d in self.usage if d not in days]:
+            del self.usage[day]
+
+    async def observe(self, event: dict[str, Any]) -> None:
+        """庫存事件訂閱者: 出庫時累加今天的出庫量，並讓快取失效"""
+        if event.get("event") == "change" and event.get("op") == "out":
+            today = self.usage.get(f"{date.today()}")
+            if today is not None:  # 今天尚未載入時，由 refresh 讀取完整紀錄
+                today[event["item"]] = today.get(event["item"], 0) + event["delta"]
+        self._results = None
+
+    def forecast(self, inventory: dict[str, int]) -> dict[str, dict[str, Any]]:
+        """
+        計算每項物品的預測結果
+
+        Args:
+            inventory: 目前庫存 {物品: 數量}
+
+        Returns:
+            dict[str, dict[str, Any]]: {物品: {"stock", "daily_rate", "forecast_7d",
+                "reorder_point", "days_remaining"(不會耗盡時為 None), "reorder"}}
+        """
+        if self._results is not None and inventory == self._stock:
+            return self._results
+        import numpy as np
+
+        window = self._window()
+        items = sorted(set(inventory) | {i for u in self.usage.values() for i in u})
+        if not items:
+            return {}
+
+        # 物品 × 日期 的出庫量矩陣（不含今天，今天尚未結束）
+        past = window[:-1]
+        matrix = np.array(
+            [[self.usage.get(f"{d}", {}).get(i, 0) for d in past] for i in items],
+            dtype=float,
+        ).reshape(len(items), len(past))
+        rate = _base_rate(matrix)
+        sigma = matrix.std(axis=1) if past else np.zeros(len(items))
+        weekdays = np.array([d.weekday() for d in past], dtype=int)
+        factor = _weekday_factor(matrix, weekdays)
+
+        # 未來每日預估消耗（從今天開始）與累計
+        today = window[-1]
+        future = np.array(
+            [(today + timedelta(days=k)).weekday() for k in range(self.horizon_days)]
+        )
+        daily = rate[:, None] * factor[:, future]
+        cumulative = np.cumsum(daily, axis=1)
+
+        stock = np.array([max(inventory.get(i, 0), 0) for i in items], dtype=float)
+        remaining = _days_remaining(daily, cumulative, stock)
+        lead = cumulative[:, min(self.lead_time_days, self.horizon_days) - 1]
+        week = cumulative[:, min(7, self.horizon_days) - 1]
+        reorder_point = np.ceil(
+            lead + self.service_z * sigma * math.sqrt(self.lead_time_days)
+        )
+
+        self._results = {
+            item: {
+                "stock": int(stock[n]),
+                "daily_rate": round(float(rate[n]), 2),
+                "forecast_7d": round(float(week[n]), 1),
+                "reorder_point": int(reorder_point[n]),
+                "days_remaining": (
+                    None if math.isinf(remaining[n]) else round(float(remaining[n]), 1)
+                ),
+                "reorder": bool(rate[n] > 0 and stock[n] <= reorder_point[n]),
+            }
+            for n, item in enumerate(items)
+        }
+        self._stock = dict(inventory)
+        return self._results
+
+    def _window(self) -> list[date]:
+        """歷史範圍內的日期（由舊到新，最後一天為今天）"""
+        today = date.today()
+        return [
+            today - timedelta(days=k) for k in range(self.history_days - 1, -1, -1)
+        ]
+
+
+def _base_rate(matrix: "np.ndarray") -> "np.ndarray":
+    """近 7 天平均 × 0.6 + 近 28 天平均 × 0.4（以累積和計算滾動平均）"""
+    import numpy as np
+
+    if matrix.shape[1] == 0:
+        return np.zeros(matrix.shape[0])
+    cumsum = np.concatenate(
+        [np.zeros((matrix.shape[0], 1)), np.cumsum(matrix, axis=1)], axis=1
+    )
+
+    def rolling(window: int) -> "np.ndarray":
+        window = min(window, matrix.shape[1])
+        return (cumsum[:, -1] - cumsum[:, -1 - window]) / window
+
+    return 0.6 * rolling(7) + 0.4 * rolling(28)
+
+
+def _weekday_factor(matrix: "np.ndarray", weekdays: "np.ndarray") -> "np.ndarray":
+    """
+    各物品的星期季節性係數（物品 × 7），資料不足時往 1 收斂
+
+    Args:
+        matrix: 物品 × 日期 的出庫量
+        weekdays: 每個日期的星期 (0=星期一)
+    """
+    import numpy as np
+
+    factor = np.ones((matrix.shape[0], 7))
+    if matrix.shape[1] == 0:
+        return factor
+    onehot = np.eye(7)[weekdays]  # 日期 × 7
+    counts = onehot.sum(axis=0)
+    mean = matrix.mean(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weekday_mean = (matrix @ onehot) / counts
+        raw = np.where((mean > 0) & (counts > 0), weekday_mean / mean, 1.0)
+    weight = min(1.0, counts.min() / 4)  # 每個星期幾至少 4 筆才完全採用
+    return 1 + (raw - 1) * weight
+
+
+def _days_remaining(
+    daily: "np.ndarray", cumulative: "np.ndarray", stock: "np.ndarray"
+) -> "np.ndarray":
+    """累計預估消耗達到庫存的天數（線性內插），範圍內不會耗盡時為 inf"""
+    import numpy as np
+
+    reached = cumulative >= stock[:, None]
+    index = reached.argmax(axis=1)
+    rows = np.arange(len(stock))
+    used = daily[rows, index]
+    before = cumulative[rows, index] - used
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fraction = np.where(used > 0, (stock - before) / used, 0.0)
+    consumed = cumulative[:, -1] > 0  # 沒有消耗的物品不會耗盡
+    return np.where(reached.any(axis=1) & consumed, index + fraction, np.inf)
@@ -0,0 +1,420 @@
+"""
+大量匯入庫存（盤點）
+
+使用範例:
+  python -m depot import stock.csv                 # 預設以 set 設定數量
+  python -m depot import stock.xlsx --type in      # 沒有 type 欄位的列以 in 入庫
+  python -m depot import stock.csv --restart       # 忽略上次的進度重新匯入
+
+檔案第一列為欄位名稱: item/物品、amount/數量，可選 type/類型、time/時間。
+檔案逐段讀取，每段在子行程解析與驗證（DepotItemBatch），再依序以單一交易寫入；
+每段完成後更新 <檔案>.checkpoint.json，中斷後重新執行會從下一段繼續。
+每段以 idempotency key 寫入，即使在寫入後、更新進度前中斷也不會重複寫入；
+寫入中被強制結束而留下處理中的 key 時，重新執行會檢查該段是否已寫入，未寫入則重寫。
+"""
+
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from datetime import date
+from pathlib import Path
+from typing import Any, Iterator
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+import uuid
+
+COLUMNS = {  # 欄位名稱 → 欄位
+    "item": "item",
+    "物品": "item",
+    "amount": "amount",
+    "數量": "amount",
+    "type": "type",
+    "類型": "type",
+    "time": "time",
+    "時間": "time",
+}
+CHUNK_ROWS = 5000  # 每段列數（每段一次交易）
+MAX_ERRORS = 20  # 最多顯示的無效列
+
+
+class ImportSource:
+    """
+    逐段讀取 CSV / XLSX\n
+    - header 欄位 → 欄位索引\n
+    - chunks 每次返回最多 chunk_rows 列（字串或儲存格值）與其列號\n
+    - progress 已讀取的比例 (0~1，無法估計時為 None)
+    """
+
+    def __init__(self, path: str, chunk_rows: int = CHUNK_ROWS) -> None:
+        """
+        Args:
+            path: 檔案路徑 (.csv / .xlsx)
+            chunk_rows: 每段列數
+
+        Raises:
+            ValueError: 不支援的格式或缺少 item / amount 欄位
+        """
+        self.path = Path(path)
+        self.chunk_rows = chunk_rows
+        self.size = self.path.stat().st_size
+        self._file: Any = None
+        self._total: int | None = None
+        self.rows_read = 0  # 已讀取的資料列數（不含標題）
+
+        suffix = self.path.suffix.lower()
+        if suffix == ".csv":
+            self._file = open(self.path, encoding="utf-8-sig", newline="")
+            self._rows: Iterator[Any] = csv.reader(self._file)
+        elif suffix == ".xlsx":
+            try:  # openpyxl 為選用套件，只有匯入 Excel 時需要
+                from openpyxl import load_workbook
+            except ImportError:
+                raise ValueError("匯入 .xlsx 需要安裝 openpyxl") from None
+            book = load_workbook(self.path, read_only=True, data_only=True)
+            sheet = book.active
+            self._file = book
+            self._total = max((sheet.max_row or 1) - 1, 1)
+            self._rows = sheet.iter_rows(values_only=True)
+        else:
+            raise ValueError(f"不支援的檔案格式: {suffix}（僅支援 .csv / .xlsx）")
+
+        names = next(self._rows, None) or []
+        self.header: dict[str, int] = {}
+        for i, name in enumerate(names):
+            column = COLUMNS.get(str(name or "").strip().lower())
+            if column is not None and column not in self.header:
+                self.header[column] = i
+        if "item" not in self.header or "amount" not in self.header:
+            self.close()
+            raise ValueError("第一列需包含 item/物品 與 amount/數量 欄位")
+
+    def chunks(self) -> Iterator[tuple[list[int], list[tuple[Any, ...]]]]:
+        """每次返回最多 chunk_rows 列 (列號, 列)，略過整列空白"""
+        lines: list[int] = []
+        chunk: list[tuple[Any, ...]] = []
+        for row in self._rows:
+            self.rows_read += 1
+            if not any(v not in (None, "") for v in row):
+                continue
+            lines.append(self.rows_read + 1)  # 第 1 列為標題
+            chunk.append(tuple(row))
+            if len(chunk) >= self.chunk_rows:
+                yield lines, chunk
+                lines, chunk = [], []
+        if chunk:
+            yield lines, chunk
+
+    @property
+    def progress(self) -> float | None:
+        """已讀取的比例（CSV 依檔案位置，XLSX 依列數）"""
+        if self._total is not None:
+            return min(self.rows_read / self._total, 1.0)
+        try:
+            return min(self._file.buffer.tell() / self.size, 1.0)
+        except (AttributeError, ValueError, ZeroDivisionError):
+            return None
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def parse_chunk(
+    header: dict[str, int],
+    lines: list[int],
+    rows: list[tuple[Any, ...]],
+    default_type: str,
+) -> tuple[list[dict[str, Any]], list[tuple[int, str, str]]]:
+    """
+    解析並驗證一段（在子行程執行）
+
+    Args:
+        header: 欄位 → 欄位索引
+        lines: 各列在檔案中的列號（含標題列，從 1 起算）
+        rows: 原始列
+        default_type: 沒有 type 欄位或空白時使用的類型
+
+    Returns:
+        tuple: (有效的紀錄 {"type", "item", "amount", "time"}, 無效列 (列號, 欄位, 原因))
+    """
+    from item_batch import DepotItemBatch
+
+    def column(name: str, default: Any = None) -> list[Any]:
+        index = header.get(name)
+        if index is None:
+            return [default] * len(rows)
+        return [
+            (row[index] if index < len(row) and row[index] not in (None, "") else default)
+            for row in rows
+        ]
+
+    batch = DepotItemBatch.from_columns(
+        column("type", default_type),
+        column("item"),
+        column("amount"),
+        column("time") if "time" in header else None,
+    )
+    batch.validate()
+    errors = [(lines[i], field, reason) for i, field, reason in batch.errors()]
+    return batch.records(), errors
+
+
+class Checkpoint:
+    """
+    匯入進度 (<檔案>.checkpoint.json)\n
+    檔案大小、修改時間或每段列數不同（或指定 restart）時視為新的匯入
+    """
+
+    def __init__(
+        self,
+        source: Path,
+        chunk_rows: int,
+        path: str | None = None,
+        restart: bool = False,
+    ) -> None:
+        """
+        Args:
+            source: 匯入的檔案
+            chunk_rows: 每段列數
+            path: 進度檔路徑，預設為 <檔案>.checkpoint.json
+            restart: 忽略上次的進度
+        """
+        stat = source.stat()
+        identity = f"{source.resolve()}|{stat.st_size}|{stat.st_mtime_ns}|{chunk_rows}"
+        self.identity = hashlib.sha1(identity.encode("utf-8")).hexdigest()
+        self.path = Path(path or f"{source}.checkpoint.json")
+        self.run = uuid.uuid4().hex  # 本次匯入的識別碼（idempotency key 使用）
+        self.chunks = 0  # 已寫入的段數
+        self.rows = 0  # 已寫入的列數
+        self.invalid = 0  # 略過的無效列數
+        self.pending: dict[str, Any] | None = None  # 寫入中的段 {"chunk", "seq", "day"}
+        if self.path.exists() and not restart:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            if data.get("identity") == self.identity:
+                self.run = data["run"]
+                self.chunks = data["chunks"]
+                self.rows = data["rows"]
+                self.invalid = data["invalid"]
+                self.pending = data.get("pending")
+
+    def key(self, chunk: int) -> str:
+        """該段的 idempotency key"""
+        return f"import:{self.run}:{chunk}"
+
+    def begin(self, chunk: int, seq: int) -> None:
+        """寫入一段之前記錄寫入前的紀錄序號與日期（中斷後判斷該段是否已寫入）"""
+        self.pending = {"chunk": chunk, "seq": seq, "day": f"{date.today()}"}
+        self.save()
+
+    def save(self) -> None:
+        data = {
+            "identity": self.identity,
+            "run": self.run,
+            "chunks": self.chunks,
+            "rows": self.rows,
+            "invalid": self.invalid,
+            "pending": self.pending,
+        }
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def remove(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+
+def _resume_applied(
+    storage: Any, checkpoint: Checkpoint, chunk: int, source: str
+) -> bool:
+    """
+    上次在寫入這一段時中斷: 檢查該段是否已寫入（交易全有或全無），並釋放處理中的 key\n
+    已寫入的判斷: 寫入當日（或隔日）有來源相同、序號大於寫入前 last_seq 的紀錄
+
+    Returns:
+        bool: 已寫入（略過這一段）；未寫入或 key 已有結果時返回 False（照常寫入或重送）
+    """
+    pending = checkpoint.pending
+    if pending is None or pending["chunk"] != chunk:
+        return False
+    key = checkpoint.key(chunk)
+    doc = storage.get_key(key)
+    if doc is not None and doc.get("result") is not None:
+        return False  # 已完成，write_transaction 會返回原始結果
+    days = {pending["day"], f"{date.today()}"}
+    applied = any(
+        r.get("source") == source and (r.get("seq") or 0) > pending["seq"]
+        for day in days
+        for r in storage.find_records(day)
+    )
+    if doc is not None:
+        storage.release_key(key)  # 被強制結束而留下的處理中 key
+    return applied
+
+
+def import_file(
+    path: str,
+    depot: Any,
+    default_type: str = "set",
+    chunk_rows: int = CHUNK_ROWS,
+    workers: int | None = None,
+    checkpoint_path: str | None = None,
+    restart: bool = False,
+    source: str = "import",
+    output: Any = sys.stderr,
+) -> dict[str, Any]:
+    """
+    匯入檔案
+
+    Args:
+        path: 檔案路徑
+        depot: Depot
+        default_type: 沒有 type 欄位或空白時使用的類型
+        chunk_rows: 每段列數
+        workers: 解析的子行程數，預設為 CPU 數（1 為不使用子行程）
+        checkpoint_path: 進度檔路徑，預設為 <檔案>.checkpoint.json
+        restart: 忽略上次的進度
+        source: 紀錄來源
+        output: 進度輸出（None 不輸出）
+
+    Returns:
+        dict[str, Any]: {"rows", "invalid", "chunks", "resumed", "seconds", "errors"}
+    """
+    from depot import DepotItem
+
+    reader = ImportSource(path, chunk_rows)
+    checkpoint = Checkpoint(reader.path, chunk_rows, checkpoint_path, restart)
+    resumed = checkpoint.chunks
+    resumed_rows = checkpoint.rows
+    committed_lines = 0  # 已寫入（或略過）的段所含的列數，用於估計進度
+    workers = workers or os.cpu_count() or 1
+    executor: Executor | None = ProcessPoolExecutor(workers) if workers > 1 else None
+    pending: deque[tuple[int, int, Future | tuple]] = deque()
+    errors: list[tuple[int, str, str]] = []
+    started = time.perf_counter()
+
+    def submit(index: int, lines: list[int], rows: list[tuple[Any, ...]]) -> None:
+        args = (reader.header, lines, rows, default_type)
+        if executor is None:
+            pending.append((index, len(rows), parse_chunk(*args)))
+        else:
+            pending.append((index, len(rows), executor.submit(parse_chunk, *args)))
+
+    def commit_next() -> None:
+        nonlocal committed_lines
+        index, size, result = pending.popleft()
+        records, invalid = result.result() if isinstance(result, Future) else result
+        if records and not _resume_applied(depot.storage, checkpoint, index, source):
+            items = [
+                DepotItem._validated(r["type"], r["item"], r["amount"], r["time"])
+                for r in records
+            ]
+            checkpoint.begin(index, depot.storage.last_seq())
+            depot.write_transaction(items, source, checkpoint.key(index))
+        checkpoint.pending = None
+        checkpoint.chunks = index + 1
+        checkpoint.rows += len(records)
+        checkpoint.invalid += len(invalid)
+        checkpoint.save()
+        errors.extend(invalid[: MAX_ERRORS - len(errors)])
+        committed_lines += size
+        if output is not None:
+            progress = reader.progress  # 讀取位置領先已寫入的段，依列數比例換算
+            if progress is not None and reader.rows_read:
+                progress *= committed_lines / reader.rows_read
+            elapsed = max(time.perf_counter() - started, 1e-9)
+            percent = f"{progress:6.1%} " if progress is not None else ""
+            output.write(
+                f"\r匯入 {percent}{checkpoint.rows} 列（略過 {checkpoint.invalid}），"
+                f"{checkpoint.chunks} 段，"
+                f"{(checkpoint.rows - resumed_rows) / elapsed:,.0f} 列/秒"
+            )
+            output.flush()
+
+    snapshot_every, depot.snapshot_every = depot.snapshot_every, 0  # 完成後保存一次
+    try:
+        for index, (lines, rows) in enumerate(reader.chunks()):
+            if index < checkpoint.chunks:  # 已完成的段只讀取不解析
+                committed_lines += len(rows)
+                continue
+            submit(index, lines, rows)
+            while len(pending) > workers * 2:  # 限制預先解析的段數
+                commit_next()
+        while pending:
+            commit_next()
+    finally:
+        depot.snapshot_every = snapshot_every
+        reader.close()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    depot.take_snapshot()
+    checkpoint.remove()
+    if output is not None:
+        output.write("\n")
+    return {
+        "rows": checkpoint.rows,
+        "invalid": checkpoint.invalid,
+        "chunks": checkpoint.chunks,
+        "resumed": resumed,
+        "seconds": round(time.perf_counter() - started, 2),
+        "errors": errors,
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m depot import", description="大量匯入庫存（CSV / XLSX）"
+    )
+    parser.add_argument("file", help="CSV 或 XLSX 檔案")
+    parser.add_argument(
+        "--type",
+        default="set",
+        choices=("set", "in", "out", "auto"),
+        help="沒有 type 欄位時使用的類型（預設 set: 盤點數量）",
+    )
+    parser.add_argument("--chunk", type=int, default=CHUNK_ROWS, help="每段列數")
+    parser.add_argument("--workers", type=int, default=None, help="解析子行程數")
+    parser.add_argument("--checkpoint", help="進度檔路徑")
+    parser.add_argument("--restart", action="store_true", help="忽略上次的進度")
+    parser.add_argument("--verbose", action="store_true", help="輸出逐筆寫入日誌")
+    args = parser.parse_args(argv)
+
+    import depot as depot_module
+    from depot import Depot, DepotError
+
+    depot_module.ENABLE_SUCCESS_LOG = args.verbose
+    depot = Depot(seed_items=False)  # 匯入不需要預設物品
+    try:
+        result = import_file(
+            args.file,
+            depot,
+            default_type=args.type,
+            chunk_rows=args.chunk,
+            workers=args.workers,
+            checkpoint_path=args.checkpoint,
+            restart=args.restart,
+        )
+    except (ValueError, OSError) as err:
+        print(f"匯入失敗: {err}", file=sys.stderr)
+        return 2
+    except DepotError as err:
+        print(f"匯入中止（已完成的段保留，修正後重新執行會繼續）: {err}", file=sys.stderr)
+        return 1
+
+    for row, field, reason in result["errors"]:
+        print(f"第 {row} 列 {field}: {reason}", file=sys.stderr)
+    resumed = f"，從第 {result['resumed'] + 1} 段繼續" if result["resumed"] else ""
+    print(
+        f"匯入完成: {result['rows']} 列，略過 {result['invalid']} 列，"
+        f"{result['seconds']} 秒{resumed}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+from datetime import datetime
+from typing import Any, Iterable, Iterator, Sequence
+from depot import DepotItem
+import numpy as np
+
+TYPES = ("in", "out", "set", "auto")  # 類型代碼 = 索引
+TYPE_IN, TYPE_OUT, TYPE_SET, TYPE_AUTO = range(len(TYPES))
+TYPE_INVALID = 255
+MAX_DIGITS = 18  # 超過即可能溢位 int64
+
+# 驗證結果代碼（0 為有效）
+VALID = 0
+BAD_TYPE = 1  # type 不是 in / out / set / auto
+BAD_ITEM = 2  # item 為空
+BAD_AMOUNT = 3  # amount 不是整數，或 in / out 時不是正整數
+BAD_TIME = 4  # time 無法解析
+REASONS = {
+    BAD_TYPE: ("type", "type 必須是 'in' 或 'out' 或 'auto' 或 'set'"),
+    BAD_ITEM: ("item", "item 不可為空"),
+    BAD_AMOUNT: ("amount", "amount 必須是正整數"),
+    BAD_TIME: ("time", "time 格式錯誤"),
+}
+
+
+class DepotItemBatch:
+    """
+    欄位式的大量倉庫進出（匯入用）\n
+    - from_columns / from_rows 由欄位或列建立（數量可為整數、整數值的浮點數或數字字串）\n
+    - validate 以 NumPy 整批驗證並解析 auto 的正負號，返回每列的結果代碼\n
+    - invalid 無效列的遮罩 / errors 無效列的 (列號, 欄位, 原因)\n
+    - items / records 轉為 DepotItem / 紀錄文件（只含有效列）\n
+    \n
+    規則同 DepotItem: auto 依正負數轉為 in / out，in / out 的數量需為正整數，
+    set 的數量可為 0 或負數（仍需為整數）；另外 item 不可為空。
+    無效列只標記在結果代碼中，不逐筆建立 DepotError。\n
+    \n
+    使用範例:\n
+      batch = DepotItemBatch.from_rows(rows)  # rows: [{"type", "item", "amount"}, ...]
+      bad = batch.validate() != VALID
+      await depot.write_transaction(list(batch.items()))
+    """
+
+    __slots__ = ("types", "names", "amounts", "times", "codes")
+
+    def __init__(
+        self,
+        types: np.ndarray,
+        names: np.ndarray,
+        amounts: np.ndarray,
+        times: np.ndarray,
+        codes: np.ndarray,
+    ) -> None:
+        """
+        請使用 from_columns / from_rows 建立
+
+        Args:
+            types: 類型代碼 (uint8，TYPES 的索引，無法辨識為 TYPE_INVALID)
+            names: 物品名稱 (object)
+            amounts: 數量 (int64)
+            times: 時間 (datetime64[us])
+            codes: 每列的結果代碼 (uint8)，轉換階段已可判定的錯誤
+        """
+        self.types = types
+        self.names = names
+        self.amounts = amounts
+        self.times = times
+        self.codes = codes
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    @classmethod
+    def from_columns(
+        cls,
+        types: Sequence[Any],
+        items: Sequence[Any],
+        amounts: Sequence[Any],
+        times: Sequence[Any] | None = None,
+    ) -> "DepotItemBatch":
+        """
+        由欄位建立
+
+        Args:
+            types: 操作類型（不分大小寫，忽略前後空白）
+            items: 物品名稱
+            amounts: 數量
+            times: 時間 (datetime 或 ISO 字串)，預設為現在時間
+
+        Raises:
+            ValueError: 各欄位長度不同
+        """
+        n = len(types)
+        if not (len(items) == len(amounts) == n and (times is None or len(times) == n)):
+            raise ValueError("各欄位長度必須相同")
+        codes = np.zeros(n, dtype=np.uint8)
+
+        names = np.char.lower(np.char.strip(np.asarray(types, dtype=str)))
+        type_codes = np.full(n, TYPE_INVALID, dtype=np.uint8)
+        for code, name in enumerate(TYPES):
+            type_codes[names == name] = code
+        codes[type_codes == TYPE_INVALID] = BAD_TYPE
+
+        item_arr = np.asarray(items, dtype=object)
+        text = np.char.strip(np.asarray(items, dtype=str))
+        codes[(codes == VALID) & ((text == "") | _is_none(item_arr))] = BAD_ITEM
+
+        amount_arr, bad_amount = _to_int64(amounts)
+        codes[(codes == VALID) & bad_amount] = BAD_AMOUNT
+
+        if times is None:
+            time_arr = np.full(n, np.datetime64(datetime.now(), "us"))
+        else:
+            time_arr, bad_time = _to_datetime64(times)
+            codes[(codes == VALID) & bad_time] = BAD_TIME
+
+        return cls(type_codes, item_arr, amount_arr, time_arr, codes)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[dict[str, Any]]) -> "DepotItemBatch":
+        """
+        由 {"type", "item", "amount", "time"(可選)} 列表建立
+
+        Args:
+            rows: 列資料
+        """
+        rows = list(rows)
+        times = [r.get("time") for r in rows]
+        return cls.from_columns(
+            [r.get("type") for r in rows],
+            [r.get("item") for r in rows],
+            [r.get("amount") for r in rows],
+            None if all(t is None for t in times) else times,
+        )
+
+    def validate(self) -> np.ndarray:
+        """
+        整批驗證並解析 auto（就地轉為 in / out 與正數），可重複呼叫
+
+        Returns:
+            np.ndarray: 每列的結果代碼 (uint8)，VALID 為有效，其餘見 REASONS
+        """
+        auto = self.types == TYPE_AUTO
+        negative = auto & (self.amounts <= 0)
+        self.types[auto] = np.where(negative[auto], TYPE_OUT, TYPE_IN)
+        self.amounts[negative] *= -1
+
+        moves = (self.types == TYPE_IN) | (self.types == TYPE_OUT)
+        self.codes[(self.codes == VALID) & moves & (self.amounts <= 0)] = BAD_AMOUNT
+        return self.codes
+
+    @property
+    def invalid(self) -> np.ndarray:
+        """無效列的遮罩（需先 validate）"""
+        return self.codes != VALID
+
+    def errors(self, limit: int | None = None) -> list[tuple[int, str, str]]:
+        """
+        無效列的說明（需先 validate）
+
+        Args:
+            limit: 最多返回幾筆
+
+        Returns:
+            list[tuple[int, str, str]]: (列號, 欄位, 原因)
+        """
+        rows = np.flatnonzero(self.codes)[:limit]
+        return [(int(i), *REASONS[int(self.codes[i])]) for i in rows]
+
+    def items(self) -> Iterator[DepotItem]:
+        """有效列 → DepotItem（需先 validate，不重複檢查）"""
+        for type, item, amount, time in self._valid_columns():
+            yield DepotItem._validated(type, item, amount, time)
+
+    def records(self) -> list[dict[str, Any]]:
+        """有效列 → 紀錄文件 {"type", "item", "amount", "time"}（需先 validate）"""
+        return [
+            {"type": type, "item": item, "amount": amount, "time": time}
+            for type, item, amount, time in self._valid_columns()
+        ]
+
+    def _valid_columns(self) -> Iterator[tuple[str, str, int, datetime]]:
+        valid = self.codes == VALID
+        return zip(
+            [TYPES[c] for c in self.types[valid].tolist()],
+            self.names[valid].tolist(),
+            self.amounts[valid].tolist(),
+            self.times[valid].astype(object).tolist(),
+        )
+
+
+def _is_none(values: np.ndarray) -> np.ndarray:
+    return np.equal(values, None)
+
+
+def _to_int64(values: Sequence[Any]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    數量欄位 → (int64 陣列, 無效遮罩)
+
+    整數直接轉換；浮點數需為整數值（如 Excel 的 5.0）；其他值以字串解析 [+-]數字
+    """
+    arr = np.asarray(values)
+    if arr.dtype.kind == "U" and not all(isinstance(v, str) for v in values):
+        arr = np.asarray(values, dtype=object)  # 數字與字串混合，避免數字被轉成字串
+    n = len(arr)
+    if arr.dtype.kind in "iu":
+        return arr.astype(np.int64), np.zeros(n, dtype=bool)
+    if arr.dtype.kind == "f":
+        bad = ~np.isfinite(arr) | (arr != np.trunc(arr)) | (np.abs(arr) >= 1e18)
+        return np.where(bad, 0, arr).astype(np.int64), bad
+
+    if arr.dtype.kind == "O":  # 混合型別: 整數值的浮點數視為整數
+        arr = np.asarray(
+            [int(v) if isinstance(v, float) and v.is_integer() else v for v in arr],
+            dtype=object,
+        )
+    text = np.char.strip(np.asarray(arr, dtype=str))
+    digits = np.char.lstrip(text, "+-")
+    sign_len = np.char.str_len(text) - np.char.str_len(digits)
+    ok = (
+        np.char.isdigit(digits)
+        & (sign_len <= 1)
+        & (np.char.str_len(digits) <= MAX_DIGITS)
+    )
+    result = np.where(ok, digits, "0").astype(np.int64)
+    result[np.char.startswith(text, "-")] *= -1
+    return result, ~ok
+
+
+def _to_datetime64(values: Sequence[Any]) -> tuple[np.ndarray, np.ndarray]:
+    """時間欄位 → (datetime64[us] 陣列, 無效遮罩)，空值為現在時間"""
+    now = np.datetime64(datetime.now(), "us")
+    try:
+        arr = np.asarray(
+            [now if v is None or v == "" else v for v in values], dtype="datetime64[us]"
+        )
+    except (ValueError, TypeError):  # 含無法解析的值: 逐筆轉換
+        arr = np.empty(len(values), dtype="datetime64[us]")
+        for i, v in enumerate(values):
+            try:
+                arr[i] = now if v is None or v == "" else np.datetime64(v, "us")
+            except (ValueError, TypeError):
+                arr[i] = np.datetime64("NaT")
+    bad = np.isnat(arr)
+    arr[bad] = now
+    return arr, bad
@@ -0,0 +1,586 @@
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Iterator
+from bson import ObjectId, json_util
+from pymongo.errors import ConnectionFailure, DuplicateKeyError
+from storage import (
+    AsyncStorage,
+    MemoryStorage,
+    NextAmount,
+    RECORD_BATCH,
+    batch_ops,
+    plan_batch,
+)
+import asyncio
+import os
+import time
+
+
+class Journal:
+    """
+    本地預寫日誌 (write-ahead journal)\n
+    - append 寫入一筆操作（分段 append-only 檔案，fsync 批次化）\n
+    - sync 強制 fsync\n
+    - rotate 關閉目前分段並開新分段\n
+    - closed_segments / read_segment / drop_segment 依序重播並刪除已套用的分段\n
+    \n
+    檔案格式: <directory>/segment-<序號>.jsonl，每行一筆 bson json_util 操作
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = 4 * 1024 * 1024,
+        fsync_batch: int = 64,
+        fsync_interval: float = 0.05,
+    ) -> None:
+        """
+        Args:
+            directory: 日誌目錄
+            segment_bytes: 單一分段大小上限，超過後自動換新分段
+            fsync_batch: 累積多少筆未 fsync 的操作就立即 fsync
+            fsync_interval: 距離上次 fsync 超過多少秒就 fsync
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = segment_bytes
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+
+        self._pending = 0  # 尚未 fsync 的筆數
+        self._last_sync = time.monotonic()
+        segments = self.segments()
+        self._index = self._segment_index(segments[-1]) + 1 if segments else 1
+        self._file = self._open_segment()
+
+    def append(self, op: dict[str, Any]) -> None:
+        """
+        寫入一筆操作
+
+        Args:
+            op: 操作字典（可含 datetime / ObjectId）
+        """
+        if self._file.tell() >= self.segment_bytes:
+            self.rotate()
+        self._file.write(json_util.dumps(op, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self._pending += 1
+        if (
+            self._pending >= self.fsync_batch
+            or time.monotonic() - self._last_sync >= self.fsync_interval
+        ):
+            self.sync()
+
+    def sync(self) -> None:
+        """將尚未落地的操作 fsync 到磁碟"""
+        if self._pending:
+            os.fsync(self._file.fileno())
+            self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def rotate(self) -> None:
+        """關閉目前分段並開新分段（空分段直接沿用）"""
+        if self._file.tell() == 0:
+            return
+        self.sync()
+        self._file.close()
+        self._index += 1
+        self._file = self._open_segment()
+
+    def segments(self) -> list[Path]:
+        """所有分段（依序號排序）"""
+        return sorted(self.directory.glob("segment-*.jsonl"), key=self._segment_index)
+
+    def closed_segments(self) -> list[Path]:
+        """已關閉（不會再寫入）的分段"""
+        current = self._segment_path(self._index)
+        return [p for p in self.segments() if p != current]
+
+    def read_segment(self, path: Path) -> Iterator[dict[str, Any]]:
+        """
+        讀取分段內的操作，最後一行寫入不完整時忽略
+
+        Args:
+            path: 分段路徑
+        """
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json_util.loads(line)
+                except ValueError:
+                    continue
+
+    def drop_segment(self, path: Path) -> None:
+        """刪除已套用的分段"""
+        path.unlink(missing_ok=True)
+
+    def is_empty(self) -> bool:
+        """是否沒有任何待重播的操作"""
+        return self._file.tell() == 0 and not self.closed_segments()
+
+    def close(self) -> None:
+        """fsync 並關閉目前分段"""
+        self.sync()
+        self._file.close()
+
+    def _open_segment(self):
+        return open(self._segment_path(self._index), "a", encoding="utf-8")
+
+    def _segment_path(self, index: int) -> Path:
+        return self.directory / f"segment-{index:08d}.jsonl"
+
+    @staticmethod
+    def _segment_index(path: Path) -> int:
+        return int(path.stem.split("-")[1])
+
+
+class AsyncJournaledStorage(AsyncStorage):
+    """
+    MongoDB 斷線保護（包裝任一 AsyncStorage）\n
+    - 連線正常: 直接寫入主儲存，並同步更新記憶體影子庫存\n
+    - 斷線時: 寫入本地日誌與影子庫存，讀取改由影子庫存提供（最後已知庫存）\n
+    - 恢復後: 依序重播日誌到主儲存，紀錄以預先產生的 _id 去重\n
+    - 斷線期間的紀錄序號由影子保留，重播時改用主儲存重新保留的序號（維持寫入順序）\n
+    - idempotency key 同時保存在影子；斷線期間與寫入一起寫入日誌，恢復後重播到主儲存\n
+    \n
+    需在應用啟動時 await start()，關閉時 await close()
+    """
+
+    def __init__(
+        self,
+        primary: AsyncStorage,
+        directory: str,
+        retry_interval: float = 2.0,
+    ) -> None:
+        """
+        Args:
+            primary: 主儲存（通常為 AsyncMongoStorage）
+            directory: 日誌目錄
+            retry_interval: 斷線時重試連線的間隔秒數
+        """
+        self.primary = primary
+        self.sync = primary.sync
+        self.journal = Journal(directory)
+        self.shadow = MemoryStorage()  # 最後已知的庫存與斷線期間的紀錄
+        self.retry_interval = retry_interval
+        self.online = True
+        self._tasks: list[asyncio.Task] = []
+        self._replay_lock = asyncio.Lock()
+
+        # 上次未重播完的日誌: 先套用到影子庫存，並視為斷線直到重播完成
+        for path in self.journal.segments():
+            for op in self.journal.read_segment(path):
+                self._apply_shadow(op)
+                self.online = False
+
+    async def start(self) -> None:
+        """啟動背景工作: 定期 fsync 與斷線重試"""
+        self._tasks = [
+            asyncio.create_task(self._sync_loop()),
+            asyncio.create_task(self._recover_loop()),
+        ]
+        try:
+            await self.primary.start()
+            await self.list_items()  # 載入影子庫存
+        except ConnectionFailure:
+            pass
+
+    async def close(self) -> None:
+        """停止背景工作並 fsync 日誌"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.journal.close()
+        await self.primary.close()
+
+    # ---- 讀取: 連線時讀主儲存並更新影子，斷線時讀影子 ----
+    async def find_item(self, item: str) -> dict[str, Any] | None:
+        if self.online:
+            try:
+                doc = await self.primary.find_item(item)
+                if doc is not None:
+                    self._mirror([doc])
+                return doc
+            except ConnectionFailure:
+                self._go_offline()
+        return self.shadow.find_item(item)
+
+    async def list_items(self) -> list[dict[str, Any]]:
+        if self.online:
+            try:
+                docs = await self.primary.list_items()
+                with self.shadow.lock:
+                    self.shadow.items.clear()
+                self._mirror(docs)
+                return docs
+            except ConnectionFailure:
+                self._go_offline()
+        return self.shadow.list_items()
+
+    async def find_records(self, day: str) -> list[dict[str, Any]]:
+        if self.online:
+            try:
+                return await self.primary.find_records(day)
+            except ConnectionFailure:
+                self._go_offline()
+        return self.shadow.find_records(day)
+
+    async def iter_record_batches(
+        self, day: str, batch_size: int = RECORD_BATCH
+    ) -> AsyncIterator[bytes]:
+        if self.online:
+            sent = False
+            try:
+                async for batch in self.primary.iter_record_batches(day, batch_size):
+                    sent = True
+                    yield batch
+                return
+            except ConnectionFailure:
+                self._go_offline()
+                if sent:  # 已輸出部分紀錄，改讀影子會重複
+                    raise
+        async for batch in super().iter_record_batches(day, batch_size):
+            yield batch
+
+    async def record_days(self) -> list[str]:
+        if self.online:
+            try:
+                return await self.primary.record_days()
+            except ConnectionFailure:
+                self._go_offline()
+        return self.shadow.record_days()
+
+    async def find_snapshot(self, before: datetime) -> dict[str, Any] | None:
+        if self.online:
+            try:
+                return await self.primary.find_snapshot(before)
+            except ConnectionFailure:
+                self._go_offline()
+        return self.shadow.find_snapshot(before)
+
+    # ---- 寫入: 連線時寫主儲存，失敗或斷線時寫日誌 ----
+    async def set_amount(
+        self, item: str, amount: int, seq: int | None = None
+    ) -> None:
+        await self._write({"op": "amount", "item": item, "amount": amount, "seq": seq})
+
+    async def seed_item(self, item: str, amount: int, tag: dict[str, Any]) -> None:
+        await self._write({"op": "seed", "item": item, "amount": amount, "tag": tag})
+
+    async def set_tag(self, item: str, tag: dict[str, Any]) -> None:
+        await self._write({"op": "tag", "item": item, "tag": tag})
+
+    async def remove_if_empty(self, item: str) -> bool:
+        removed = self.shadow.remove_if_empty(item)
+        if self.online:
+            try:
+                return await self.primary.remove_if_empty(item)
+            except ConnectionFailure:
+                self._go_offline()
+        if removed:
+            self.journal.append({"op": "remove", "item": item})
+        return removed
+
+    async def clear_inventory(self) -> int:
+        count = len(self.shadow.items)
+        if self.online:
+            try:
+                count = await self.primary.clear_inventory()
+                self.shadow.clear_inventory()
+                return count
+            except ConnectionFailure:
+                self._go_offline()
+        self.shadow.clear_inventory()
+        self.journal.append({"op": "clear"})
+        return count
+
+    async def drop_records(self, day: str) -> None:
+        # 封存只在連線時進行，斷線時不寫日誌（下次再封存）
+        if not self.online:
+            raise ConnectionFailure("MongoDB 斷線中，暫不刪除紀錄")
+        await self.primary.drop_records(day)
+        self.shadow.drop_records(day)
+
+    async def write_batch(
+        self, day: str, records: list[dict[str, Any]], next_amount: NextAmount
+    ) -> list[tuple[Any, int]]:
+        if self.online:
+            try:
+                results = await self.primary.write_batch(day, records, next_amount)
+                amounts = {r["item"]: a for r, (_, a) in zip(records, results)}
+                docs = [{"_id": i, **r} for r, (i, _) in zip(records, results)]
+                ops = batch_ops(day, amounts, docs)
+                self._apply_shadow({"op": "batch", "ops": ops})
+                return results
+            except ConnectionFailure:
+                self._go_offline()
+
+        # 斷線: 以影子庫存計算，整批寫成日誌的一行
+        current = {
+            r["item"]: (self.shadow.find_item(r["item"]) or {}).get("amount", 0)
+            for r in records
+        }
+        results, amounts, docs = plan_batch(current, records, next_amount)
+        ops = batch_ops(day, amounts, docs)
+        self._apply_shadow({"op": "batch", "ops": ops})
+        self.journal.append({"op": "batch", "ops": ops})
+        return results
+
+    async def reserve_seq(self, count: int = 1) -> int:
+        if self.online:
+            try:
+                first = await self.primary.reserve_seq(count)
+                with self.shadow.lock:
+                    last = first + count - 1
+                    self.shadow.record_seq = max(self.shadow.record_seq, last)
+                return first
+            except ConnectionFailure:
+                self._go_offline()
+        return self.shadow.reserve_seq(count)
+
+    async def last_seq(self) -> int:
+        if self.online:
+            try:
+                return await self.primary.last_seq()
+            except ConnectionFailure:
+                self._go_offline()
+        return self.shadow.last_seq()
+
+    async def save_snapshot(self, snapshot: dict[str, Any]) -> None:
+        if self.online:
+            try:
+                await self.primary.save_snapshot(snapshot)
+                self.shadow.save_snapshot(snapshot)
+                return
+            except ConnectionFailure:
+                self._go_offline()
+        # 斷線期間的快照序號屬於影子，不寫入日誌（恢復後由下次自動快照補上）
+        self.shadow.save_snapshot(snapshot)
+
+    async def append_record(self, day: str, record: dict[str, Any]) -> Any:
+        record = {"_id": ObjectId(), **record}  # 預先產生 _id，重播時用於去重
+        await self._write({"op": "record", "day": day, "record": record})
+        return record["_id"]
+
+    async def append_records(self, day: str, records: list[dict[str, Any]]) -> None:
+        await self._write({"op": "records", "day": day, "records": records})
+
+    # ---- 重送 key: 影子保留本行程的 key，斷線期間寫入日誌（與寫入依序重播） ----
+    async def insert_key(self, key: str) -> bool:
+        if self.online:
+            try:
+                inserted = await self.primary.insert_key(key)
+                if inserted:
+                    self.shadow.insert_key(key)
+                return inserted
+            except ConnectionFailure:
+                self._go_offline()
+        if not self.shadow.insert_key(key):
+            return False
+        self.journal.append({"op": "key", "key": key})
+        return True
+
+    async def get_key(self, key: str) -> dict[str, Any] | None:
+        if self.online:
+            try:
+                return await self.primary.get_key(key)
+            except ConnectionFailure:
+                self._go_offline()
+        return self.shadow.get_key(key)
+
+    async def store_key_result(self, key: str, result: dict[str, Any]) -> None:
+        self.shadow.store_key_result(key, result)
+        if self.online:
+            try:
+                await self.primary.store_key_result(key, result)
+                return
+            except ConnectionFailure:
+                self._go_offline()
+        self.journal.append({"op": "key_result", "key": key, "result": result})
+
+    async def release_key(self, key: str) -> None:
+        self.shadow.release_key(key)
+        if self.online:
+            try:
+                await self.primary.release_key(key)
+                return
+            except ConnectionFailure:
+                self._go_offline()
+        self.journal.append({"op": "key_release", "key": key})
+
+    # ---- 內部 ----
+    async def _write(self, op: dict[str, Any]) -> None:
+        """寫入一筆操作（連線時寫主儲存，否則寫日誌），並更新影子庫存"""
+        self._apply_shadow(op)
+        if self.online:
+            try:
+                await self._apply_primary(op)
+                return
+            except ConnectionFailure:
+                self._go_offline()
+        self.journal.append(op)
+
+    def _apply_shadow(self, op: dict[str, Any]) -> None:
+        """套用操作到影子庫存"""
+        match op["op"]:
+            case "amount":
+                self.shadow.set_amount(op["item"], op["amount"], op.get("seq"))
+            case "seed":
+                self.shadow.seed_item(op["item"], op["amount"], op["tag"])
+            case "tag":
+                self.shadow.set_tag(op["item"], op["tag"])
+            case "remove":
+                self.shadow.remove_if_empty(op["item"])
+            case "clear":
+                self.shadow.clear_inventory()
+            case "key":
+                self.shadow.insert_key(op["key"])
+            case "key_result":
+                self.shadow.store_key_result(op["key"], op["result"])
+            case "key_release":
+                self.shadow.release_key(op["key"])
+            case "record":
+                # 只保留今天的紀錄，避免長時間運行時無限成長
+                if op["day"] == f"{date.today()}":
+                    self.shadow.append_record(op["day"], op["record"])
+            case "records":
+                if op["day"] == f"{date.today()}":
+                    self.shadow.append_records(op["day"], op["records"])
+            case "snapshot":
+                self.shadow.save_snapshot(op["snapshot"])
+            case "batch":
+                for sub in op["ops"]:
+                    self._apply_shadow(sub)
+
+    async def _apply_primary(
+        self, op: dict[str, Any], seqs: dict[int, int] | None = None
+    ) -> None:
+        """
+        套用操作到主儲存（數量為絕對值，重複套用結果相同）
+
+        Args:
+            op: 操作
+            seqs: 重播日誌時傳入，斷線期間的序號 → 主儲存重新保留的序號
+        """
+        if seqs is not None:
+            op = await self._remap_seqs(op, seqs)
+        match op["op"]:
+            case "amount":
+                await self.primary.set_amount(op["item"], op["amount"], op.get("seq"))
+            case "seed":
+                await self.primary.seed_item(op["item"], op["amount"], op["tag"])
+            case "tag":
+                await self.primary.set_tag(op["item"], op["tag"])
+            case "remove":
+                await self.primary.remove_if_empty(op["item"])
+            case "clear":
+                await self.primary.clear_inventory()
+            case "key":
+                await self.primary.insert_key(op["key"])  # 已存在時不變
+            case "key_result":
+                await self.primary.store_key_result(op["key"], op["result"])
+            case "key_release":
+                await self.primary.release_key(op["key"])
+            case "record":
+                try:
+                    await self.primary.append_record(op["day"], dict(op["record"]))
+                except DuplicateKeyError:
+                    pass  # 已重播過
+            case "records":
+                records = [dict(r) for r in op["records"]]
+                await self.primary.append_records(op["day"], records)  # 重複 _id 會略過
+            case "snapshot":
+                if seqs is None:  # 舊版日誌中斷線期間的快照不重播（序號屬於影子）
+                    await self.primary.save_snapshot(op["snapshot"])
+            case "batch":
+                # 重播時逐項套用: 數量為絕對值、紀錄依 _id 去重，中斷後重播結果相同
+                for sub in op["ops"]:
+                    await self._apply_primary(sub, seqs)
+
+    async def _remap_seqs(
+        self, op: dict[str, Any], seqs: dict[int, int]
+    ) -> dict[str, Any]:
+        """
+        將斷線期間的序號換成主儲存的序號（依日誌順序保留，維持寫入順序）\n
+        重播中斷後再次重播會保留新的序號: 數量為絕對值且序號更大，已寫入的紀錄視為已計入
+        """
+
+        async def remap(doc: dict[str, Any]) -> dict[str, Any]:
+            seq = doc.get("seq")
+            if seq is None:  # 舊版日誌或未帶序號的操作
+                return doc
+            if seq not in seqs:
+                seqs[seq] = await self.primary.reserve_seq(1)
+            return {**doc, "seq": seqs[seq]}
+
+        match op["op"]:
+            case "amount":
+                return await remap(op)
+            case "record":
+                return {**op, "record": await remap(op["record"])}
+            case "records":
+                return {**op, "records": [await remap(r) for r in op["records"]]}
+        return op
+
+    def _mirror(self, docs: list[dict[str, Any]]) -> None:
+        """以主儲存讀到的物品文件更新影子（數量、tag 與序號）"""
+        with self.shadow.lock:
+            for d in docs:
+                mirrored = {
+                    "item": d["item"],
+                    "amount": d.get("amount", 0),
+                    "tag": d.get("tag", {}),
+                }
+                if d.get("seq") is not None:
+                    mirrored["seq"] = d["seq"]
+                    self.shadow.record_seq = max(self.shadow.record_seq, d["seq"])
+                self.shadow.items[d["item"]] = mirrored
+
+    def _go_offline(self) -> None:
+        if self.online:
+            self.online = False
+            _log("WARNING", "MongoDB 斷線，改寫入本地日誌")
+
+    async def _replay(self) -> None:
+        """依序重播日誌到主儲存，全部完成後切回連線模式"""
+        async with self._replay_lock:
+            while True:
+                self.journal.rotate()
+                segments = self.journal.closed_segments()
+                if not segments:
+                    break
+                seqs: dict[int, int] = {}
+                for path in segments:
+                    count = 0
+                    for op in self.journal.read_segment(path):
+                        await self._apply_primary(op, seqs)
+                        count += 1
+                    self.journal.drop_segment(path)
+                    _log("SUCCESS", "重播本地日誌", f"{path.name}: {count} 筆")
+            if self.journal.is_empty():
+                self.online = True
+                _log("SUCCESS", "MongoDB 已恢復連線")
+
+    async def _recover_loop(self) -> None:
+        """斷線時定期嘗試連線並重播日誌"""
+        while True:
+            await asyncio.sleep(self.retry_interval)
+            if self.online:
+                continue
+            try:
+                await self.primary.record_days()  # 連線測試
+                await self._replay()
+            except ConnectionFailure:
+                continue
+
+    async def _sync_loop(self) -> None:
+        """定期 fsync，讓批次中最後幾筆也能在時限內落地"""
+        while True:
+            await asyncio.sleep(self.journal.fsync_interval)
+            self.journal.sync()
+
+
+def _log(level: str, operation: str, details: str = "") -> None:
+    from depot import _log_operation  # 避免循環匯入
+
+    _log_operation(level, operation, details)
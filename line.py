@@ -1,3 +1,7 @@
+from startup import StartupTimer
+
+startup = StartupTimer()  # 需在其他 import 之前建立，才能量到模組載入時間
+
 from flask import (
     Flask,
     request,
@@ -8,33 +12,76 @@ from flask import (
     redirect,
     url_for,
 )
-from linebot import LineBotApi, WebhookHandler
-from linebot.exceptions import InvalidSignatureError
-from linebot.models import (
-    MessageEvent,
-    TextMessage,
-    TextSendMessage,
-    FlexSendMessage,
-    URIAction,
-    MessageAction,
-    BubbleContainer,
-    BoxComponent,
-    TextComponent,
-    ButtonComponent,
-)
+from flask_sock import Sock
 from dotenv import dotenv_values
-from depot import Depot
-import requests
+from typing import TYPE_CHECKING, Any, Callable, TypeVar
+import functools
 import json
+import queue
+import threading
+
+if TYPE_CHECKING:
+    from depot import Depot
+    from dispatch import CommandDispatcher
+
+startup.mark("imports")
 
 
 app = Flask(__name__)
+sock = Sock(app)
 
 CONFIG = json.load(open("./config/server_config.json", "r", encoding="utf-8"))
 env = dotenv_values()
-line_bot_api = LineBotApi(env["LINE_CHANNEL_ACCESS_TOKEN"])
-handler = WebhookHandler(env["LINE_CHANNEL_SECRET"])
-depot = Depot()
+startup.mark("app")
+startup.log(print)
+
+
+T = TypeVar("T")
+
+
+# ---- 延遲初始化: linebot 與資料庫在第一次使用時才載入/連線 ----
+def once(factory: Callable[[], T]) -> Callable[[], T]:
+    """
+    延遲建立的單例: 第一次呼叫時建立，之後返回同一個物件\n
+    與 functools.cache 不同，多個 thread 同時第一次呼叫也只會建立一次
+    """
+    lock = threading.Lock()
+    created: list[T] = []
+
+    @functools.wraps(factory)
+    def get() -> T:
+        if not created:
+            with lock:
+                if not created:
+                    created.append(factory())
+        return created[0]
+
+    return get
+
+
+@once
+def line_bot() -> tuple[Any, Any]:
+    """
+    LINE Messaging API 與 webhook handler
+
+    Returns:
+        tuple[LineBotApi, WebhookHandler]: 已註冊 handle_message 的 handler
+    """
+    from linebot import LineBotApi, WebhookHandler
+    from linebot.models import MessageEvent, TextMessage
+
+    api = LineBotApi(env["LINE_CHANNEL_ACCESS_TOKEN"])
+    handler = WebhookHandler(env["LINE_CHANNEL_SECRET"])
+    handler.add(MessageEvent, message=TextMessage)(handle_message)
+    return api, handler
+
+
+@once
+def get_depot() -> "Depot":
+    """倉庫（第一次查詢庫存時才連線 MongoDB）"""
+    from depot import Depot
+
+    return Depot()
 
 
 @app.route("/")
@@ -44,11 +91,13 @@ def index():
 
 @app.route("/callback", methods=["POST"])
 def callback():
+    from linebot.exceptions import InvalidSignatureError
+
     signature = request.headers["X-Line-Signature"]
     body = request.get_data(as_text=True)
 
     try:
-        handler.handle(body, signature)
+        line_bot()[1].handle(body, signature)
     except InvalidSignatureError:
         abort(400)
     return "OK"
@@ -66,78 +115,120 @@ def line_web_menu():
     return render_template("line_web_menu.html")
 
 
-@app.route("/sc", methods=["POST"])
-def sc_do():
-    try:
-        # 接收來自前端的資料
-        data = request.get_json()
+@once
+def dispatcher() -> "CommandDispatcher":
+    """機器人指令佇列（第一次轉發時才載入 requests 並啟動 worker）"""
+    from dispatch import CommandDispatcher
 
-        # 轉發到 sc
-        response = requests.post(CONFIG["url"]["sc"], json=data, timeout=30)
+    targets = {"sc": CONFIG["url"]["sc"], "xc": CONFIG["url"]["xc"]}
+    return CommandDispatcher(targets, **CONFIG.get("dispatch", {}))
 
-        # 回傳結果給前端
-        return (
-            jsonify(
-                {
-                    "status": "success",
-                    "message": "SC request forwarded successfully",
-                    "response_status": response.status_code,
-                }
-            ),
-            response.status_code,
-        )
 
-    except requests.exceptions.RequestException as e:
+def enqueue(target: str, label: str):
+    """排入轉發任務並立即回應 202，結果由 /jobs/<id> 或 /jobs/ws 查詢"""
+    data = request.get_json(silent=True)
+    if data is None:
+        return jsonify({"status": "error", "message": "Invalid JSON body"}), 400
+
+    try:
+        job = dispatcher().submit(target, data)
+    except queue.Full:
         return (
             jsonify(
                 {
                     "status": "error",
-                    "message": f"Failed to forward SC request: {str(e)}",
+                    "message": f"{label} queue is full, please retry later",
                 }
             ),
-            500,
+            503,
+            {"Retry-After": "5"},
         )
-    except Exception as e:
-        return jsonify({"status": "error", "message": f"Internal error: {str(e)}"}), 500
+
+    return (
+        jsonify(
+            {
+                "status": "queued",
+                "message": f"{label} request queued",
+                "job_id": job.id,
+                "status_url": url_for("job_status", job_id=job.id),
+            }
+        ),
+        202,
+    )
+
+
+@app.route("/sc", methods=["POST"])
+def sc_do():
+    return enqueue("sc", "SC")
 
 
 @app.route("/xc", methods=["POST"])
 def xc_do():
-    try:
-        # 接收來自前端的資料
-        data = request.get_json()
+    return enqueue("xc", "XC")
 
-        # 轉發到 xc
-        response = requests.post(CONFIG["url"]["xc"], json=data, timeout=30)
 
-        # 回傳結果給前端
-        return (
-            jsonify(
-                {
-                    "status": "success",
-                    "message": "XC request forwarded successfully",
-                    "response_status": response.status_code,
-                }
-            ),
-            response.status_code,
-        )
+@app.route("/jobs")
+def jobs():
+    return jsonify({"targets": dispatcher().stats(), "jobs": dispatcher().recent()})
 
-    except requests.exceptions.RequestException as e:
-        return (
-            jsonify(
-                {
-                    "status": "error",
-                    "message": f"Failed to forward XC request: {str(e)}",
-                }
-            ),
-            500,
-        )
-    except Exception as e:
-        return jsonify({"status": "error", "message": f"Internal error: {str(e)}"}), 500
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id: str):
+    job = dispatcher().get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+
+@sock.route("/jobs/ws")
+def jobs_ws(ws):
+    """
+    任務狀態推送（每次變化送出 Job.to_dict()）\n
+    ?ids=a,b 只推送指定任務（先送出目前狀態），全部完成後關閉；未指定則推送所有任務
+    """
+    from dispatch import FINISHED
+
+    ids = {i for i in request.args.get("ids", "").split(",") if i}
+    updates = dispatcher().watch()  # 先訂閱再讀目前狀態，避免漏掉變化
+    try:
+        pending = set()
+        for job_id in ids:
+            job = dispatcher().get(job_id)
+            if job is not None:
+                ws.send(json.dumps(job.to_dict(), ensure_ascii=False))
+                if job.status not in FINISHED:
+                    pending.add(job_id)
+
+        while pending or not ids:
+            try:
+                message = updates.get(timeout=15)
+            except queue.Empty:
+                if not ws.connected:
+                    break
+                continue
+            if ids and message["id"] not in pending:
+                continue
+            ws.send(json.dumps(message, ensure_ascii=False))
+            if message["status"] in FINISHED:
+                pending.discard(message["id"])
+    finally:
+        dispatcher().unwatch(updates)
 
 
-@handler.add(MessageEvent, message=TextMessage)
 def handle_message(event):
+    """文字訊息處理（由 line_bot() 註冊到 webhook handler）"""
+    from linebot.models import (
+        TextSendMessage,
+        FlexSendMessage,
+        URIAction,
+        MessageAction,
+        BubbleContainer,
+        BoxComponent,
+        TextComponent,
+        ButtonComponent,
+    )
+
+    line_bot_api = line_bot()[0]
     msg: str = event.message.text.strip()
 
     if msg.startswith("!"):  # 指令區域，未處理這邊可擴充
@@ -198,7 +289,7 @@ def handle_message(event):
 
 
 def get_depot_inventory():
-    inventory = depot.get_inventory()
+    inventory = get_depot().get_inventory()
     reply = "當前倉庫剩餘:\n"
     if inventory is None:
         reply += "  無物品"
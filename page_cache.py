@@ -0,0 +1,182 @@
+from dataclasses import dataclass
+from fastapi import Request
+from fastapi.responses import Response
+from fastapi.templating import Jinja2Templates
+from urllib.parse import urlsplit
+from typing import Any
+import hashlib
+import gzip
+import json
+
+try:  # brotli 為選用套件，未安裝時只提供 gzip
+    import brotli
+except ImportError:
+    brotli = None
+
+
+@dataclass(slots=True)
+class CachedPage:
+    """已渲染並預先壓縮的頁面"""
+
+    body: bytes
+    etag: str
+    gzip_body: bytes
+    br_body: bytes | None
+
+
+class PageCache:
+    """
+    靜態模板渲染快取\n
+    - response 回傳快取頁面（支援 ETag / If-None-Match 與 gzip / br）\n
+    - warm 啟動時預先渲染並壓縮頁面\n
+    \n
+    快取鍵為 模板名稱 + 版本 + request.base_url，
+    因為模板內的 url_for 會輸出含主機名稱的絕對網址。\n
+    版本: context 固定的頁面傳入固定字串、依檔案產生的頁面傳入 mtime（每次請求不需序列化 context）；
+    未指定時以 context 雜湊作為版本。\n
+    只適用於內容不隨資料變動的頁面（首頁、狀態頁等）。
+    """
+
+    def __init__(self, templates: Jinja2Templates, max_entries: int = 64) -> None:
+        self.templates = templates
+        self.max_entries = max_entries
+        self.pages: dict[tuple[str, str, str], CachedPage] = {}
+
+    def response(
+        self,
+        request: Request,
+        name: str,
+        context: dict[str, Any] | None = None,
+        status_code: int = 200,
+        version: str | None = None,
+    ) -> Response:
+        """
+        回傳快取頁面，必要時先渲染
+
+        Args:
+            request: 目前請求
+            name: 模板名稱
+            context: 模板參數（不含 request；未指定 version 時需可 JSON 序列化）
+            status_code: HTTP 狀態碼
+            version: context 的版本（相同版本視為相同內容），None 時計算 context 雜湊
+
+        Returns:
+            Response: 304 或（壓縮後的）HTML 回應
+        """
+        page = self.render(request, name, context or {}, version)
+        headers = {
+            "ETag": page.etag,
+            "Cache-Control": "no-cache",  # 每次向伺服器驗證 ETag
+            "Vary": "Accept-Encoding",
+        }
+
+        if status_code == 200 and page.etag in request.headers.get(
+            "if-none-match", ""
+        ):
+            return Response(status_code=304, headers=headers)
+
+        accept = request.headers.get("accept-encoding", "")
+        body = page.body
+        if page.br_body is not None and "br" in accept:
+            body = page.br_body
+            headers["Content-Encoding"] = "br"
+        elif "gzip" in accept:
+            body = page.gzip_body
+            headers["Content-Encoding"] = "gzip"
+
+        return Response(
+            content=body,
+            status_code=status_code,
+            media_type="text/html; charset=utf-8",
+            headers=headers,
+        )
+
+    def render(
+        self,
+        request: Request,
+        name: str,
+        context: dict[str, Any],
+        version: str | None = None,
+    ) -> CachedPage:
+        """
+        取得（或渲染並寫入）快取頁面
+
+        Args:
+            request: 目前請求，url_for 需要
+            name: 模板名稱
+            context: 模板參數（不含 request）
+            version: context 的版本，None 時計算 context 雜湊
+
+        Returns:
+            CachedPage: 快取頁面
+        """
+        if version is None:
+            version = hashlib.blake2b(
+                json.dumps(context, sort_keys=True, default=str).encode(),
+                digest_size=16,
+            ).hexdigest()
+        key = (name, version, str(request.base_url))
+
+        page = self.pages.get(key)
+        if page is None:
+            html = self.templates.get_template(name).render(
+                {**context, "request": request}
+            )
+            page = self._compress(html.encode("utf-8"))
+            if len(self.pages) >= self.max_entries:
+                self.pages.pop(next(iter(self.pages)))  # 移除最舊的項目
+            self.pages[key] = page
+        return page
+
+    def warm(
+        self,
+        app: Any,
+        base_urls: list[str],
+        pages: list[tuple[str, dict[str, Any], str | None]],
+    ) -> int:
+        """
+        啟動時預先渲染並壓縮頁面
+
+        Args:
+            app: FastAPI 應用（url_for 需要路由表）
+            base_urls: 預期的對外網址，例如 server_config 的 web / web_local
+            pages: (模板名稱, context, 版本) 列表，版本需與 response 使用的相同
+
+        Returns:
+            int: 預先渲染的頁面數
+        """
+        count = 0
+        for base_url in base_urls:
+            url = urlsplit(base_url)
+            host = url.netloc.encode("latin-1")
+            port = url.port or (443 if url.scheme == "https" else 80)
+            scope = {
+                "type": "http",
+                "scheme": url.scheme,
+                "server": (url.hostname, port),
+                "path": "/",
+                "root_path": "",
+                "query_string": b"",
+                "headers": [(b"host", host)],
+                "app": app,
+                "router": app.router,
+            }
+            for name, context, version in pages:
+                self.render(Request(scope), name, context, version)
+                count += 1
+        return count
+
+    def clear(self) -> None:
+        """清空快取（模板或內容變更時使用）"""
+        self.pages.clear()
+
+    @staticmethod
+    def _compress(body: bytes) -> CachedPage:
+        """計算 ETag 並預先壓縮"""
+        etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        return CachedPage(
+            body=body,
+            etag=etag,
+            gzip_body=gzip.compress(body, compresslevel=9, mtime=0),
+            br_body=brotli.compress(body, quality=11) if brotli else None,
+        )
@@ -0,0 +1,156 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any
+import asyncio
+import json
+import time
+
+
+@dataclass(slots=True)
+class Reading:
+    """單一物品的最新秤重讀數（body 為預先序列化的 JSON）"""
+
+    etag: str
+    body: bytes
+
+
+class ReadingTable:
+    """
+    ESP32 最新讀數表（記憶體內）\n
+    - update_frame 由 ESP 接收路徑寫入每一幀資料\n
+    - get 取得物品最新讀數\n
+    - wait_change 長輪詢：等待讀數與客戶端 ETag 不同\n
+    - configure 套用（新的）物品設定，設定檔變更時不需重啟\n
+    \n
+    每筆讀數在更新時就序列化成 JSON 與 ETag，
+    讀取端 (/api/data) 不需再做任何計算。
+    """
+
+    def __init__(self, item_config: list[dict[str, Any]]) -> None:
+        """
+        Args:
+            item_config: config/item_id.json 內容
+        """
+        self.seq: int = 0  # 全域版本號，用於 ETag
+        self.epoch: str = f"{int(time.time()):x}"  # 避免重啟後 ETag 重複
+        self.esp_map: dict[str, str] = {}  # esp 欄位 -> 物品名稱
+        self.readings: dict[str, Reading] = {}  # 物品名稱 -> 讀數
+        self.counts: dict[str, int | float] = {}  # 物品名稱 -> 最新個數
+        self.settings: dict[str, dict[str, Any]] = {}  # 物品名稱 -> 設定
+        self._changed = asyncio.Event()
+        self.configure(item_config)
+
+    def configure(self, item_config: list[dict[str, Any]]) -> None:
+        """
+        套用（新的）物品設定: 新物品從 0 開始，設定變動的物品以目前個數重新序列化，
+        不在設定中的物品移除讀數
+
+        Args:
+            item_config: config/item_id.json 內容
+        """
+        self.esp_map = {i["esp"]: i["name"] for i in item_config}
+        names = {i["name"] for i in item_config}
+        removed = [name for name in self.readings if name not in names]
+        for name in removed:
+            del self.readings[name]
+            self.counts.pop(name, None)
+            self.settings.pop(name, None)
+        changed = bool(removed)
+        for i in item_config:
+            setting = i.get("setting", {})
+            if i["name"] in self.readings and self.settings.get(i["name"]) == setting:
+                continue
+            self.settings[i["name"]] = setting
+            self._set(i["name"], self.counts.get(i["name"], 0), None)
+            changed = True
+
+        if changed:  # 喚醒所有長輪詢
+            self._changed.set()
+            self._changed = asyncio.Event()
+
+    def update_frame(self, data: dict[str, Any]) -> None:
+        """
+        以 ESP32 傳來的一幀資料更新讀數，只有數值改變的物品才會更新版本
+
+        Args:
+            data: ESP32 JSON，例如 {"weight": 12.3, "small": 4, "final": false}
+        """
+        changed = False
+        now = datetime.now().isoformat(timespec="milliseconds")
+        for key, value in data.items():
+            name = self.esp_map.get(key)
+            if name is None or not isinstance(value, (int, float)):
+                continue
+            if self.counts.get(name) != value:
+                self._set(name, value, now)
+                changed = True
+
+        if changed:  # 喚醒所有長輪詢
+            self._changed.set()
+            self._changed = asyncio.Event()
+
+    def get(self, item: str) -> Reading | None:
+        """
+        取得物品最新讀數
+
+        Args:
+            item: 物品名稱或 esp 欄位名稱
+
+        Returns:
+            Reading | None: 讀數，未配置的物品返回 None
+        """
+        return self.readings.get(item) or self.readings.get(
+            self.esp_map.get(item, "")
+        )
+
+    async def wait_change(
+        self, item: str, etag: str, timeout: float
+    ) -> Reading | None:
+        """
+        長輪詢：等待物品讀數的 ETag 與客戶端不同，或逾時
+
+        Args:
+            item: 物品名稱或 esp 欄位名稱
+            etag: 客戶端目前持有的 ETag (If-None-Match)
+            timeout: 最長等待秒數
+
+        Returns:
+            Reading | None: 最新讀數（逾時則與客戶端相同）
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        reading = self.get(item)
+        while reading is not None and reading.etag == etag:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+            reading = self.get(item)
+        return reading
+
+    def _set(
+        self,
+        name: str,
+        count: int | float,
+        timestamp: str | None,
+    ) -> None:
+        """寫入讀數並預先序列化"""
+        self.seq += 1
+        self.counts[name] = count
+        setting = self.settings.get(name, {})
+        unit_weight = setting.get("unit_weight", 0)
+        body = {
+            "item": name,
+            "count": count,
+            "weight": count * unit_weight,
+            "unit_weight": unit_weight,
+            "min_weight": setting.get("min_weight_warning", 0),
+            "timestamp": timestamp,
+        }
+        self.readings[name] = Reading(
+            etag=f'"{self.epoch}-{self.seq}"',
+            body=json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode(),
+        )
@@ -0,0 +1,171 @@
+from typing import Any, Literal
+from bson import ObjectId
+from storage import AsyncStorage
+import asyncio
+
+Ack = Literal["buffered", "committed"]
+RETRY_INTERVAL = 1.0  # 寫入失敗後重試的間隔秒數
+
+
+class RecordBuffer:
+    """
+    紀錄的 group commit 緩衝（write-behind）\n
+    - append 加入一筆紀錄，返回預先產生的紀錄 ID\n
+    - flush 立即寫入所有待寫紀錄\n
+    - close 等待寫入中的批次完成、停止背景寫入並 flush（lifespan 關閉時呼叫）\n
+    \n
+    所有呼叫端（HTTP、ESP、Menu）的紀錄集中後，
+    每 max_delay_ms 毫秒或累積 max_records 筆以 append_records (insert_many) 一次寫入。\n
+    \n
+    ack:\n
+    - "committed"（預設）: append 等到該批寫入完成才返回，寫入失敗時拋出例外\n
+    - "buffered": append 立即返回，延遲最低；寫入失敗的紀錄留在緩衝中每 RETRY_INTERVAL 秒重試，
+      行程在 flush 前異常結束會遺失尚未寫入的紀錄
+    """
+
+    def __init__(
+        self,
+        storage: AsyncStorage,
+        max_records: int = 256,
+        max_delay_ms: float = 5,
+        ack: Ack = "committed",
+    ) -> None:
+        """
+        Args:
+            storage: 寫入的儲存引擎
+            max_records: 累積多少筆立即寫入
+            max_delay_ms: 第一筆加入後最多等待的毫秒數
+            ack: "committed" / "buffered"
+        """
+        if ack not in ("buffered", "committed"):
+            raise ValueError(f"未知的 ack 模式: {ack}")
+        self.storage = storage
+        self.max_records = max_records
+        self.max_delay = max_delay_ms / 1000
+        self.ack: Ack = ack
+
+        self._pending: list[tuple[str, dict[str, Any], asyncio.Future | None]] = []
+        self._wakeup = asyncio.Event()  # 有待寫紀錄
+        self._full = asyncio.Event()  # 已達 max_records
+        self._lock = asyncio.Lock()  # 依序寫入，保持紀錄順序
+        self._task: asyncio.Task | None = None
+        self._closing = False  # close 後背景寫入在目前批次完成時結束
+
+    async def append(self, day: str, record: dict[str, Any]) -> Any:
+        """
+        加入一筆紀錄
+
+        Args:
+            day: 紀錄資料表 (YYYY-MM-DD)
+            record: 紀錄內容
+
+        Returns:
+            Any: 紀錄 ID
+        """
+        if self._task is None and not self._closing:
+            self._task = asyncio.create_task(self._run())
+        record = {"_id": ObjectId(), **record}
+        future = None
+        if self.ack == "committed":
+            future = asyncio.get_running_loop().create_future()
+        self._pending.append((day, record, future))
+        self._wakeup.set()
+        if len(self._pending) >= self.max_records:
+            self._full.set()
+        if self._closing:
+            await self.flush()  # 已關閉: 直接寫入
+        if future is not None:
+            await future
+        return record["_id"]
+
+    async def flush(self) -> None:
+        """
+        立即寫入所有待寫紀錄
+
+        Raises:
+            Exception: 寫入失敗（buffered 的紀錄仍保留在緩衝中）
+        """
+        while self._pending:
+            await self._commit_next()
+
+    async def close(self) -> None:
+        """
+        停止背景寫入並 flush（不取消寫入中的批次，等待其完成）
+
+        Raises:
+            Exception: 最後的 flush 寫入失敗
+        """
+        self._closing = True
+        if self._task is not None:
+            self._wakeup.set()
+            self._full.set()  # 不再等待 max_delay
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        """背景寫入: 等第一筆後最多 max_delay 秒（或滿 max_records 筆）寫入一批"""
+        while not self._closing:
+            await self._wakeup.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            if self._closing:
+                break  # 剩下的由 close 的 flush 寫入
+            try:
+                await self._commit_next()
+            except Exception:
+                await asyncio.sleep(RETRY_INTERVAL)  # 紀錄已留在緩衝中，稍後重試
+
+    async def _commit_next(self) -> None:
+        """
+        取出最多 max_records 筆，依日期分組寫入並通知等待中的呼叫端\n
+        寫入失敗時 committed 的呼叫端收到例外，buffered 的紀錄放回緩衝最前面等待重試；
+        寫入中途被取消時整批放回（重複的 _id 視為已寫入，重試不會重複）
+
+        Raises:
+            Exception: 寫入失敗
+        """
+        async with self._lock:
+            batch = self._pending[: self.max_records]
+            self._pending = self._pending[self.max_records :]
+            if not self._pending:
+                self._wakeup.clear()
+            if len(self._pending) < self.max_records:
+                self._full.clear()
+            if not batch:
+                return
+
+            days: dict[str, list[dict[str, Any]]] = {}
+            for day, record, _ in batch:
+                days.setdefault(day, []).append(record)
+            try:
+                for day, records in days.items():
+                    await self.storage.append_records(day, records)
+            except Exception as e:
+                from depot import _log_operation  # 避免循環匯入
+
+                _log_operation("ERROR", "批次寫入紀錄失敗", f"{len(batch)} 筆: {e}")
+                for _, _, future in batch:
+                    if future is not None and not future.done():
+                        future.set_exception(e)
+                self._requeue([i for i in batch if i[2] is None])
+                raise
+            except BaseException:
+                self._requeue(batch)  # 被取消: 整批留待 flush
+                raise
+            for _, _, future in batch:
+                if future is not None and not future.done():
+                    future.set_result(None)
+
+    def _requeue(
+        self, batch: list[tuple[str, dict[str, Any], asyncio.Future | None]]
+    ) -> None:
+        """將未寫入的紀錄放回緩衝最前面（保持順序）"""
+        if not batch:
+            return
+        self._pending[:0] = batch
+        self._wakeup.set()
+        if len(self._pending) >= self.max_records:
+            self._full.set()
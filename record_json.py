@@ -0,0 +1,66 @@
+from datetime import datetime
+from typing import Any, Iterable
+from bson import ObjectId, decode_all
+import json
+
+try:  # orjson 為選用套件，未安裝時使用標準 json
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(obj: Any) -> Any:
+    """JSON 無法直接表示的型別: ObjectId → 字串，datetime → ISO 時間"""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"無法轉為 JSON: {type(obj).__name__}")
+
+
+_encode = json.JSONEncoder(  # 預先建立，每批共用
+    ensure_ascii=False, separators=(",", ":"), default=_default
+).encode
+
+
+def encode_records(records: Iterable[dict[str, Any]]) -> bytes:
+    """
+    紀錄 → 以逗號分隔的 JSON 物件（不含外層 []，空列表為 b""）
+
+    Args:
+        records: 紀錄列表
+
+    Returns:
+        bytes: UTF-8 JSON
+    """
+    records = list(records)
+    if orjson is not None:
+        return orjson.dumps(records, default=_default)[1:-1]
+    return _encode(records)[1:-1].encode("utf-8")
+
+
+def decode_batch(raw: bytes) -> list[dict[str, Any]]:
+    """
+    一批串接的 BSON 紀錄（storage.iter_record_batches）→ 紀錄列表\n
+    整批一次交給 bson 的 C 擴充解碼，不經過游標逐筆建立文件
+
+    Args:
+        raw: BSON 位元組
+
+    Returns:
+        list[dict[str, Any]]: 紀錄列表
+    """
+    return decode_all(raw)
+
+
+def encode_batch(raw: bytes) -> bytes:
+    """
+    一批串接的 BSON 紀錄 → 同 encode_records
+
+    Args:
+        raw: BSON 位元組
+
+    Returns:
+        bytes: UTF-8 JSON
+    """
+    return encode_records(decode_batch(raw))
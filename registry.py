@@ -0,0 +1,127 @@
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+import json
+import threading
+
+
+@dataclass(frozen=True, slots=True)
+class ItemTables:
+    """item_id.json 預先計算的查詢表（不可變，整份替換）"""
+
+    config: list[dict[str, Any]] = field(default_factory=list)  # 原始設定
+    esp_map: dict[str, str] = field(default_factory=dict)  # esp 欄位 -> 物品名稱
+    tags: dict[str, dict[str, Any]] = field(default_factory=dict)  # 物品名稱 -> tag
+    names: frozenset[str] = frozenset()  # 所有 ESP 物品名稱
+
+
+@dataclass(frozen=True, slots=True)
+class ItemChanges:
+    """ItemRegistry.reload 的結果"""
+
+    tags: dict[str, dict[str, Any]] = field(default_factory=dict)  # 新增或 tag 變動
+    esp_map_changed: bool = False  # esp 欄位對應變動（新增、改對應或移除物品）
+
+
+class ItemRegistry:
+    """
+    ESP 物品設定 (config/item_id.json)\n
+    - esp_map esp 欄位 → 物品名稱（每幀只需一次字典查詢）\n
+    - tags / names 物品 tag 與名稱\n
+    - reload 檔案變更（mtime 不同）時重新載入，返回 tag 與 esp 欄位對應的變動\n
+    \n
+    查詢表整份預先計算後一次替換，讀取端不會看到更新到一半的狀態；
+    檔案格式錯誤時保留目前的設定。
+    """
+
+    def __init__(self, path: str = "./config/item_id.json") -> None:
+        """
+        Args:
+            path: 設定檔路徑
+        """
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.tables = ItemTables()
+        self._mtime: int | None = None
+        self.reload()
+
+    @property
+    def config(self) -> list[dict[str, Any]]:
+        """原始設定（ReadingTable 使用）"""
+        return self.tables.config
+
+    @property
+    def esp_map(self) -> dict[str, str]:
+        """esp 欄位 → 物品名稱"""
+        return self.tables.esp_map
+
+    @property
+    def tags(self) -> dict[str, dict[str, Any]]:
+        """物品名稱 → tag"""
+        return self.tables.tags
+
+    @property
+    def names(self) -> frozenset[str]:
+        """所有 ESP 物品名稱"""
+        return self.tables.names
+
+    def reload(self) -> ItemChanges:
+        """
+        檔案變更時重新載入
+
+        Returns:
+            ItemChanges: 新增或 tag 變動的物品 {物品: tag} 與 esp 欄位對應是否變動
+
+        Raises:
+            ValueError: 設定檔格式錯誤（目前的設定不變）
+        """
+        with self.lock:
+            try:
+                mtime = self.path.stat().st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime == self._mtime:
+                return ItemChanges()
+            self._mtime = mtime  # 格式錯誤時也只回報一次，等待下次修改
+            config = []
+            if mtime is not None:
+                config = json.loads(self.path.read_text(encoding="utf-8"))
+            tables = _compile(config)
+            previous = self.tables
+            self.tables = tables  # 一次替換
+            return ItemChanges(
+                {
+                    name: tag
+                    for name, tag in tables.tags.items()
+                    if previous.tags.get(name) != tag
+                },
+                tables.esp_map != previous.esp_map,
+            )
+
+
+def item_tag(setting: dict[str, Any]) -> dict[str, Any]:
+    """item_id.json 的 setting → 倉庫 tag"""
+    return {
+        "no_auto_remove": setting.get("no_auto_remove", False),
+        "unit_weight": setting.get("unit_weight", 0),
+        "min_weight_warning": setting.get("min_weight_warning", 0),
+    }
+
+
+def _compile(config: list[dict[str, Any]]) -> ItemTables:
+    """
+    驗證並建立查詢表
+
+    Raises:
+        ValueError: 缺少 name / esp 欄位或 esp 欄位重複
+    """
+    esp_map: dict[str, str] = {}
+    tags: dict[str, dict[str, Any]] = {}
+    for i in config:
+        if "name" not in i or "esp" not in i:
+            raise ValueError(f"item_id.json 項目缺少 name 或 esp: {i}")
+        if i["esp"] in esp_map:
+            raise ValueError(f"item_id.json esp 欄位重複: {i['esp']}")
+        esp_map[i["esp"]] = i["name"]
+        tags[i["name"]] = item_tag(i.get("setting", {}))
+    return ItemTables(config, esp_map, tags, frozenset(tags))
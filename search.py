@@ -0,0 +1,114 @@
+from typing import Any
+import unicodedata
+
+
+class ItemIndex:
+    """
+    物品名稱搜尋索引（記憶體內）\n
+    - search 前綴/子字串搜尋，返回前 k 筆\n
+    - add / remove 增減單一物品\n
+    - rebuild 以完整庫存重建\n
+    - observe 庫存事件訂閱者，依變動事件增量更新\n
+    \n
+    索引方式: 名稱正規化（NFKC、小寫、去空白）後，
+    每個字元與相鄰兩字元各自建立倒排表。中文沒有空白分詞，
+    以單字/雙字切分即可找到 "布管" → 立布管；英數也適用同一套規則。\n
+    \n
+    排序: 完全相同 > 前綴 > 出現位置越前越好 > 名稱越短越好
+    """
+
+    def __init__(self) -> None:
+        self.amounts: dict[str, int] = {}  # 物品名稱 -> 數量
+        self._keys: dict[str, str] = {}  # 物品名稱 -> 正規化名稱
+        self._postings: dict[str, set[str]] = {}  # 單字/雙字 -> 物品名稱
+
+    def __len__(self) -> int:
+        return len(self.amounts)
+
+    def add(self, item: str, amount: int = 0) -> None:
+        """新增物品或更新數量"""
+        self.amounts[item] = amount
+        if item in self._keys:
+            return
+        key = _normalize(item)
+        self._keys[item] = key
+        for gram in _grams(key):
+            self._postings.setdefault(gram, set()).add(item)
+
+    def remove(self, item: str) -> None:
+        """移除物品"""
+        key = self._keys.pop(item, None)
+        self.amounts.pop(item, None)
+        if key is None:
+            return
+        for gram in _grams(key):
+            posting = self._postings.get(gram)
+            if posting is not None:
+                posting.discard(item)
+                if not posting:
+                    del self._postings[gram]
+
+    def rebuild(self, inventory: dict[str, int]) -> None:
+        """以完整庫存重建索引"""
+        self.amounts.clear()
+        self._keys.clear()
+        self._postings.clear()
+        for item, amount in inventory.items():
+            self.add(item, amount)
+
+    async def observe(self, event: dict[str, Any]) -> None:
+        """庫存事件訂閱者: reset 時重建，change 時新增物品/更新數量（removed 時移除）"""
+        if event.get("event") == "reset":
+            self.rebuild(event["items"])
+        elif event.get("event") == "change" and event.get("removed"):
+            self.remove(event["item"])
+        elif event.get("event") == "change":
+            self.add(event["item"], event["amount"])
+
+    def search(self, query: str, limit: int = 10) -> list[dict[str, Any]]:
+        """
+        搜尋物品名稱
+
+        Args:
+            query: 關鍵字（前綴或名稱中的任一段），空字串返回空列表
+            limit: 最多返回筆數
+
+        Returns:
+            list[dict[str, Any]]: [{"item", "amount"}]，依相關度排序
+        """
+        key = _normalize(query)
+        if not key or limit <= 0:
+            return []
+
+        # 以最短的倒排表為起點取交集，再確認確實包含完整關鍵字
+        grams = sorted(
+            {key} if len(key) == 1 else {key[i : i + 2] for i in range(len(key) - 1)},
+            key=lambda g: len(self._postings.get(g, ())),
+        )
+        candidates = set(self._postings.get(grams[0], ()))
+        for gram in grams[1:]:
+            if not candidates:
+                break
+            candidates &= self._postings.get(gram, set())
+
+        ranked = []
+        for item in candidates:
+            name = self._keys[item]
+            position = name.find(key)
+            if position >= 0:
+                ranked.append((name != key, position, len(name), item))
+        ranked.sort()
+        return [
+            {"item": item, "amount": self.amounts[item]}
+            for *_, item in ranked[:limit]
+        ]
+
+
+def _normalize(text: str) -> str:
+    """NFKC（全形轉半形）、小寫、去除空白"""
+    return "".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+def _grams(key: str) -> set[str]:
+    """單字與相鄰兩字"""
+    return set(key) | {key[i : i + 2] for i in range(len(key) - 1)}
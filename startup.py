@@ -0,0 +1,90 @@
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+import sys
+import time
+
+
+class StartupTimer:
+    """
+    啟動時間量測\n
+    - mark 結束目前階段（從上一個 mark 起算）\n
+    - phase 以 with 區塊量測一個階段\n
+    - report / log 各階段耗時與新載入的模組數\n
+    \n
+    需在其他 import 之前建立，才能量到模組載入時間，例如:\n
+      from startup import StartupTimer
+      startup = StartupTimer()
+      import heavy_module
+      startup.mark("imports")
+    \n
+    個別模組的載入時間可用 python -X importtime app.py 細看
+    """
+
+    def __init__(self) -> None:
+        self.origin = time.perf_counter()
+        self.phases: list[dict[str, Any]] = []
+        self._last = self.origin
+        self._modules = len(sys.modules)
+
+    def mark(self, name: str) -> float:
+        """
+        結束目前階段
+
+        Args:
+            name: 階段名稱
+
+        Returns:
+            float: 此階段耗時（毫秒）
+        """
+        now = time.perf_counter()
+        modules = len(sys.modules)
+        elapsed = (now - self._last) * 1000
+        self.phases.append(
+            {
+                "phase": name,
+                "ms": round(elapsed, 1),
+                "modules": modules - self._modules,
+            }
+        )
+        self._last = now
+        self._modules = modules
+        return elapsed
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """量測 with 區塊（區塊前的時間不計入）"""
+        self._last = time.perf_counter()
+        self._modules = len(sys.modules)
+        try:
+            yield
+        finally:
+            self.mark(name)
+
+    def report(self) -> dict[str, Any]:
+        """
+        Returns:
+            dict[str, Any]: {"total_ms", "phases": [{"phase", "ms", "modules"}]}
+        """
+        return {
+            "total_ms": round((self._last - self.origin) * 1000, 1),
+            "phases": list(self.phases),
+        }
+
+    def log(self, output: Callable[[str], Any] | None = None) -> None:
+        """
+        輸出各階段耗時
+
+        Args:
+            output: 輸出函式，預設使用 depot 的 _log_operation（尚未載入 depot 時可傳入 print）
+        """
+        report = self.report()
+        detail = ", ".join(
+            f"{p['phase']} {p['ms']}ms (+{p['modules']} 模組)" for p in report["phases"]
+        )
+        if output is not None:
+            output(f"啟動完成 {report['total_ms']}ms: {detail}")
+            return
+
+        from depot import _log_operation
+
+        _log_operation("INFO", "啟動完成", f"{report['total_ms']}ms: {detail}")
@@ -0,0 +1,1160 @@
+from abc import ABC, abstractmethod
+from bisect import bisect_right, insort
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Iterator
+from bson import ObjectId, encode, json_util
+from pymongo import MongoClient, AsyncMongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import (
+    BulkWriteError,
+    ConnectionFailure,
+    DuplicateKeyError,
+    OperationFailure,
+)
+import copy
+import json
+import os
+import threading
+
+SYSTEM_COLLECTIONS = {  # 非每日紀錄的資料表
+    "inventory",
+    "idempotency",
+    "snapshots",
+    "batches",
+    "events",
+    "counters",
+}
+IDEMPOTENCY_TTL = 24 * 60 * 60  # idempotency key 保存秒數
+NO_TRANSACTIONS = 20  # IllegalOperation: 單機 mongod 不支援交易
+RECORD_BATCH = 1000  # 分批讀取紀錄的每批筆數
+RECORD_FIELDS = {"type": 1, "item": 1, "amount": 1, "time": 1, "source": 1}  # 含 _id
+
+NextAmount = Callable[[str, str, int, int], int]  # (type, item, 目前數量, 數量) -> 新數量
+JOURNAL_TIMEOUT_MS = 2000  # 啟用本地日誌時，判定 MongoDB 斷線的逾時
+
+
+class Storage(ABC):
+    """
+    倉庫儲存介面（同步）\n
+    - 庫存: find_item / list_items / set_amount / seed_item / set_tag / remove_if_empty / clear_inventory\n
+    - 紀錄: append_record / append_records / find_records / record_days / drop_records\n
+    - 分批讀取: iter_record_batches 分批輸出原始 BSON 紀錄（大量輸出用）\n
+    - 交易: write_batch（多筆庫存與紀錄全部成功或全部不寫入）\n
+    - 序號: reserve_seq / last_seq（紀錄的寫入順序，跨行程遞增）\n
+    - 快照: save_snapshot / find_snapshot\n
+    - 重送: insert_key / get_key / store_key_result / release_key\n
+    \n
+    庫存文件格式: {"item": str, "amount": int, "tag": dict, "seq": 最後套用的紀錄序號}\n
+    紀錄文件格式: {"_id", "type", "item", "amount", "time", "source", "seq"}，依日期 (YYYY-MM-DD) 分表\n
+    快照文件格式: {"time": datetime, "seq": int, "items": [{"item", "amount", "seq"}]}
+    """
+
+    # ---- 庫存 ----
+    @abstractmethod
+    def find_item(self, item: str) -> dict[str, Any] | None:
+        """取得單一物品文件"""
+
+    @abstractmethod
+    def list_items(self) -> list[dict[str, Any]]:
+        """取得所有物品文件"""
+
+    @abstractmethod
+    def set_amount(self, item: str, amount: int, seq: int | None = None) -> None:
+        """設定物品數量（與造成此數量的紀錄序號），物品不存在時以空 tag 新增"""
+
+    @abstractmethod
+    def seed_item(self, item: str, amount: int, tag: dict[str, Any]) -> None:
+        """物品不存在時以數量與 tag 新增，已存在時不變（預設物品初始化用）"""
+
+    @abstractmethod
+    def set_tag(self, item: str, tag: dict[str, Any]) -> None:
+        """覆寫物品的 tag"""
+
+    @abstractmethod
+    def remove_if_empty(self, item: str) -> bool:
+        """數量為 0 且未設定 no_auto_remove 時移除物品，返回是否移除"""
+
+    @abstractmethod
+    def clear_inventory(self) -> int:
+        """清空庫存，返回刪除筆數"""
+
+    # ---- 紀錄 ----
+    @abstractmethod
+    def append_record(self, day: str, record: dict[str, Any]) -> Any:
+        """新增一筆紀錄到 day 資料表，返回紀錄 ID"""
+
+    @abstractmethod
+    def append_records(self, day: str, records: list[dict[str, Any]]) -> None:
+        """一次新增多筆紀錄（需已含 _id，重複的 _id 視為已寫入）"""
+
+    @abstractmethod
+    def find_records(self, day: str) -> list[dict[str, Any]]:
+        """取得 day 資料表的所有紀錄"""
+
+    @abstractmethod
+    def record_days(self) -> list[str]:
+        """取得所有紀錄資料表名稱"""
+
+    @abstractmethod
+    def drop_records(self, day: str) -> None:
+        """刪除 day 資料表（封存後釋放空間）"""
+
+    # ---- 交易 ----
+    @abstractmethod
+    def write_batch(
+        self, day: str, records: list[dict[str, Any]], next_amount: NextAmount
+    ) -> list[tuple[Any, int]]:
+        """
+        以單一交易寫入多筆紀錄與對應的庫存數量
+
+        Args:
+            day: 紀錄資料表 (YYYY-MM-DD)
+            records: 紀錄 {"type", "item", "amount", "time", "source"}，依序套用
+            next_amount: 計算新數量，拋出例外時整批不寫入
+
+        Returns:
+            list[tuple[Any, int]]: 每筆紀錄的 (紀錄 ID, 異動後數量)
+        """
+
+    # ---- 序號 ----
+    @abstractmethod
+    def reserve_seq(self, count: int = 1) -> int:
+        """保留 count 個連續的紀錄序號，返回第一個"""
+
+    @abstractmethod
+    def last_seq(self) -> int:
+        """目前已保留的最大序號（尚未保留時為 0）"""
+
+    # ---- 快照 ----
+    @abstractmethod
+    def save_snapshot(self, snapshot: dict[str, Any]) -> None:
+        """保存庫存快照"""
+
+    @abstractmethod
+    def find_snapshot(self, before: datetime) -> dict[str, Any] | None:
+        """取得時間不晚於 before 的最新快照"""
+
+    # ---- 重送 (idempotency) ----
+    @abstractmethod
+    def insert_key(self, key: str) -> bool:
+        """佔用 key，已存在時返回 False"""
+
+    @abstractmethod
+    def get_key(self, key: str) -> dict[str, Any] | None:
+        """取得 key 文件 {"_id", "created", "result"}"""
+
+    @abstractmethod
+    def store_key_result(self, key: str, result: dict[str, Any]) -> None:
+        """保存 key 對應的寫入結果"""
+
+    @abstractmethod
+    def release_key(self, key: str) -> None:
+        """釋放 key（寫入失敗時）"""
+
+    def iter_record_batches(
+        self, day: str, batch_size: int = RECORD_BATCH
+    ) -> Iterator[bytes]:
+        """
+        分批讀取紀錄，每批為串接的 BSON 文件（bson.decode_all 可解碼）\n
+        預設由 find_records 編碼；MongoDB 直接返回伺服器的原始批次，不逐筆解碼成 dict
+        """
+        records = self.find_records(day)
+        for i in range(0, len(records), batch_size):
+            yield b"".join(encode(r) for r in records[i : i + batch_size])
+
+
+class AsyncStorage(ABC):
+    """
+    倉庫儲存介面（非同步），方法同 Storage\n
+    sync 屬性提供同一份資料的同步存取（初始化預設物品用）
+    """
+
+    sync: Storage
+
+    @abstractmethod
+    async def find_item(self, item: str) -> dict[str, Any] | None: ...
+
+    @abstractmethod
+    async def list_items(self) -> list[dict[str, Any]]: ...
+
+    @abstractmethod
+    async def set_amount(
+        self, item: str, amount: int, seq: int | None = None
+    ) -> None: ...
+
+    @abstractmethod
+    async def seed_item(self, item: str, amount: int, tag: dict[str, Any]) -> None: ...
+
+    @abstractmethod
+    async def set_tag(self, item: str, tag: dict[str, Any]) -> None: ...
+
+    @abstractmethod
+    async def remove_if_empty(self, item: str) -> bool: ...
+
+    @abstractmethod
+    async def clear_inventory(self) -> int: ...
+
+    @abstractmethod
+    async def append_record(self, day: str, record: dict[str, Any]) -> Any: ...
+
+    @abstractmethod
+    async def append_records(self, day: str, records: list[dict[str, Any]]) -> None: ...
+
+    @abstractmethod
+    async def find_records(self, day: str) -> list[dict[str, Any]]: ...
+
+    @abstractmethod
+    async def record_days(self) -> list[str]: ...
+
+    @abstractmethod
+    async def drop_records(self, day: str) -> None: ...
+
+    @abstractmethod
+    async def write_batch(
+        self, day: str, records: list[dict[str, Any]], next_amount: NextAmount
+    ) -> list[tuple[Any, int]]: ...
+
+    @abstractmethod
+    async def reserve_seq(self, count: int = 1) -> int: ...
+
+    @abstractmethod
+    async def last_seq(self) -> int: ...
+
+    @abstractmethod
+    async def save_snapshot(self, snapshot: dict[str, Any]) -> None: ...
+
+    @abstractmethod
+    async def find_snapshot(self, before: datetime) -> dict[str, Any] | None: ...
+
+    @abstractmethod
+    async def insert_key(self, key: str) -> bool: ...
+
+    @abstractmethod
+    async def get_key(self, key: str) -> dict[str, Any] | None: ...
+
+    @abstractmethod
+    async def store_key_result(self, key: str, result: dict[str, Any]) -> None: ...
+
+    @abstractmethod
+    async def release_key(self, key: str) -> None: ...
+
+    async def iter_record_batches(
+        self, day: str, batch_size: int = RECORD_BATCH
+    ) -> AsyncIterator[bytes]:
+        """
+        分批讀取紀錄，每批為串接的 BSON 文件（bson.decode_all 可解碼）\n
+        預設由 find_records 編碼；MongoDB 直接返回伺服器的原始批次，不逐筆解碼成 dict
+        """
+        records = await self.find_records(day)
+        for i in range(0, len(records), batch_size):
+            yield b"".join(encode(r) for r in records[i : i + batch_size])
+
+    # ---- 生命週期（應用啟動 / 關閉時呼叫）----
+    async def start(self) -> None:
+        """啟動背景工作（預設無）"""
+
+    async def close(self) -> None:
+        """釋放連線與檔案（預設無）"""
+
+
+def plan_batch(
+    current: dict[str, int], records: list[dict[str, Any]], next_amount: NextAmount
+) -> tuple[list[tuple[Any, int]], dict[str, int], list[dict[str, Any]]]:
+    """
+    依序計算整批紀錄的異動結果（不寫入）
+
+    Args:
+        current: 涉及物品的目前數量（不存在為 0）
+        records: 紀錄列表（已含 seq）
+        next_amount: 計算新數量
+
+    Returns:
+        tuple: (每筆的 (紀錄 ID, 異動後數量), 物品最終數量, 附上 _id 的紀錄文件)
+    """
+    amounts = dict(current)
+    results: list[tuple[Any, int]] = []
+    docs: list[dict[str, Any]] = []
+    for r in records:
+        amounts[r["item"]] = next_amount(
+            r["type"], r["item"], amounts[r["item"]], r["amount"]
+        )
+        doc = {"_id": ObjectId(), **r}
+        docs.append(doc)
+        results.append((doc["_id"], amounts[r["item"]]))
+    return results, amounts, docs
+
+
+def _item_seqs(docs: list[dict[str, Any]]) -> dict[str, int]:
+    """每個物品最後一筆紀錄的序號"""
+    return {d["item"]: d["seq"] for d in docs if d.get("seq") is not None}
+
+
+def batch_ops(
+    day: str, amounts: dict[str, int], docs: list[dict[str, Any]]
+) -> list[dict[str, Any]]:
+    """整批寫入對應的 MemoryStorage 操作（數量與序號、紀錄）"""
+    seqs = _item_seqs(docs)
+    ops = [
+        {"op": "amount", "item": k, "amount": v, "seq": seqs.get(k)}
+        for k, v in amounts.items()
+    ]
+    return ops + [{"op": "record", "day": day, "record": d} for d in docs]
+
+
+def _amount_set(amount: int, seq: int | None) -> dict[str, Any]:
+    """庫存數量的 $set 內容（有序號時一併寫入，與數量在同一次更新中）"""
+    return {"amount": amount} if seq is None else {"amount": amount, "seq": seq}
+
+
+def _batch_doc(
+    day: str,
+    current: dict[str, int],
+    amounts: dict[str, int],
+    docs: list[dict[str, Any]],
+) -> dict[str, Any]:
+    """
+    單機 mongod 的交易暫存文件（先寫入再套用，中斷時由啟動時的 _recover_batches 補完）\n
+    數量以增減量保存，套用時不會覆寫其他行程在這之後寫入的數量
+    """
+    seqs = _item_seqs(docs)
+    return {
+        "_id": ObjectId(),
+        "day": day,
+        "deltas": [
+            {"item": k, "delta": v - current[k], "seq": seqs.get(k)}
+            for k, v in amounts.items()
+        ],
+        "records": docs,
+        "created": datetime.now(timezone.utc),
+    }
+
+
+def _batch_updates(batch: dict[str, Any]) -> list[UpdateOne]:
+    """
+    套用交易暫存文件的數量（可重複執行）:
+    先確保物品存在，再只對序號小於該批序號的物品 $inc，並把物品序號推進到該批的序號
+    """
+    if "amounts" in batch:  # 舊版暫存文件（絕對數量）
+        amounts = {i["item"]: i["amount"] for i in batch["amounts"]}
+        seqs = {i["item"]: i["seq"] for i in batch["amounts"] if i.get("seq")}
+        return _amount_upserts(amounts, seqs)
+
+    updates = []
+    for d in batch["deltas"]:
+        updates.append(
+            UpdateOne(
+                {"item": d["item"]},
+                {"$setOnInsert": {"amount": 0, "tag": {}}},
+                upsert=True,
+            )
+        )
+        if d["seq"] is None:
+            inc = {"$inc": {"amount": d["delta"]}}
+            updates.append(UpdateOne({"item": d["item"]}, inc))
+            continue
+        pending = {"$or": [{"seq": {"$lt": d["seq"]}}, {"seq": {"$exists": False}}]}
+        updates.append(
+            UpdateOne(
+                {"item": d["item"], **pending},
+                {"$inc": {"amount": d["delta"]}, "$set": {"seq": d["seq"]}},
+            )
+        )
+    return updates
+
+
+def _amount_upserts(
+    amounts: dict[str, int], seqs: dict[str, int]
+) -> list[UpdateOne]:
+    """多個物品的數量寫入（bulk_write 一次送出，同 set_amount）"""
+    return [
+        UpdateOne(
+            {"item": item},
+            {
+                "$set": _amount_set(amount, seqs.get(item)),
+                "$setOnInsert": {"tag": {}},
+            },
+            upsert=True,
+        )
+        for item, amount in amounts.items()
+    ]
+
+
+_SEQ_COUNTER = {"_id": "records"}  # counters 資料表中的紀錄序號文件
+
+
+_REMOVABLE = {  # 可自動移除的條件
+    "amount": 0,
+    "$or": [
+        {"tag.no_auto_remove": {"$ne": True}},
+        {"tag.no_auto_remove": {"$exists": False}},
+    ],
+}
+
+
+class MongoStorage(Storage):
+    """MongoDB 儲存（同步）"""
+
+    def __init__(
+        self,
+        addr: str,
+        db_name: str = "depotDB",
+        timeout_ms: int | None = None,
+        setup: bool = True,
+    ) -> None:
+        """
+        Args:
+            addr: MongoDB 位址
+            db_name: 資料庫名稱
+            timeout_ms: 選擇伺服器的逾時毫秒數（None 為 pymongo 預設 30 秒）
+            setup: 是否立即建立索引並補完中斷的交易（False 時不連線，由呼叫端稍後呼叫 setup）
+        """
+        options = {"serverSelectionTimeoutMS": timeout_ms} if timeout_ms else {}
+        self.client = MongoClient(addr, **options)
+        self.db = self.client[db_name]
+        self.inventory = self.db["inventory"]  # 倉庫
+        self.idempotency = self.db["idempotency"]  # 已處理的 idempotency key
+        self.snapshots = self.db["snapshots"]  # 庫存快照
+        self.batches = self.db["batches"]  # 單機 mongod 的交易暫存
+        self.counters = self.db["counters"]  # 紀錄序號
+        self.transactions = True  # 是否支援交易（第一次失敗時自動切換）
+        if setup:
+            self.setup()
+
+    def setup(self) -> None:
+        """建立 TTL / 快照索引並補完中斷的交易（資料庫未啟動時略過，下次啟動再建立）"""
+        try:
+            self.idempotency.create_index(
+                "created", expireAfterSeconds=IDEMPOTENCY_TTL
+            )
+            self.snapshots.create_index("time")
+            self._recover_batches()
+        except ConnectionFailure:
+            pass
+
+    def find_item(self, item: str) -> dict[str, Any] | None:
+        return self.inventory.find_one({"item": item})
+
+    def list_items(self) -> list[dict[str, Any]]:
+        return list(self.inventory.find())
+
+    def set_amount(self, item: str, amount: int, seq: int | None = None) -> None:
+        self.inventory.update_one(
+            {"item": item},
+            {"$set": _amount_set(amount, seq), "$setOnInsert": {"tag": {}}},
+            upsert=True,
+        )
+
+    def seed_item(self, item: str, amount: int, tag: dict[str, Any]) -> None:
+        self.inventory.update_one(
+            {"item": item},
+            {"$setOnInsert": {"amount": amount, "tag": tag}},
+            upsert=True,
+        )
+
+    def set_tag(self, item: str, tag: dict[str, Any]) -> None:
+        self.inventory.update_one({"item": item}, {"$set": {"tag": tag}}, upsert=True)
+
+    def remove_if_empty(self, item: str) -> bool:
+        return self.inventory.delete_one({"item": item, **_REMOVABLE}).deleted_count > 0
+
+    def clear_inventory(self) -> int:
+        return self.inventory.delete_many({}).deleted_count
+
+    def append_record(self, day: str, record: dict[str, Any]) -> Any:
+        return self.db[day].insert_one(record).inserted_id
+
+    def append_records(self, day: str, records: list[dict[str, Any]]) -> None:
+        try:
+            self.db[day].insert_many(records, ordered=False)
+        except BulkWriteError as err:
+            if any(e["code"] != 11000 for e in err.details["writeErrors"]):
+                raise
+
+    def find_records(self, day: str) -> list[dict[str, Any]]:
+        return list(self.db[day].find())
+
+    def iter_record_batches(
+        self, day: str, batch_size: int = RECORD_BATCH
+    ) -> Iterator[bytes]:
+        yield from self.db[day].find_raw_batches(
+            {}, RECORD_FIELDS, batch_size=batch_size
+        )
+
+    def record_days(self) -> list[str]:
+        return [
+            i for i in self.db.list_collection_names() if i not in SYSTEM_COLLECTIONS
+        ]
+
+    def drop_records(self, day: str) -> None:
+        self.db.drop_collection(day)
+
+    def write_batch(
+        self, day: str, records: list[dict[str, Any]], next_amount: NextAmount
+    ) -> list[tuple[Any, int]]:
+        if self.transactions:
+            try:
+                with self.client.start_session() as session:
+                    return session.with_transaction(
+                        lambda s: self._write_batch(day, records, next_amount, s)
+                    )
+            except OperationFailure as err:
+                if err.code != NO_TRANSACTIONS:
+                    raise
+                self.transactions = False
+
+        # 單機 mongod: 先寫入暫存文件，再套用，最後刪除（中斷時於下次啟動補完）
+        current = self._current(records)
+        results, amounts, docs = plan_batch(current, records, next_amount)
+        batch = _batch_doc(day, current, amounts, docs)
+        self.batches.insert_one(batch)
+        self._apply_batch(batch)
+        return results
+
+    def _current(
+        self, records: list[dict[str, Any]], session: Any = None
+    ) -> dict[str, int]:
+        """涉及物品的目前數量（不存在為 0）"""
+        items = {r["item"] for r in records}
+        current = {i: 0 for i in items}
+        for d in self.inventory.find({"item": {"$in": list(items)}}, session=session):
+            current[d["item"]] = d.get("amount", 0)
+        return current
+
+    def _write_batch(
+        self,
+        day: str,
+        records: list[dict[str, Any]],
+        next_amount: NextAmount,
+        session: Any,
+    ) -> list[tuple[Any, int]]:
+        """交易內容（with_transaction 遇到暫時性錯誤時會重新執行）"""
+        results, amounts, docs = plan_batch(
+            self._current(records, session), records, next_amount
+        )
+        self.inventory.bulk_write(
+            _amount_upserts(amounts, _item_seqs(docs)), session=session
+        )
+        self.db[day].insert_many(docs, session=session)
+        return results
+
+    def _apply_batch(self, batch: dict[str, Any]) -> None:
+        """套用交易暫存文件（可重複執行: 數量依序號只增減一次，紀錄依 _id 去重）"""
+        self.inventory.bulk_write(_batch_updates(batch))
+        try:
+            self.db[batch["day"]].insert_many(batch["records"], ordered=False)
+        except BulkWriteError as err:
+            if any(e["code"] != 11000 for e in err.details["writeErrors"]):
+                raise
+        self.batches.delete_one({"_id": batch["_id"]})
+
+    def _recover_batches(self) -> None:
+        """補完上次中斷的交易（只在啟動時執行）"""
+        for batch in self.batches.find().sort("created", 1):
+            self._apply_batch(batch)
+
+    def reserve_seq(self, count: int = 1) -> int:
+        doc = self.counters.find_one_and_update(
+            _SEQ_COUNTER,
+            {"$inc": {"seq": count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return doc["seq"] - count + 1
+
+    def last_seq(self) -> int:
+        return (self.counters.find_one(_SEQ_COUNTER) or {}).get("seq", 0)
+
+    def save_snapshot(self, snapshot: dict[str, Any]) -> None:
+        self.snapshots.insert_one(dict(snapshot))
+
+    def find_snapshot(self, before: datetime) -> dict[str, Any] | None:
+        return self.snapshots.find_one(
+            {"time": {"$lte": before}}, sort=[("time", -1)]
+        )
+
+    def insert_key(self, key: str) -> bool:
+        try:
+            self.idempotency.insert_one(
+                {"_id": key, "created": datetime.now(timezone.utc), "result": None}
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+
+    def get_key(self, key: str) -> dict[str, Any] | None:
+        return self.idempotency.find_one({"_id": key})
+
+    def store_key_result(self, key: str, result: dict[str, Any]) -> None:
+        self.idempotency.update_one({"_id": key}, {"$set": {"result": result}})
+
+    def release_key(self, key: str) -> None:
+        self.idempotency.delete_one({"_id": key})
+
+
+class AsyncMongoStorage(AsyncStorage):
+    """MongoDB 儲存（非同步）"""
+
+    def __init__(
+        self, addr: str, db_name: str = "depotDB", timeout_ms: int | None = None
+    ) -> None:
+        self.sync = MongoStorage(addr, db_name, timeout_ms, setup=False)  # 索引於 start 建立
+        options = {"serverSelectionTimeoutMS": timeout_ms} if timeout_ms else {}
+        self.client = AsyncMongoClient(addr, **options)
+        self.db = self.client[db_name]
+        self.inventory = self.db["inventory"]
+        self.idempotency = self.db["idempotency"]
+        self.snapshots = self.db["snapshots"]
+        self.batches = self.db["batches"]
+        self.counters = self.db["counters"]
+        self.transactions = True
+
+    async def find_item(self, item: str) -> dict[str, Any] | None:
+        return await self.inventory.find_one({"item": item})
+
+    async def list_items(self) -> list[dict[str, Any]]:
+        return [i async for i in self.inventory.find()]
+
+    async def set_amount(
+        self, item: str, amount: int, seq: int | None = None
+    ) -> None:
+        await self.inventory.update_one(
+            {"item": item},
+            {"$set": _amount_set(amount, seq), "$setOnInsert": {"tag": {}}},
+            upsert=True,
+        )
+
+    async def seed_item(self, item: str, amount: int, tag: dict[str, Any]) -> None:
+        await self.inventory.update_one(
+            {"item": item},
+            {"$setOnInsert": {"amount": amount, "tag": tag}},
+            upsert=True,
+        )
+
+    async def set_tag(self, item: str, tag: dict[str, Any]) -> None:
+        await self.inventory.update_one(
+            {"item": item}, {"$set": {"tag": tag}}, upsert=True
+        )
+
+    async def remove_if_empty(self, item: str) -> bool:
+        result = await self.inventory.delete_one({"item": item, **_REMOVABLE})
+        return result.deleted_count > 0
+
+    async def clear_inventory(self) -> int:
+        return (await self.inventory.delete_many({})).deleted_count
+
+    async def append_record(self, day: str, record: dict[str, Any]) -> Any:
+        return (await self.db[day].insert_one(record)).inserted_id
+
+    async def append_records(self, day: str, records: list[dict[str, Any]]) -> None:
+        try:
+            await self.db[day].insert_many(records, ordered=False)
+        except BulkWriteError as err:
+            if any(e["code"] != 11000 for e in err.details["writeErrors"]):
+                raise
+
+    async def find_records(self, day: str) -> list[dict[str, Any]]:
+        return [i async for i in self.db[day].find()]
+
+    async def iter_record_batches(
+        self, day: str, batch_size: int = RECORD_BATCH
+    ) -> AsyncIterator[bytes]:
+        cursor = self.db[day].find_raw_batches({}, RECORD_FIELDS, batch_size=batch_size)
+        async for batch in cursor:
+            yield batch
+
+    async def record_days(self) -> list[str]:
+        return [
+            i
+            for i in await self.db.list_collection_names()
+            if i not in SYSTEM_COLLECTIONS
+        ]
+
+    async def drop_records(self, day: str) -> None:
+        await self.db.drop_collection(day)
+
+    async def write_batch(
+        self, day: str, records: list[dict[str, Any]], next_amount: NextAmount
+    ) -> list[tuple[Any, int]]:
+        if self.transactions:
+            try:
+                async with self.client.start_session() as session:
+                    return await session.with_transaction(
+                        lambda s: self._write_batch(day, records, next_amount, s)
+                    )
+            except OperationFailure as err:
+                if err.code != NO_TRANSACTIONS:
+                    raise
+                self.transactions = False
+
+        # 單機 mongod: 先寫入暫存文件，再套用，最後刪除（中斷時於下次啟動補完）
+        current = await self._current(records)
+        results, amounts, docs = plan_batch(current, records, next_amount)
+        batch = _batch_doc(day, current, amounts, docs)
+        await self.batches.insert_one(batch)
+        await self._apply_batch(batch)
+        return results
+
+    async def _current(
+        self, records: list[dict[str, Any]], session: Any = None
+    ) -> dict[str, int]:
+        """涉及物品的目前數量（不存在為 0）"""
+        items = {r["item"] for r in records}
+        current = {i: 0 for i in items}
+        async for d in self.inventory.find(
+            {"item": {"$in": list(items)}}, session=session
+        ):
+            current[d["item"]] = d.get("amount", 0)
+        return current
+
+    async def _write_batch(
+        self,
+        day: str,
+        records: list[dict[str, Any]],
+        next_amount: NextAmount,
+        session: Any,
+    ) -> list[tuple[Any, int]]:
+        """交易內容（with_transaction 遇到暫時性錯誤時會重新執行）"""
+        results, amounts, docs = plan_batch(
+            await self._current(records, session), records, next_amount
+        )
+        await self.inventory.bulk_write(
+            _amount_upserts(amounts, _item_seqs(docs)), session=session
+        )
+        await self.db[day].insert_many(docs, session=session)
+        return results
+
+    async def _apply_batch(self, batch: dict[str, Any]) -> None:
+        """套用交易暫存文件（可重複執行: 數量依序號只增減一次，紀錄依 _id 去重）"""
+        await self.inventory.bulk_write(_batch_updates(batch))
+        try:
+            await self.db[batch["day"]].insert_many(batch["records"], ordered=False)
+        except BulkWriteError as err:
+            if any(e["code"] != 11000 for e in err.details["writeErrors"]):
+                raise
+        await self.batches.delete_one({"_id": batch["_id"]})
+
+    async def _recover_batches(self) -> None:
+        """補完上次中斷的交易（只在啟動時執行）"""
+        async for batch in self.batches.find().sort("created", 1):
+            await self._apply_batch(batch)
+
+    async def reserve_seq(self, count: int = 1) -> int:
+        doc = await self.counters.find_one_and_update(
+            _SEQ_COUNTER,
+            {"$inc": {"seq": count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return doc["seq"] - count + 1
+
+    async def last_seq(self) -> int:
+        return (await self.counters.find_one(_SEQ_COUNTER) or {}).get("seq", 0)
+
+    async def save_snapshot(self, snapshot: dict[str, Any]) -> None:
+        await self.snapshots.insert_one(dict(snapshot))
+
+    async def find_snapshot(self, before: datetime) -> dict[str, Any] | None:
+        return await self.snapshots.find_one(
+            {"time": {"$lte": before}}, sort=[("time", -1)]
+        )
+
+    async def insert_key(self, key: str) -> bool:
+        try:
+            await self.idempotency.insert_one(
+                {"_id": key, "created": datetime.now(timezone.utc), "result": None}
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def get_key(self, key: str) -> dict[str, Any] | None:
+        return await self.idempotency.find_one({"_id": key})
+
+    async def store_key_result(self, key: str, result: dict[str, Any]) -> None:
+        await self.idempotency.update_one({"_id": key}, {"$set": {"result": result}})
+
+    async def release_key(self, key: str) -> None:
+        await self.idempotency.delete_one({"_id": key})
+
+    async def start(self) -> None:
+        try:
+            await self.idempotency.create_index(
+                "created", expireAfterSeconds=IDEMPOTENCY_TTL
+            )
+            await self.snapshots.create_index("time")
+            await self._recover_batches()
+        except ConnectionFailure:
+            pass  # 資料庫未啟動時略過，下次啟動再建立
+
+    async def close(self) -> None:
+        await self.client.close()
+
+
+class MemoryStorage(Storage):
+    """
+    記憶體儲存（測試、展示、無 mongod 的邊緣部署）\n
+    - 庫存為 dict，紀錄依日期分表並依時間排序 (bisect)\n
+    - 指定 path 時以 append-only JSONL 持久化（含 idempotency key），啟動時重播\n
+    \n
+    注意: 資料只存在於單一行程內，app.py 與 line.py 不會共用
+    """
+
+    def __init__(self, path: str | None = None) -> None:
+        self.items: dict[str, dict[str, Any]] = {}
+        self.records: dict[str, list[tuple[datetime, int, dict[str, Any]]]] = {}
+        self.snapshots: list[tuple[datetime, int, dict[str, Any]]] = []
+        self.keys: dict[str, dict[str, Any]] = {}
+        self.lock = threading.RLock()
+        self._seq = 0  # 同時間紀錄的排序鍵
+        self.record_seq = 0  # 已保留的最大紀錄序號（重播時由紀錄與庫存還原）
+        self._file = None
+
+        if path:
+            file = Path(path)
+            file.parent.mkdir(parents=True, exist_ok=True)
+            if file.exists():
+                self._replay(file)
+            self._file = open(file, "a", encoding="utf-8")
+
+    # ---- 庫存 ----
+    def find_item(self, item: str) -> dict[str, Any] | None:
+        with self.lock:
+            doc = self.items.get(item)
+            return copy.deepcopy(doc) if doc is not None else None
+
+    def list_items(self) -> list[dict[str, Any]]:
+        with self.lock:
+            return copy.deepcopy(list(self.items.values()))
+
+    def set_amount(self, item: str, amount: int, seq: int | None = None) -> None:
+        with self.lock:
+            self._apply({"op": "amount", "item": item, "amount": amount, "seq": seq})
+
+    def seed_item(self, item: str, amount: int, tag: dict[str, Any]) -> None:
+        with self.lock:
+            if item in self.items:
+                return  # 已存在的物品不覆寫（也不寫入檔案）
+            self._apply({"op": "seed", "item": item, "amount": amount, "tag": tag})
+
+    def set_tag(self, item: str, tag: dict[str, Any]) -> None:
+        with self.lock:
+            self._apply({"op": "tag", "item": item, "tag": tag})
+
+    def remove_if_empty(self, item: str) -> bool:
+        with self.lock:
+            doc = self.items.get(item)
+            if (
+                doc is None
+                or doc.get("amount") != 0
+                or doc.get("tag", {}).get("no_auto_remove") is True
+            ):
+                return False
+            self._apply({"op": "remove", "item": item})
+            return True
+
+    def clear_inventory(self) -> int:
+        with self.lock:
+            count = len(self.items)
+            self._apply({"op": "clear"})
+            return count
+
+    # ---- 紀錄 ----
+    def append_record(self, day: str, record: dict[str, Any]) -> Any:
+        with self.lock:
+            record = {"_id": ObjectId(), **record}
+            self._apply({"op": "record", "day": day, "record": record})
+            return record["_id"]
+
+    def append_records(self, day: str, records: list[dict[str, Any]]) -> None:
+        with self.lock:
+            ops = [{"op": "record", "day": day, "record": r} for r in records]
+            self._apply({"op": "batch", "ops": ops})  # 整批寫成一行
+
+    def find_records(self, day: str) -> list[dict[str, Any]]:
+        with self.lock:
+            return [copy.deepcopy(r) for _, _, r in self.records.get(day, [])]
+
+    def record_days(self) -> list[str]:
+        with self.lock:
+            return list(self.records)
+
+    def drop_records(self, day: str) -> None:
+        with self.lock:
+            self._apply({"op": "drop", "day": day})
+
+    # ---- 交易（整批寫成一行，檔案尾端不完整時整批忽略）----
+    def write_batch(
+        self, day: str, records: list[dict[str, Any]], next_amount: NextAmount
+    ) -> list[tuple[Any, int]]:
+        with self.lock:
+            current = {
+                r["item"]: self.items.get(r["item"], {}).get("amount", 0)
+                for r in records
+            }
+            results, amounts, docs = plan_batch(current, records, next_amount)
+            self._apply({"op": "batch", "ops": batch_ops(day, amounts, docs)})
+            return results
+
+    # ---- 序號 ----
+    def reserve_seq(self, count: int = 1) -> int:
+        with self.lock:
+            self.record_seq += count
+            return self.record_seq - count + 1
+
+    def last_seq(self) -> int:
+        with self.lock:
+            return self.record_seq
+
+    # ---- 快照 ----
+    def save_snapshot(self, snapshot: dict[str, Any]) -> None:
+        with self.lock:
+            self._apply({"op": "snapshot", "snapshot": snapshot})
+
+    def find_snapshot(self, before: datetime) -> dict[str, Any] | None:
+        with self.lock:
+            index = bisect_right(self.snapshots, before, key=lambda s: s[0])
+            if index == 0:
+                return None
+            return copy.deepcopy(self.snapshots[index - 1][2])
+
+    # ---- 重送 (與庫存一起持久化，重播後仍可辨識已完成的寫入) ----
+    def insert_key(self, key: str) -> bool:
+        with self.lock:
+            self._expire_keys()
+            if key in self.keys:
+                return False
+            created = datetime.now(timezone.utc)
+            self._apply({"op": "key", "key": key, "created": created})
+            return True
+
+    def get_key(self, key: str) -> dict[str, Any] | None:
+        with self.lock:
+            return copy.deepcopy(self.keys.get(key))
+
+    def store_key_result(self, key: str, result: dict[str, Any]) -> None:
+        with self.lock:
+            if key in self.keys:
+                self._apply({"op": "key_result", "key": key, "result": result})
+
+    def release_key(self, key: str) -> None:
+        with self.lock:
+            if key in self.keys:
+                self._apply({"op": "key_release", "key": key})
+
+    def _expire_keys(self) -> None:
+        """移除過期的 key（對應 Mongo 的 TTL 索引）"""
+        now = datetime.now(timezone.utc)
+        expired = [
+            k
+            for k, v in self.keys.items()
+            if (now - v["created"]).total_seconds() > IDEMPOTENCY_TTL
+        ]
+        for k in expired:
+            del self.keys[k]
+
+    # ---- 變更套用與持久化 ----
+    def _apply(self, op: dict[str, Any], persist: bool = True) -> None:
+        """套用一筆變更，並寫入持久化檔案"""
+        match op["op"]:
+            case "amount":
+                doc = self.items.setdefault(op["item"], {"item": op["item"], "tag": {}})
+                doc["amount"] = op["amount"]
+                if op.get("seq") is not None:
+                    doc["seq"] = op["seq"]
+                    self.record_seq = max(self.record_seq, op["seq"])
+            case "seed":
+                self.items[op["item"]] = {
+                    "item": op["item"],
+                    "amount": op["amount"],
+                    "tag": copy.deepcopy(op["tag"]),
+                }
+            case "tag":
+                doc = self.items.setdefault(op["item"], {"item": op["item"]})
+                doc["tag"] = copy.deepcopy(op["tag"])
+            case "remove":
+                self.items.pop(op["item"], None)
+            case "clear":
+                self.items.clear()
+            case "drop":
+                self.records.pop(op["day"], None)
+            case "key":
+                self.keys[op["key"]] = {
+                    "_id": op["key"],
+                    # json_util 重播時為不含時區的 UTC
+                    "created": op["created"].replace(tzinfo=timezone.utc),
+                    "result": None,
+                }
+            case "key_result":
+                self.keys[op["key"]]["result"] = copy.deepcopy(op["result"])
+            case "key_release":
+                self.keys.pop(op["key"], None)
+            case "record":
+                self._seq += 1
+                record = copy.deepcopy(op["record"])
+                self.record_seq = max(self.record_seq, record.get("seq") or 0)
+                insort(
+                    self.records.setdefault(op["day"], []),
+                    (record["time"], self._seq, record),
+                    key=lambda r: (r[0], r[1]),
+                )
+            case "batch":
+                for sub in op["ops"]:
+                    self._apply(sub, persist=False)
+            case "snapshot":
+                self._seq += 1
+                snapshot = copy.deepcopy(op["snapshot"])
+                self.record_seq = max(self.record_seq, snapshot.get("seq") or 0)
+                insort(
+                    self.snapshots,
+                    (snapshot["time"], self._seq, snapshot),
+                    key=lambda s: (s[0], s[1]),
+                )
+
+        if persist and self._file is not None:
+            self._file.write(json_util.dumps(op, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def _replay(self, file: Path) -> None:
+        """重播持久化檔案（忽略最後一行不完整的寫入）"""
+        with open(file, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    op = json_util.loads(line)
+                except (ValueError, json.JSONDecodeError):
+                    continue
+                self._apply(op, persist=False)
+
+
+class AsyncMemoryStorage(AsyncStorage):
+    """MemoryStorage 的非同步介面（無 I/O，直接呼叫同步版本）"""
+
+    def __init__(self, storage: MemoryStorage) -> None:
+        self.sync = storage
+
+    async def find_item(self, item: str) -> dict[str, Any] | None:
+        return self.sync.find_item(item)
+
+    async def list_items(self) -> list[dict[str, Any]]:
+        return self.sync.list_items()
+
+    async def set_amount(
+        self, item: str, amount: int, seq: int | None = None
+    ) -> None:
+        self.sync.set_amount(item, amount, seq)
+
+    async def seed_item(self, item: str, amount: int, tag: dict[str, Any]) -> None:
+        self.sync.seed_item(item, amount, tag)
+
+    async def set_tag(self, item: str, tag: dict[str, Any]) -> None:
+        self.sync.set_tag(item, tag)
+
+    async def remove_if_empty(self, item: str) -> bool:
+        return self.sync.remove_if_empty(item)
+
+    async def clear_inventory(self) -> int:
+        return self.sync.clear_inventory()
+
+    async def append_record(self, day: str, record: dict[str, Any]) -> Any:
+        return self.sync.append_record(day, record)
+
+    async def append_records(self, day: str, records: list[dict[str, Any]]) -> None:
+        self.sync.append_records(day, records)
+
+    async def find_records(self, day: str) -> list[dict[str, Any]]:
+        return self.sync.find_records(day)
+
+    async def record_days(self) -> list[str]:
+        return self.sync.record_days()
+
+    async def drop_records(self, day: str) -> None:
+        self.sync.drop_records(day)
+
+    async def write_batch(
+        self, day: str, records: list[dict[str, Any]], next_amount: NextAmount
+    ) -> list[tuple[Any, int]]:
+        return self.sync.write_batch(day, records, next_amount)
+
+    async def reserve_seq(self, count: int = 1) -> int:
+        return self.sync.reserve_seq(count)
+
+    async def last_seq(self) -> int:
+        return self.sync.last_seq()
+
+    async def save_snapshot(self, snapshot: dict[str, Any]) -> None:
+        self.sync.save_snapshot(snapshot)
+
+    async def find_snapshot(self, before: datetime) -> dict[str, Any] | None:
+        return self.sync.find_snapshot(before)
+
+    async def insert_key(self, key: str) -> bool:
+        return self.sync.insert_key(key)
+
+    async def get_key(self, key: str) -> dict[str, Any] | None:
+        return self.sync.get_key(key)
+
+    async def store_key_result(self, key: str, result: dict[str, Any]) -> None:
+        self.sync.store_key_result(key, result)
+
+    async def release_key(self, key: str) -> None:
+        self.sync.release_key(key)
+
+
+_memory_storages: dict[str | None, MemoryStorage] = {}  # 同一行程共用同一份記憶體資料
+
+
+def storage_config() -> dict[str, Any]:
+    """
+    讀取儲存設定: config/server_config.json 的 storage 欄位，
+    環境變數 DEPOT_STORAGE_ENGINE 可覆寫引擎（例如 DEPOT_STORAGE_ENGINE=memory python app.py）
+
+    Returns:
+        dict[str, Any]: {"engine": "mongo" | "memory", "file": str | None, "journal": str | None,
+            "archive": str | None, "retention_days": int | None}
+    """
+    try:
+        with open("./config/server_config.json", encoding="utf-8") as f:
+            config = dict(json.load(f).get("storage", {}))
+    except FileNotFoundError:
+        config = {}
+    if os.environ.get("DEPOT_STORAGE_ENGINE"):
+        config["engine"] = os.environ["DEPOT_STORAGE_ENGINE"]
+    return config
+
+
+def create_storage(addr: str, engine: str | None = None) -> Storage:
+    """
+    依設定建立同步儲存
+
+    Args:
+        addr: MongoDB 位址
+        engine: "mongo" / "memory"，預設讀取 storage_config()
+    """
+    config = storage_config()
+    engine = engine or config.get("engine", "mongo")
+    if engine == "memory":
+        file = config.get("file")
+        if file not in _memory_storages:
+            _memory_storages[file] = MemoryStorage(file)
+        return _memory_storages[file]
+    if engine == "mongo":
+        return MongoStorage(addr)
+    raise ValueError(f"未知的儲存引擎: {engine}")
+
+
+def create_async_storage(addr: str, engine: str | None = None) -> AsyncStorage:
+    """依設定建立非同步儲存，參數同 create_storage"""
+    config = storage_config()
+    engine = engine or config.get("engine", "mongo")
+    if engine == "memory":
+        return AsyncMemoryStorage(create_storage(addr, "memory"))  # type: ignore
+    if engine == "mongo":
+        if config.get("journal"):
+            # MongoDB 斷線時改寫本地日誌，縮短逾時以免每筆寫入卡住 30 秒
+            from journal import AsyncJournaledStorage
+
+            return AsyncJournaledStorage(
+                AsyncMongoStorage(addr, timeout_ms=JOURNAL_TIMEOUT_MS),
+                config["journal"],
+            )
+        return AsyncMongoStorage(addr)
+    raise ValueError(f"未知的儲存引擎: {engine}")